@@ -106,10 +106,10 @@ Rs = 0b00000001 # Register select bit
 
 class lcd:
    #initializes objects and lcd
-   def __init__(self):
+   def __init__(self, port=I2CBUS):
       print(f'in LCD')
       try:
-          self.lcd_device = i2c_device(ADDRESS)
+          self.lcd_device = i2c_device(ADDRESS, port)
       except Exception as e:
           print(traceback.format_exc())
           print(e)
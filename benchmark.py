@@ -0,0 +1,411 @@
+"""
+Benchmarks for ServoMaster, run against the simulated I2C bus in i2c_sim.py.
+
+Generates synthetic servo.txt layouts of the given sizes, and for each one measures:
+  how long the file takes to load
+  the cost of one pass of the main loop, with the servos idle and with them all moving
+  the latency from a button being pressed to the first write to the servo board
+  how long the trackplan takes to redraw (if there is a display)
+  memory use
+  bus utilisation
+
+Each layout is run in a fresh process so they do not affect each other.
+Results are written as JSON so runs can be compared across versions.
+
+    python benchmark.py                                  # the default sizes
+    python benchmark.py --sizes 30:3:100 200:50:2000     # servos:io-boards:connectors
+    python benchmark.py --output before.json
+    python benchmark.py --compare before.json after.json
+    python benchmark.py --generate 200:50:2000 > big.txt
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import config
+
+
+DEFAULT_SIZES = ['30:3:100', '100:10:500', '200:50:2000', '500:64:5000']   # The largest that fits on one bus
+UPS_ADDRESS = 0x42
+LCD_ADDRESS = 0x27
+
+
+
+#################################################################################
+# LAYOUT GENERATOR
+
+def parse_size(s):
+    """ Converts "servos:io-boards:connectors" to a tuple of ints; missing values are 0. """
+    parts = [int(n) for n in s.split(':')] + [0, 0]
+    return tuple(parts[:3])
+
+
+def generate_layout(n_servos, n_io_boards=0, n_connectors=0, seed=1):
+    """
+    Gets a synthetic layout as the text of a servo.txt file.
+    Servos are put 16 to a board. Each servo gets an on and off button and an on and off LED
+    while there are pins left on the I/O boards. Points and connectors are scattered over the trackplan,
+    with the connectors in straight runs.
+    """
+    rnd = random.Random(seed)
+    cols = math.floor(config.WIDTH / config.X_SCALE)
+    rows = math.floor(config.HEIGHT / config.Y_SCALE)
+
+    # PCA9685 boards go from 0x40, and the rest of the addresses are used for I/O boards,
+    # which is fine for a simulation even if a real bus could not have that many PCF8575s
+    servo_addrs = [a for a in range(0x40, 0x80) if a not in (0x70, UPS_ADDRESS)]
+    io_addrs = [a for a in range(0x08, 0x78) if a not in (LCD_ADDRESS, UPS_ADDRESS) and a not in servo_addrs[:math.ceil(n_servos / 16)]]
+    n_servo_boards = math.ceil(n_servos / 16)
+    if n_servo_boards > len(servo_addrs) or n_io_boards > len(io_addrs):
+        raise ValueError(f'Too many boards for one bus: at most {len(servo_addrs)} servo boards, and {len(io_addrs)} I/O boards with {n_servo_boards} servo boards')
+
+    lines = ['# Synthetic layout generated by benchmark.py\n']
+    for i in range(n_servo_boards):
+        lines.append(f'S{hex(servo_addrs[i])}\n')
+    for i in range(n_io_boards):
+        lines.append(f'IO{hex(io_addrs[i])}\n')
+    lines.append(f'LCD{hex(LCD_ADDRESS)}\n')
+    lines.append(f'UPS{hex(UPS_ADDRESS)}\n')
+    lines.append('\n\n')
+
+    pins = ((board, pin) for board in range(n_io_boards) for pin in range(16))
+    for i in range(n_servos):
+        off = rnd.randint(40, 80)
+        on = rnd.randint(100, 140)
+        reverse = 'r' if rnd.random() < 0.5 else ''
+        shape = rnd.choice('ABY')
+        x = rnd.randrange(cols)
+        y = rnd.randrange(2, rows - 2)
+        lines.append(f's {i // 16}.{i % 16}, 1000, {off}, 90, {on},[{reverse}{shape} {x}, {y}] Point {i}\n')
+        for prefix in ['l on', 'l off', 'b on', 'b off']:
+            pin = next(pins, None)
+            if pin:
+                lines.append(f'{prefix} {pin[0]}.{pin[1]}\n')
+        lines.append('\n')
+
+    count = 0
+    while count < n_connectors:
+        x = rnd.randrange(cols)
+        y = rnd.randrange(1, rows - 1)
+        for j in range(min(rnd.randint(1, 10), n_connectors - count)):
+            lines.append(f'-c - {(x + j) % cols}, {y}\n')
+            count += 1
+    return ''.join(lines)
+
+
+
+#################################################################################
+# MEASURING
+
+def summary(samples, scale=1000000):
+    """ Mean and percentiles of a list of times in seconds, converted by the scale (to microseconds by default). """
+    if not samples:
+        return None
+    lst = sorted(samples)
+    def pc(p):
+        return round(lst[max(1, round(p / 100 * len(lst))) - 1] * scale, 3)
+    return {
+        'n':len(lst),
+        'mean':round(sum(lst) / len(lst) * scale, 3),
+        'p50':pc(50),
+        'p95':pc(95),
+        'p99':pc(99),
+        'max':round(lst[-1] * scale, 3),
+    }
+
+
+def time_ticks(sm, n):
+    """ Times n calls to tick, returning the times and the bus transactions per tick. """
+    sm.i2c.reset_stats()
+    times = []
+    for _ in range(n):
+        t = time.perf_counter()
+        sm.tick()
+        times.append(time.perf_counter() - t)
+    return times, sm.i2c.transactions / n, sm.i2c.utilisation()
+
+
+def settle(sm, servo):
+    # Puts a servo straight at its off position, without moving
+    servo.set(False)
+    servo.current_angle = servo.target_angle
+    servo.moving = False
+
+
+def button_latency(sm, n):
+    """
+    Presses up to n buttons, each connected to a servo that is currently off, with the main loop
+    running on its own thread as normal, and times how long until the first write to the servo board.
+    """
+    candidates = [b for b in sm.buttons if b.on_servos][:n]
+    latencies = []
+    thread = threading.Thread(target=sm.main_loop, daemon=True)
+    thread.start()
+    for button in candidates:
+        servo = button.on_servos[0]
+        pcf = sm.i2c.device(button.guard.addr)
+        pca = sm.i2c.device(servo.guard.addr)
+        writes = pca.writes[servo.pin_no]
+        pressed = time.perf_counter()
+        pcf.press(button.pin_no)
+        while pca.writes[servo.pin_no] == writes and time.perf_counter() - pressed < 1:
+            time.sleep(0.0001)
+        if pca.writes[servo.pin_no] != writes:
+            latencies.append(pca.last_write[servo.pin_no] - pressed)
+        pcf.release(button.pin_no)
+        time.sleep(0.01)
+        settle(sm, servo)
+    sm.send_request('terminate')
+    thread.join()
+    return latencies
+
+
+def time_trackplan(sm, n):
+    """ Times full and partial redraws of the trackplan, if there is a display to do it on. """
+    try:
+        root = sm.tk.Tk()
+    except sm.TclError as err:
+        return {'skipped':str(err)}
+    root.withdraw()
+    sm.window = root
+    trackplan = sm.TrackPlan(root)
+    full = []
+    partial = []
+    for _ in range(n):
+        t = time.perf_counter()
+        trackplan.redraw(True)
+        root.update()
+        full.append(time.perf_counter() - t)
+    for _ in range(n):
+        for servo in sm.servos:
+            servo.main_colour = None
+        t = time.perf_counter()
+        trackplan.redraw()
+        root.update()
+        partial.append(time.perf_counter() - t)
+    result = {
+        'full_ms':summary(full, 1000),
+        'changed_ms':summary(partial, 1000),
+        'canvas_items':len(trackplan.canvas.find_all()),
+    }
+    root.destroy()
+    return result
+
+
+def run_layout(size, args):
+    """ Runs the benchmarks for one layout; this is done in its own process, see worker. """
+    n_servos, n_io_boards, n_connectors = size
+    config.ON_LINE = False
+    config.SIMULATE = True
+    config.SIM_SETUP = None
+    config.SIM_BUS_FREQUENCY = args.frequency
+    config.SIM_LATENCY = args.latency
+    config.REPORT_SERVO_SWITCHING = False
+    config.SUPPRESS_WARNINGS = True
+    config.SHOW_TRACKPLAN = False
+    config.I2C_STATS = True
+
+    text = generate_layout(n_servos, n_io_boards, n_connectors, args.seed)
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as f:
+        f.write(text)
+        filename = f.name
+
+    # servo.py is chatty, so send its output to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        tracemalloc.start()
+        import servo as sm
+        sm.i2c.realtime = not args.no_realtime
+        base = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        sm.load(filename)
+        load_time = time.perf_counter() - t
+        loaded = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        os.unlink(filename)
+        sm.home_servos()
+        sm.tick()
+
+        idle, idle_transactions, idle_utilisation = time_ticks(sm, args.ticks)
+        for servo in sm.servos:
+            servo.set(True)
+        moving, moving_transactions, moving_utilisation = time_ticks(sm, args.ticks)
+        for servo in sm.servos:
+            settle(sm, servo)
+        sm.tick()
+        latencies = button_latency(sm, args.presses)
+        trackplan = time_trackplan(sm, args.redraws) if not args.no_trackplan else {'skipped':'--no-trackplan'}
+
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        max_rss = None
+
+    return {
+        'version':sm.VERSION,
+        'servos':n_servos,
+        'io_boards':n_io_boards,
+        'connectors':n_connectors,
+        'buttons':len(sm.buttons),
+        'leds':len(sm.leds),
+        'lines':text.count('\n'),
+        'load_ms':round(load_time * 1000, 3),
+        'tick_idle_us':summary(idle),
+        'tick_moving_us':summary(moving),
+        'transactions_per_tick_idle':round(idle_transactions, 2),
+        'transactions_per_tick_moving':round(moving_transactions, 2),
+        'bus_utilisation_idle':round(idle_utilisation, 4),
+        'bus_utilisation_moving':round(moving_utilisation, 4),
+        'button_to_write_ms':summary(latencies, 1000),
+        'latency_trace':[{k:v for k, v in h.items() if k != 'buckets_ms'} for h in sm.tracer.snapshot()],
+        'trackplan':trackplan,
+        'memory':{
+            'layout_kb':round((loaded - base) / 1024, 1),
+            'max_rss_kb':max_rss,
+        },
+    }
+
+
+def worker(size, args):
+    # Entry point in the child process; the result is the last line of stdout
+    result = run_layout(parse_size(size), args)
+    print(json.dumps(result))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """ Runs each layout size in its own process and collects the results. """
+    results = []
+    failed = []
+    for size in args.sizes:
+        print(f'INFO: Benchmarking {size} (servos:io-boards:connectors)...', file=sys.stderr)
+        cmd = [sys.executable, os.path.abspath(__file__), '--worker', size] + passthrough(args)
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode != 0 or not proc.stdout.strip():
+            print(proc.stderr, file=sys.stderr)
+            print(f'ERROR: Benchmark for {size} failed.', file=sys.stderr)
+            lines = proc.stderr.strip().split('\n')
+            failed.append({'size':size, 'error':lines[-1]})
+            continue
+        results.append(json.loads(proc.stdout.strip().split('\n')[-1]))
+
+    versions = [r.pop('version') for r in results]
+    return {
+        'version':versions[0] if versions else None,
+        'commit':git_commit(),
+        'python':platform.python_version(),
+        'platform':platform.platform(),
+        'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'bus_frequency':args.frequency,
+        'realtime_bus':not args.no_realtime,
+        'results':results,
+        'failed':failed,
+    }
+
+
+def passthrough(args):
+    # The options the child process needs
+    lst = ['--frequency', str(args.frequency), '--latency', str(args.latency), '--seed', str(args.seed),
+           '--ticks', str(args.ticks), '--presses', str(args.presses), '--redraws', str(args.redraws)]
+    if args.no_realtime:
+        lst.append('--no-realtime')
+    if args.no_trackplan:
+        lst.append('--no-trackplan')
+    return lst
+
+
+
+#################################################################################
+# COMPARING
+
+COMPARE = [
+    ('load_ms', None),
+    ('tick_idle_us', 'p50'),
+    ('tick_moving_us', 'p50'),
+    ('button_to_write_ms', 'p95'),
+    ('memory', 'layout_kb'),
+]
+
+
+def compare(old, new):
+    """ Prints the main figures side by side for layouts of the same size in two result files. """
+    print(f"{'layout':>16} {'figure':>24} {old.get('commit') or 'old':>10} {new.get('commit') or 'new':>10} {'ratio':>7}")
+    old_results = {(r['servos'], r['io_boards'], r['connectors']):r for r in old['results']}
+    for r in new['results']:
+        key = (r['servos'], r['io_boards'], r['connectors'])
+        if key not in old_results:
+            continue
+        for name, sub in COMPARE:
+            a = old_results[key].get(name)
+            b = r.get(name)
+            if sub:
+                a = a.get(sub) if a else None
+                b = b.get(sub) if b else None
+            if a is None or b is None:
+                continue
+            ratio = f'{b / a:.2f}' if a else '---'
+            label = name + ('.' + sub if sub else '')
+            print(f"{':'.join(str(n) for n in key):>16} {label:>24} {a:>10} {b:>10} {ratio:>7}")
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for ServoMaster, using the simulated I2C bus.')
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='Layouts to try, as servos:io-boards:connectors')
+    parser.add_argument('--output', help='Write the results to this JSON file (otherwise to stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files')
+    parser.add_argument('--generate', metavar='SIZE', help='Just print a layout of this size')
+    parser.add_argument('--frequency', type=int, default=100000, help='Simulated bus clock in Hz')
+    parser.add_argument('--latency', type=float, default=0.0, help='Extra seconds per simulated transaction')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--ticks', type=int, default=200, help='Main loop passes to time')
+    parser.add_argument('--presses', type=int, default=20, help='Button presses to time')
+    parser.add_argument('--redraws', type=int, default=10, help='Trackplan redraws to time')
+    parser.add_argument('--no-realtime', action='store_true', help='Do not make simulated transactions take real time')
+    parser.add_argument('--no-trackplan', action='store_true', help='Skip the trackplan, which needs a display')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args)
+    elif args.generate:
+        sys.stdout.write(generate_layout(*parse_size(args.generate), seed=args.seed))
+    elif args.compare:
+        with open(args.compare[0], encoding='utf-8') as f:
+            old = json.load(f)
+        with open(args.compare[1], encoding='utf-8') as f:
+            new = json.load(f)
+        compare(old, new)
+    else:
+        data = run(args)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            print(f'INFO: Results written to {args.output}', file=sys.stderr)
+        else:
+            print(json.dumps(data, indent=2))
+        if data['failed']:
+            for f in data['failed']:
+                print(f"ERROR: No results for {f['size']}: {f['error']}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
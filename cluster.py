@@ -0,0 +1,160 @@
+"""
+Lets several ServoMaster nodes, each a Pi with its own I2C bus, share one layout.
+
+Every node loads the same servo.txt, which says which node owns each board. A node only
+drives the boards it owns; anything on another node's boards is sent there, and each
+node tells the others about the changes to what it owns, so every node knows the state
+of the whole layout.
+
+Each node listens on its own address and port, as given for it, and connects to each of the others. A node sends on
+the connections it makes, and receives on those made to it, so there is one connection
+each way between every pair. Messages are lines of JSON. Each connection starts with
+
+    {"m":"hello","node":"west","layout":"<hash of servo.txt>"}
+
+so nodes with different layouts refuse to work together, then the state of everything the
+sender owns, then changes as they happen. A message the receiver will not take, because it is
+malformed or asks for something a node should not, is reported and dropped. If a connection fails it is made again, and
+the state sent again; nothing is queued for a node that is not connected.
+
+This module just moves the messages; what they mean is up to the receive and snapshot
+functions given to the Cluster.
+"""
+
+import json
+import queue
+import socket
+import threading
+import time
+
+
+RETRY = 1.0     # Seconds between attempts to connect to a node
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class Peer:
+    """ Another node, and the connection to send to it on, with its own thread. """
+    def __init__(self, cluster, name, host, port):
+        self.cluster = cluster
+        self.name = name
+        self.host = host
+        self.port = port
+        self.queue = queue.SimpleQueue()
+        self.connected = False
+        self.sock = None
+
+    def send(self, data):
+        if self.connected:
+            self.queue.put(data)
+
+    def run(self):
+        reported = False
+        while self.cluster.running:
+            try:
+                self.sock = socket.create_connection((self.host, self.port), timeout=RETRY)
+            except OSError as ex:
+                if not reported:
+                    print(f'WARNING: Cannot connect to node {self.name} at {self.host}:{self.port} ({ex}); will keep trying.')
+                    reported = True
+                time.sleep(RETRY)
+                continue
+            reported = False
+            try:
+                self.sock.settimeout(None)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.sock.sendall(encode({'m':'hello', 'node':self.cluster.name, 'layout':self.cluster.layout}))
+                # Anything that changes from now on is queued, so the snapshot can only be older
+                self.connected = True
+                self.sock.sendall(b''.join(encode(message) for message in self.cluster.snapshot()))
+                print(f'INFO: Connected to node {self.name}')
+                while self.cluster.running:
+                    data = [self.queue.get()]
+                    # Send whatever else has built up at the same time
+                    while not self.queue.empty():
+                        data.append(self.queue.get())
+                    if None in data:
+                        break
+                    self.sock.sendall(b''.join(data))
+            except OSError as ex:
+                print(f'WARNING: Lost the connection to node {self.name} ({ex}); reconnecting.')
+            finally:
+                self.connected = False
+                self.sock.close()
+                while not self.queue.empty():
+                    self.queue.get()
+            time.sleep(RETRY)
+
+
+class Cluster:
+    """
+    This node's connections to the others.
+    nodes maps each node name to (host, port), including this one.
+    receive is called with the name of the node and the message, on a thread for that node,
+    and should raise ValueError if it will not take the message;
+    snapshot should return a list of messages giving the state of everything this node owns.
+    """
+    def __init__(self, name, nodes, layout, receive, snapshot):
+        self.name = name
+        self.layout = layout
+        self.receive = receive
+        self.snapshot = snapshot
+        self.running = False
+        self.peers = {other:Peer(self, other, host, port) for other, (host, port) in nodes.items() if other != name}
+        self.listener = socket.create_server(nodes[name])
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.listen, name='cluster', daemon=True).start()
+        for peer in self.peers.values():
+            threading.Thread(target=peer.run, name=f'node {peer.name}', daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        for peer in self.peers.values():
+            peer.queue.put(None)
+        self.listener.close()
+
+    def send(self, node, message):
+        self.peers[node].send(encode(message))
+
+    def broadcast(self, message):
+        """ Sends the message to every other node; it is encoded once. """
+        data = encode(message)
+        for peer in self.peers.values():
+            peer.send(data)
+
+    def listen(self):
+        while self.running:
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.read, args=(sock,), daemon=True).start()
+
+    def read(self, sock):
+        """ Reads messages from another node until it goes. """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        node = '?'
+        with sock, sock.makefile('rb') as f:
+            try:
+                hello = json.loads(f.readline())
+                node = hello.get('node') if isinstance(hello, dict) else None
+                if node not in self.peers or hello.get('m') != 'hello':
+                    print(f'WARNING: Refused connection from unknown node: {hello}')
+                    return
+                if hello.get('layout') != self.layout:
+                    print(f'ERROR: Node {node} has a different servo.txt, so refusing to work with it.')
+                    return
+                for line in f:
+                    try:
+                        message = json.loads(line)
+                        if not isinstance(message, dict):
+                            raise ValueError('not an object')
+                        self.receive(node, message)
+                    except ValueError as ex:
+                        print(f'WARNING: Ignored a bad message from node {node} ({ex}): {line[:200]!r}')
+            except (OSError, ValueError) as ex:
+                print(f'WARNING: Lost the connection from node {node} ({ex}).')
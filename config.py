@@ -1,4 +1,9 @@
 ON_LINE = True                  # Set to False to test without connecting to I2C
+SIMULATE = True                 # When not ON_LINE, use the simulated I2C bus in i2c_sim.py rather than nothing
+SIM_BUS_FREQUENCY = 100000      # Clock speed of the simulated bus in Hz, which sets how long transactions take
+SIM_LATENCY = 0.0               # Extra time in seconds for every transaction on the simulated bus
+SIM_FAULT_RATE = 0.0            # Fraction of simulated transactions that fail with Errno 121
+SIM_SETUP = None                # Name of a module with a setup(bus) function to script the simulation
 QUIT_WITHOUT_CONFIRM = True     # Set to True to skip the confirmation when quitting
 REPORT_SERVO_SWITCHING = True   # If True requests to change servos is logged to console
 TIME_FACTOR = 20.0               # Globally control servo speed; if a servo has a speed of 1000, this is the number of seconds it will take
@@ -10,12 +15,51 @@ SUPPRESS_WARNINGS = True        # Do not warn if a serno has no LED or button
 DESC_WIDTH = 24                 # The description for servos can be this long
 ANGLE_ADJUST = 5                # Up/down buttons change the angle this much
 SLEEP = 0.001                   # Sleep for this many seconds at the end of each loop
+GUI_FPS = 20                    # Update the GUI this many times a second at most
 
 ON_BATTERY = -200               # When shunt current, in mA, is below this, the RPi is assumed to be on battery
 CHARGING = 200                  # When shunt current, in mA, is above this, the RPi is assumed to be charging
 SHUTDOWN_VOLTAGE = 8.2          # When voltage drops below this, shut down the RPi
+POWER_HYSTERESIS = 0.05         # Report the UPS voltage again once it has moved this much, in volts
 SHUTDOWN_FILE = '/home/f2andy/servo_shutdown.sh'
 
+I2C_BUS = 1                     # Boards are on this bus, /dev/i2c-1, unless servo.txt says otherwise, e.g. S0x40/3
+I2C_SCHEDULER = True            # Do every I2C transaction on a worker for its bus, the most urgent first; see i2c_bus.py
+I2C_DEADLINES = [0.02, 0.1, 1.0]  # Seconds servo frames, indicators, housekeeping can wait before going first
+I2C_STATS = True                # Count transactions, bytes, errors and timings for each I2C device
+I2C_STATS_FILE = 'i2c_stats.json'  # I2C statistics are dumped to this file on exit or from the menu
+I2C_RETRIES = 2                 # Retry a failed I2C transaction this many times if the error looks transient
+I2C_BACKOFF = 0.0005            # Wait this many seconds before the first retry, doubling each time...
+I2C_MAX_BACKOFF = 0.002         # ... up to this many seconds
+I2C_ERROR_BUDGET = 5            # A board with this many errors...
+I2C_ERROR_WINDOW = 10.0         # ... in this many seconds is quarantined
+I2C_PROBE_INTERVAL = 2.0        # Check quarantined boards this often, in seconds
+LATENCY_TRACE = True            # Time each button press through to the servo moving
+LATENCY_FILE = 'latency.json'   # Latencies are dumped to this file on exit or from the menu
+LOG_EVENTS = False              # Print every event (servo moved, button pressed, etc.) for diagnostics
+SEPARATE_GUI = False            # Run the main loop in its own process, sharing its state with the GUI through shared memory
+GUI = True                      # Show the GUI; False (or --headless) to run with just the dashboard, control socket, etc.
+STATUS_FILE = '/run/servomaster/state'  # Live state for monitor.py and other tools; None to not have one
+CONTROL_SOCKET = '/run/servomaster/control'  # Commands can be sent here, see servoctl.py; None to not listen
+ASYNC_ENGINE = False            # Run the buttons, servos, etc. as coroutines, each at its own rate, rather than in one loop
+SERVO_PERIOD = 0.01             # With the async engine, move servos this often, in seconds, while any are moving
+BUTTON_PERIOD = 0.01            # ... read the buttons this often
+FLASHER_PERIOD = 0.1            # ... update flashers this often
+UPS_PERIOD = 1.0                # ... read the UPS this often
+LCD_PERIOD = 0.2                # ... write to the LCD at most this often
+STATUS_PERIOD = 0.05            # ... update the loop count and rate in the status file this often
+STREAM_PORT = 8765              # Stream the state to followers on this TCP port, see streaming.py; 0 for any free port, None to not
+STREAM_HOST = 'localhost'       # Listen on this address; 'localhost' for just this machine, '' for all, e.g. for tablets
+WEB_PORT = 8080                 # Serve the web dashboard on this port, see web.py; 0 for any free port, None to not
+WEB_HOST = 'localhost'          # Listen on this address; 'localhost' for just this machine, '' for all
+NODE = None                     # This node's name, when the layout is shared between several, see cluster.py; or use --node
+NODE_MOVE_INTERVAL = 0.05       # Tell other nodes, and any standby, where a moving servo is at most this often, in seconds
+STANDBY_PORT = None             # A standby can follow on this TCP port, e.g. 8771, see standby.py; None to not allow one
+STANDBY_HOST = ''               # Listen on this address; '' for all
+PRIMARY = None                  # To be a standby, the primary as 'host:port'; or use --standby
+HEARTBEAT_INTERVAL = 0.1        # The primary tells the standby it is there this often, in seconds...
+FAILOVER_TIMEOUT = 0.4          # ... and the standby takes over if it hears nothing for this long
+
 
 # The rest are all for track plan
 SHOW_TRACKPLAN = True
@@ -31,4 +75,7 @@ X_MIRROR = False
 Y_MIRROR = False
 POINT_COLOUR = 'green'
 LINE_COLOUR = 'blue'
+FLASH_COLOUR = 'red'
 LEFT_CLICK_ONLY = True
+TRACKPLAN_FPS = 25              # Moving points are animated at up to this many frames a second
+TRACKPLAN_CACHE = 'trackplan_cache'  # Folder to save the drawn trackplan in, so it is quicker to open; None to not save
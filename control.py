@@ -0,0 +1,100 @@
+"""
+A Unix domain socket for controlling ServoMaster from scripts and test rigs, without the GUI.
+
+Commands are sent one per line, as they would be typed at the command line:
+
+    exit                the same as quitting the GUI
+    <n> <angle>         set servo n to the angle
+    <n> on              turn servo n on
+    <n> off             turn servo n off
+    l<n> on             turn LED n on
+    l<n> off            turn LED n off
+
+Each command gets one line back, "OK" or "ERROR" and why. OK means the command will be
+done on the next pass of the main loop.
+
+Several commands can be sent as a batch, either on one line separated by semicolons,
+or between "begin" and "end" lines. A batch is checked as a whole; if any command is bad
+nothing is done, otherwise they are all done in the same pass of the main loop.
+A batch gets one reply, after it ends; a "begin" within a batch makes it bad.
+
+    0 on; 1 on; l4 off
+    begin
+    0 on
+    1 on
+    end
+
+Connections can stay open for any number of commands; see servoctl.py.
+Only the user ServoMaster runs as, and its group, can connect.
+"""
+
+import os
+import socketserver
+
+
+MODE = 0o660    # Permissions for the socket
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """ Handles one connection, until the client closes it. """
+    def handle(self):
+        batch = None
+        error = None    # Why the batch is bad, which is only said at the end, so it gets one reply
+        for line in self.rfile:
+            line = line.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+            if line.lower() == 'begin':
+                if batch is None:
+                    batch = []
+                else:
+                    error = 'Already in a batch'
+            elif line.lower() == 'end':
+                if batch is None:
+                    self.reply('ERROR Not in a batch')
+                else:
+                    if error:
+                        self.reply(f'ERROR {error}')
+                    else:
+                        self.run(batch)
+                    batch = error = None
+            elif batch is not None:
+                batch.append(line)
+            else:
+                self.run([s.strip() for s in line.split(';') if s.strip()])
+
+    def run(self, commands):
+        try:
+            self.server.execute(commands)
+        except ValueError as ex:
+            self.reply(f'ERROR {ex}')
+        else:
+            self.reply('OK')
+
+    def reply(self, s):
+        self.wfile.write(s.encode('utf-8') + b'\n')
+
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Listens on the socket, with a thread for each connection.
+    The execute function is given a list of commands, and should raise ValueError if any is bad.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, execute):
+        self.path = path
+        self.execute = execute
+        # A socket left behind by an earlier run would stop us binding
+        if os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        super().__init__(path, ControlHandler)
+        os.chmod(path, MODE)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,92 @@
+"""
+A simple publish/subscribe event bus, so the engine can say what has happened
+without knowing who is interested.
+
+The servos, buttons, LEDs, relays, flashers and UPS monitor publish events as their
+state changes; the GUI, the log and anything else subscribe to the kinds they want.
+
+    bus.subscribe(SETTLED, lambda event: print(event.source.id(), 'has settled'))
+    bus.publish(SETTLED, servo, angle=90)
+
+Handlers are called on the thread that publishes, which is usually the main loop,
+so they must be quick and must not touch Tk; the GUI just notes what needs updating.
+"""
+
+import time
+import threading
+import traceback
+
+
+# Event kinds
+MOVE_STARTED = 'move started'        # A servo has started moving; target
+MOVED = 'moved'                      # A servo has moved a step; angle
+SETTLED = 'settled'                  # A servo has reached its target; angle
+PRESSED = 'pressed'                  # A button has been pressed
+RELEASED = 'released'                # A button has been released
+LED_CHANGED = 'LED changed'          # An LED has turned on or off; state
+RELAY_CHANGED = 'relay changed'      # A relay has turned on or off; state
+FLASHER_CHANGED = 'flasher changed'  # A flasher has turned on or off; state
+POWER_STATE = 'power state'          # New reading from the UPS; state, voltage, current, text
+
+KINDS = (MOVE_STARTED, MOVED, SETTLED, PRESSED, RELEASED, LED_CHANGED, RELAY_CHANGED, FLASHER_CHANGED, POWER_STATE)
+
+
+class Event:
+    """ Something that has happened. The data depends on the kind. """
+    __slots__ = ('kind', 'source', 'data', 'time')
+
+    def __init__(self, kind, source, data):
+        self.kind = kind
+        self.source = source
+        self.data = data
+        self.time = time.time()
+
+    def __str__(self):
+        source = self.source.id() if hasattr(self.source, 'id') else self.source
+        return f'{self.kind} {source} {self.data}'
+
+
+class EventBus:
+    """
+    Subscribing is rare and publishing is frequent, so the handlers are kept in tuples
+    that are replaced, not changed, and publishing does not need the lock.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handlers = {}
+
+    def subscribe(self, kind, fn):
+        """ Has the function called with each event of the given kind, or every event if kind is None. """
+        with self.lock:
+            handlers = dict(self.handlers)
+            handlers[kind] = handlers.get(kind, ()) + (fn,)
+            self.handlers = handlers
+
+    def unsubscribe(self, kind, fn):
+        with self.lock:
+            handlers = dict(self.handlers)
+            handlers[kind] = tuple(h for h in handlers.get(kind, ()) if h != fn)
+            self.handlers = handlers
+
+    def publish(self, kind, source=None, **data):
+        """ Tells everyone interested. An error in a handler is reported, but does not stop the others. """
+        handlers = self.handlers
+        fns = handlers.get(kind, ()) + handlers.get(None, ())
+        if not fns:
+            return
+        event = Event(kind, source, data)
+        for fn in fns:
+            try:
+                fn(event)
+            except Exception:
+                print(traceback.format_exc())
+                print(f'ERROR: Handler for "{kind}" event failed; carrying on.')
+
+
+def log(event):
+    """ A handler that prints the event, for diagnostics. """
+    print(f'EVENT: {event}')
+
+
+# The one everything uses
+bus = EventBus()
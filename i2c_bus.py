@@ -0,0 +1,260 @@
+"""
+Lets the boards be spread over several I2C buses, such as /dev/i2c-1 and /dev/i2c-3, so the
+layout is not limited to what one bus can carry, and decides the order things are done on each.
+
+Each bus has a worker thread of its own, which does the transactions on that bus in turn.
+The main loop still works out what to do, as it always has. While it is moving servos,
+updating flashers, etc., it does so inside together(), and writes to a board are queued for
+the worker for the board's bus rather than done there and then, so all the buses are busy at
+once; at the end it waits for them all to finish. Reads go the other way: each bus's worker
+reads its share, all at the same time, and the main loop acts on the results.
+
+With config.I2C_SCHEDULER, every transaction goes through the worker, even with one bus, and
+the worker does not just take them in turn. Each is in one of four classes:
+
+    input           button reads, and relays, which should follow the points without delay
+    servo           servo frames
+    indicator       LEDs and flashers
+    housekeeping    the LCD and UPS
+
+Input always goes first: there is little of it, and it is what the layout is waiting on. Of the
+rest, the worker takes the highest class waiting, and within a class takes each board in turn, so
+a busy board cannot hold up the rest. Each class has a deadline (config.I2C_DEADLINES), and
+anything that has waited longer than that goes first, so nothing waits for ever. Writes are not
+waited for, so the main loop can go back to reading the buttons while the servo frames are still
+going out; a button read then only waits for the transaction in progress. The main loop waits
+for the last frames to go before working out the next (see drain), so it keeps pace with the bus.
+A write to a servo, the LCD, etc. that has not gone yet is replaced by the next, rather than
+queued behind it, so anything else that cannot keep up drops stale writes instead of falling
+further behind.
+
+The depth of each queue, and how long things waited, can be seen with stats().
+"""
+
+import threading
+import time
+import traceback
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+import config
+import i2c_stats
+
+
+INPUT, SERVO, INDICATOR, HOUSEKEEPING = range(4)
+CLASSES = ('input', 'servo', 'indicator', 'housekeeping')
+PRIORITIES = {
+    i2c_stats.BUTTON_READ:INPUT,
+    i2c_stats.RELAY_WRITE:INPUT,
+    i2c_stats.SERVO_WRITE:SERVO,
+    i2c_stats.LED_WRITE:INDICATOR,
+    i2c_stats.LCD_WRITE:HOUSEKEEPING,
+    i2c_stats.UPS_READ:HOUSEKEEPING,
+}
+
+
+class Job:
+    __slots__ = ('fn', 'board', 'key', 'future', 'queued', 'deadline')
+
+    def __init__(self, fn, board, key, future, queued, deadline):
+        self.fn = fn
+        self.board = board
+        self.key = key
+        self.future = future
+        self.queued = queued
+        self.deadline = deadline
+
+
+class ClassStats:
+    """ How one class of transaction is doing on one bus. """
+    def __init__(self):
+        self.depth = 0
+        self.max_depth = 0
+        self.done = 0
+        self.replaced = 0
+        self.overdue = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self):
+        return {
+            'depth':self.depth,
+            'max_depth':self.max_depth,
+            'done':self.done,
+            'replaced':self.replaced,
+            'overdue':self.overdue,
+            'mean_wait_ms':round(self.total_wait / self.done * 1000, 3) if self.done else 0.0,
+            'max_wait_ms':round(self.max_wait * 1000, 3),
+        }
+
+
+class Bus:
+    """ One I2C bus, given its number and the bus object the drivers use, with its worker. """
+    def __init__(self, number, i2c):
+        self.number = number
+        self.i2c = i2c
+        self.scheduled = config.I2C_SCHEDULER
+        self.gathering = False      # True while writes are being queued, see together
+        self.lock = threading.Condition()
+        # For each class, each board with something waiting, in the order they get a turn
+        self.queues = [OrderedDict() for c in CLASSES]
+        self.keyed = {}             # Key to the write waiting for it, so a later one can replace it
+        self.waiting = 0
+        self.busy = False
+        self.class_stats = [ClassStats() for c in CLASSES]
+        self.thread = None
+
+    def __str__(self):
+        return f'bus {self.number}'
+
+    def on_worker(self):
+        return threading.current_thread() is self.thread
+
+    def submit(self, op, board, fn, key=None):
+        """
+        Has the worker call the function; gets a Future for the result. Anything waiting with
+        the key is not replaced by later writes, as those would then go before this.
+        """
+        future = Future()
+        with self.lock:
+            if key is not None:
+                self.keyed.pop(key, None)
+            self.add(op, board, fn, None, future)
+        return future
+
+    def queue(self, op, board, fn, key=None, replace=True):
+        """
+        Has the worker call the function, without waiting for it. If something with the same key
+        is still waiting, it is replaced, keeping its place, unless replace is False, when this
+        goes after it, and nothing later replaces either.
+        """
+        with self.lock:
+            if key is not None and not replace:
+                self.keyed.pop(key, None)
+                key = None
+            job = self.keyed.get(key) if key is not None else None
+            if job:
+                job.fn = fn
+                self.class_stats[PRIORITIES.get(op, HOUSEKEEPING)].replaced += 1
+            else:
+                self.add(op, board, fn, key, None)
+
+    def add(self, op, board, fn, key, future):
+        c = PRIORITIES.get(op, HOUSEKEEPING)
+        now = time.perf_counter()
+        job = Job(fn, board, key, future, now, now + config.I2C_DEADLINES[c - 1] if c != INPUT else now)
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, name=f'i2c-{self.number}', daemon=True)
+                self.thread.start()
+            self.queues[c].setdefault(board, deque()).append(job)
+            if key is not None:
+                self.keyed[key] = job
+            stats = self.class_stats[c]
+            stats.depth += 1
+            if stats.depth > stats.max_depth:
+                stats.max_depth = stats.depth
+            self.waiting += 1
+            self.lock.notify_all()
+
+    def take(self):
+        """ Gets the next job, and its class. Call under the lock, with something waiting. """
+        now = time.perf_counter()
+        # After input, anything past its deadline goes first, the most overdue first
+        late = None
+        if not self.queues[INPUT]:
+            for c, queues in enumerate(self.queues):
+                for jobs in queues.values():
+                    if jobs[0].deadline < now and (not late or jobs[0].deadline < late[1].deadline):
+                        late = (c, jobs[0])
+        if late:
+            c, job = late
+            self.class_stats[c].overdue += 1
+        else:
+            c = next(c for c, queues in enumerate(self.queues) if queues)
+            job = next(iter(self.queues[c].values()))[0]
+        # Take it, and send the board to the back of the queue for its class
+        queues = self.queues[c]
+        jobs = queues.pop(job.board)
+        jobs.popleft()
+        if jobs:
+            queues[job.board] = jobs
+        if job.key is not None and self.keyed.get(job.key) is job:
+            del self.keyed[job.key]
+        self.waiting -= 1
+        stats = self.class_stats[c]
+        stats.depth -= 1
+        stats.done += 1
+        wait = now - job.queued
+        stats.total_wait += wait
+        if wait > stats.max_wait:
+            stats.max_wait = wait
+        return job
+
+    def run(self):
+        while True:
+            with self.lock:
+                self.busy = False
+                self.lock.notify_all()
+                while not self.waiting:
+                    self.lock.wait()
+                job = self.take()
+                self.busy = True
+            try:
+                result = job.fn()
+            except Exception as ex:
+                if job.future:
+                    job.future.set_exception(ex)
+                else:
+                    print(traceback.format_exc())
+                    print(f'ERROR: Failed on I2C {self}; carrying on.')
+            else:
+                if job.future:
+                    job.future.set_result(result)
+
+    def finish(self):
+        """ Waits for everything queued to be done. """
+        with self.lock:
+            while self.waiting or self.busy:
+                self.lock.wait()
+
+    def drain(self, c):
+        """ Waits until nothing of the class is waiting, so the main loop cannot get ahead of the bus. """
+        with self.lock:
+            while self.class_stats[c].depth:
+                self.lock.wait()
+
+    def stats(self):
+        """ Gets a list of dictionaries, one for each class. """
+        with self.lock:
+            return [dict(bus=self.number, priority=name, **s.as_dict()) for name, s in zip(CLASSES, self.class_stats)]
+
+    def reset_stats(self):
+        with self.lock:
+            for c, old in enumerate(self.class_stats):
+                self.class_stats[c] = ClassStats()
+                self.class_stats[c].depth = self.class_stats[c].max_depth = old.depth
+
+
+class together:
+    """
+    Within "with together(buses):", writes to boards on each bus are queued for its worker,
+    and at the end waited for. Does nothing if there is only one bus, or with the scheduler,
+    which queues writes anyway, and does not wait for them.
+    """
+    def __init__(self, buses):
+        self.buses = buses if len(buses) > 1 and not config.I2C_SCHEDULER else []
+        self.started = []
+
+    def __enter__(self):
+        # If already gathering, whoever started it will wait
+        self.started = [bus for bus in self.buses if not bus.gathering]
+        for bus in self.started:
+            bus.gathering = True
+        return self
+
+    def __exit__(self, *args):
+        for bus in self.started:
+            bus.gathering = False
+        for bus in self.started:
+            bus.finish()
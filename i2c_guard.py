@@ -0,0 +1,203 @@
+"""
+Fault-tolerant access to I2C boards.
+
+Each board gets a BoardGuard, and all access to the board goes through it.
+Transient errors (Errno 5, 121, etc.) are retried a couple of times with a short,
+bounded backoff. Errors are counted against a budget for the board, and if the
+board keeps failing it is quarantined: further calls return at once without
+touching the bus, so every other board carries on at full rate.
+
+A background thread probes quarantined boards, and when one responds again
+it is released and put on the "recovered" queue so the main loop can send it
+its current state.
+
+Nothing here raises an OSError or sleeps for more than a few milliseconds.
+"""
+
+import errno
+import time
+import threading
+import queue
+from functools import partial
+from collections import deque
+
+import config
+from i2c_stats import stats
+
+
+TRANSIENT_ERRORS = (errno.EIO, getattr(errno, 'EREMOTEIO', 121), errno.ETIMEDOUT, errno.EAGAIN)
+PROBE = 'probe'
+
+recovered = queue.SimpleQueue()  # Guards for boards that have come out of quarantine
+guards = []
+
+
+class BoardGuard:
+    """
+    Guards one board, given its address, a name for reporting,
+    and a function that will read something harmless from the board to see if it is working.
+    """
+    def __init__(self, addr, name, probe=None):
+        self.addr = addr
+        self.name = name
+        self.probe = probe
+        self.quarantined = False
+        self.quarantined_at = None
+        self.errors = deque()    # times of recent errors
+        self.total_errors = 0
+        self.retries = 0
+        self.skipped = 0
+        self.last_error = None
+        self.bus = None         # The Bus it is on, see i2c_bus.py
+        guards.append(self)
+
+    def __str__(self):
+        return f'{self.name} {hex(self.addr)}'
+
+    def call(self, op, fn, *args, nbytes=None, default=None):
+        """
+        Calls the function with the given arguments, timed for the statistics,
+        retrying transient errors. Returns what the function returns,
+        or the default if it failed or the board is quarantined.
+        With the scheduler, it is done by the worker for the bus, see i2c_bus.py, and waited for.
+        """
+        if self.bus and self.bus.scheduled and not self.bus.on_worker():
+            return self.bus.submit(op, self, partial(self.call, op, fn, *args, nbytes=nbytes, default=default)).result()
+        if self.quarantined:
+            self.skipped += 1
+            return default
+
+        backoff = config.I2C_BACKOFF
+        for attempt in range(config.I2C_RETRIES + 1):
+            try:
+                with stats.timed(self.addr, op, nbytes):
+                    return fn(*args)
+            except OSError as err:
+                self.last_error = err
+                if err.errno not in TRANSIENT_ERRORS or attempt == config.I2C_RETRIES:
+                    break
+                self.retries += 1
+                time.sleep(backoff)
+                backoff = min(backoff * 2, config.I2C_MAX_BACKOFF)
+
+        self._failed()
+        return default
+
+    def read(self, op, obj, attr, default=None):
+        """ Reads an attribute of a driver object, such as the value of a pin. """
+        return self.call(op, getattr, obj, attr, default=default)
+
+    def write(self, op, obj, attr, value, wait=False, done=None):
+        """
+        Sets an attribute of a driver object. Returns True if it worked,
+        or if the bus queues writes, see i2c_bus.py, if it has been queued,
+        unless wait is True, when it is always done first, so the result can be checked.
+        A write of None, such as to turn a servo off, is never replaced by a later one.
+        done, if given, is called once the write has reached the board; see send.
+        """
+        if not wait:
+            return self.send(op, _setattr, obj, attr, value, key=(obj, attr), replace=value is not None, done=done)
+        fn = partial(self.sent, op, _setattr, (obj, attr, value), None, done)
+        if self.bus and (self.bus.gathering or self.bus.scheduled) and not self.bus.on_worker():
+            return self.bus.submit(op, self, fn, key=(obj, attr)).result()
+        return fn()
+
+    def send(self, op, fn, *args, nbytes=None, key=None, replace=True, done=None):
+        """
+        Calls the function, as call, for something that needs nothing back. If the bus queues
+        writes, it is queued, and True returned; see Bus.queue for the key.
+        done, if given, is called with no arguments once the call has worked, which for a
+        queued write is on the worker, when it is actually done. If the write is replaced
+        by a later one before it goes, that one's is called instead.
+        """
+        fn = partial(self.sent, op, fn, args, nbytes, done)
+        if self.bus and (self.bus.gathering or self.bus.scheduled) and not self.bus.on_worker():
+            self.bus.queue(op, self, fn, key, replace)
+            return True
+        return fn()
+
+    def sent(self, op, fn, args, nbytes, done):
+        # Does the call for send, and calls done if it worked
+        if not self.call(op, fn, *args, nbytes=nbytes, default=False):
+            return False
+        if done:
+            done()
+        return True
+
+    def _failed(self):
+        # Counts an error against the budget, and quarantines the board if it is used up
+        now = time.time()
+        self.total_errors += 1
+        self.errors.append(now)
+        while self.errors and self.errors[0] < now - config.I2C_ERROR_WINDOW:
+            self.errors.popleft()
+        print(f'ERROR: I2C error on {self}: {self.last_error}')
+        if len(self.errors) >= config.I2C_ERROR_BUDGET:
+            self.quarantine()
+
+    def quarantine(self):
+        if self.quarantined:
+            return
+        self.quarantined = True
+        self.quarantined_at = time.time()
+        print(f'WARNING: Too many errors on {self}; ignoring it until it responds again.')
+        print('This may be because there is no ground connection to the board on the I2C side')
+        Prober.start()
+
+    def release(self):
+        self.quarantined = False
+        self.quarantined_at = None
+        self.errors.clear()
+        print(f'INFO: {self} is responding again.')
+        recovered.put(self)
+
+    def try_probe(self):
+        """ Returns True if the board responds. Does not count against the budget. """
+        if not self.probe:
+            return False
+        if self.bus and self.bus.scheduled and not self.bus.on_worker():
+            return self.bus.submit(PROBE, self, self.try_probe).result()
+        try:
+            with stats.timed(self.addr, PROBE, 0):
+                self.probe()
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def status(self):
+        """ Gets a short description of the state for the GUI. """
+        if self.quarantined:
+            return f'{self}: quarantined for {round(time.time() - self.quarantined_at)} s'
+        return f'{self}: {self.total_errors} error(s), {self.retries} retries'
+
+
+def _setattr(obj, attr, value):
+    # setattr returns None, so this is to let BoardGuard.write tell success from failure
+    setattr(obj, attr, value)
+    return True
+
+
+def quarantined():
+    """ Gets a list of the guards that are currently quarantined. """
+    return [guard for guard in guards if guard.quarantined]
+
+
+class Prober:
+    """
+    The background thread that checks quarantined boards.
+    Started when the first board is quarantined, and runs until the program ends.
+    """
+    thread = None
+
+    def start():
+        if Prober.thread:
+            return
+        Prober.thread = threading.Thread(target=Prober.run, daemon=True)
+        Prober.thread.start()
+
+    def run():
+        while True:
+            time.sleep(config.I2C_PROBE_INTERVAL)
+            for guard in quarantined():
+                if guard.try_probe():
+                    guard.release()
@@ -0,0 +1,654 @@
+"""
+A simulated I2C bus, with models of the boards ServoMaster uses, so the software
+can be run, timed and tested on a machine with no hardware.
+
+SimBus looks like the bus object from board.I2C() (try_lock, unlock, scan, writeto,
+readfrom_into, writeto_then_readfrom), and the models respond to register-level
+transactions much as the real chips do:
+
+  PCA9685Model  - servo board; 256 registers with auto-increment, prescaler, LEDn ON/OFF
+  PCF8575Model  - I/O board; 16-bit port, quasi-bidirectional pins, INT output
+  INA219Model   - UPS monitor; bus voltage and current can follow scripted curves
+  HD44780Model  - LCD on a PCF8574 backpack, driven four bits at a time
+
+Each model can be given a latency per transaction and faults can be injected,
+either at random or on demand. The bus works out how long each transaction would
+take at the given clock speed, and if realtime is set actually takes that long,
+so timings of the real code paths are sensible.
+
+The rest of the file has drivers with the same interface as the ones servo.py uses
+on-line (ServoKit, PCF8575, INA219, I2C_LCD_driver.lcd), but talking to the
+simulated bus.
+"""
+
+import time
+import errno
+import random
+import threading
+
+
+#################################################################################
+# THE BUS
+
+class SimBus:
+    """
+    A simulated I2C bus. Attach device models to it, then use it as you would board.I2C().
+    The frequency is the clock speed in Hz; each byte, including the address,
+    takes nine clock cycles.
+    """
+    def __init__(self, frequency=100000, realtime=True):
+        self.frequency = frequency
+        self.realtime = realtime
+        self.devices = {}
+        self.lock = threading.RLock()
+        self.start_time = time.perf_counter()
+        self.busy = 0.0              # seconds the bus has been in use
+        self.transactions = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def attach(self, device):
+        """ Adds a device model to the bus, and returns it. """
+        self.devices[device.addr] = device
+        device.bus = self
+        return device
+
+    def device(self, addr):
+        return self.devices.get(addr)
+
+    # The busio interface
+
+    def try_lock(self):
+        return self.lock.acquire(blocking=False)
+
+    def unlock(self):
+        self.lock.release()
+
+    def scan(self):
+        return sorted(addr for addr, device in self.devices.items() if device.acks_address())
+
+    def writeto(self, addr, buffer, *, start=0, end=None):
+        data = bytes(buffer[start:end])
+        with self.lock:
+            device = self._begin(addr, len(data))
+            device.write(data)
+
+    def readfrom_into(self, addr, buffer, *, start=0, end=None):
+        if end is None:
+            end = len(buffer)
+        with self.lock:
+            device = self._begin(addr, end - start)
+            buffer[start:end] = device.read(end - start)
+
+    def writeto_then_readfrom(self, addr, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        data = bytes(buffer_out[out_start:out_end])
+        if in_end is None:
+            in_end = len(buffer_in)
+        with self.lock:
+            # Repeated start, so one address byte for each half
+            device = self._begin(addr, len(data) + 1 + in_end - in_start)
+            device.write(data)
+            buffer_in[in_start:in_end] = device.read(in_end - in_start)
+
+    # Timing and statistics
+
+    def _begin(self, addr, nbytes):
+        # Charges the bus for the transaction, and raises an OSError if it should fail
+        device = self.devices.get(addr)
+        duration = 9 * (nbytes + 1) / self.frequency
+        if device:
+            duration += device.latency
+        self.transactions += 1
+        self.bytes += nbytes
+        self.busy += duration
+        if self.realtime:
+            _wait(duration)
+        if not device or not device.acks_address():
+            self.errors += 1
+            raise OSError(errno.EREMOTEIO, 'Remote I/O error')
+        error = device.fault()
+        if error:
+            self.errors += 1
+            raise OSError(error, 'Simulated I2C fault')
+        device.transactions += 1
+        return device
+
+    def utilisation(self):
+        """ Gets the fraction of time since the start (or reset) the bus has been in use. """
+        elapsed = time.perf_counter() - self.start_time
+        return self.busy / elapsed if elapsed > 0 else 0.0
+
+    def reset_stats(self):
+        self.start_time = time.perf_counter()
+        self.busy = 0.0
+        self.transactions = 0
+        self.bytes = 0
+        self.errors = 0
+
+
+def _wait(duration):
+    # time.sleep is no good for fractions of a millisecond, so spin, giving other threads a go
+    end = time.perf_counter() + duration
+    if duration > 0.002:
+        time.sleep(duration - 0.001)
+    while time.perf_counter() < end:
+        time.sleep(0)
+
+
+
+#################################################################################
+# DEVICE MODELS
+
+class SimDevice:
+    """
+    Superclass for device models.
+    latency is extra time in seconds for each transaction.
+    fault_rate is the chance (0 to 1) any transaction fails with fault_errno.
+    If present is False the device does not respond at all.
+    If grounded is False the device answers a scan but every transaction fails with Errno 5,
+    which is what a board with no ground connection on the I2C side does.
+    """
+    def __init__(self, addr, latency=0.0, fault_rate=0.0, fault_errno=errno.EREMOTEIO):
+        self.addr = addr
+        self.bus = None
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.fault_errno = fault_errno
+        self.present = True
+        self.grounded = True
+        self.failures = []        # errnos for the next few transactions to fail with
+        self.transactions = 0
+
+    def acks_address(self):
+        return self.present
+
+    def fail_next(self, n=1, err=errno.EREMOTEIO):
+        """ Makes the next n transactions fail. """
+        self.failures.extend([err] * n)
+
+    def fault(self):
+        # Gets the errno for this transaction if it is to fail, or None
+        if not self.grounded:
+            return errno.EIO
+        if self.failures:
+            return self.failures.pop(0)
+        if self.fault_rate and random.random() < self.fault_rate:
+            return self.fault_errno
+        return None
+
+    def write(self, data):
+        pass
+
+    def read(self, n):
+        return bytes(n)
+
+
+class PCA9685Model(SimDevice):
+    """
+    Model of a PCA9685 PWM board. Only the register behaviour is modelled:
+    a write sets the register pointer then writes from there, and reads come from
+    the pointer. The pointer moves on after each byte only if auto-increment (AI)
+    is set in MODE1.
+    """
+    MODE1 = 0x00
+    MODE2 = 0x01
+    LED0_ON_L = 0x06
+    ALL_LED_ON_L = 0xFA
+    PRESCALE = 0xFE
+    AI = 0x20
+    SLEEP = 0x10
+    OSC = 25000000
+
+    def __init__(self, addr, **kwargs):
+        super().__init__(addr, **kwargs)
+        self.regs = bytearray(256)
+        self.regs[PCA9685Model.MODE1] = 0x11
+        self.regs[PCA9685Model.MODE2] = 0x04
+        self.regs[PCA9685Model.PRESCALE] = 0x1E
+        for ch in range(16):
+            # LEDn_OFF_H bit 4 - full off
+            self.regs[PCA9685Model.LED0_ON_L + 4 * ch + 3] = 0x10
+        self.pointer = 0
+        self.writes = [0] * 16    # number of transactions that touched each channel
+        self.last_write = [None] * 16
+
+    def write(self, data):
+        if not data:
+            return
+        self.pointer = data[0]
+        for b in data[1:]:
+            self._set(self.pointer, b)
+            if self.regs[PCA9685Model.MODE1] & PCA9685Model.AI:
+                self.pointer = (self.pointer + 1) & 0xFF
+        if len(data) > 1 and PCA9685Model.LED0_ON_L <= data[0] < PCA9685Model.LED0_ON_L + 64:
+            ch = (data[0] - PCA9685Model.LED0_ON_L) // 4
+            self.writes[ch] += 1
+            self.last_write[ch] = time.perf_counter()
+
+    def _set(self, reg, b):
+        # The prescaler can only be set while asleep
+        if reg == PCA9685Model.PRESCALE and not self.regs[PCA9685Model.MODE1] & PCA9685Model.SLEEP:
+            return
+        self.regs[reg] = b
+
+    def read(self, n):
+        data = bytearray()
+        for _ in range(n):
+            data.append(self.regs[self.pointer])
+            if self.regs[PCA9685Model.MODE1] & PCA9685Model.AI:
+                self.pointer = (self.pointer + 1) & 0xFF
+        return bytes(data)
+
+    def frequency(self):
+        return PCA9685Model.OSC / 4096 / (self.regs[PCA9685Model.PRESCALE] + 1)
+
+    def pulse(self, ch):
+        """ Gets the pulse width on the channel in microseconds, or None if it is fully off. """
+        base = PCA9685Model.LED0_ON_L + 4 * ch
+        on = self.regs[base] | (self.regs[base + 1] << 8)
+        off = self.regs[base + 2] | (self.regs[base + 3] << 8)
+        if off & 0x1000:
+            return None
+        if on & 0x1000:
+            return 1000000 / self.frequency()
+        return ((off - on) % 4096) * 1000000 / self.frequency() / 4096
+
+    def angle(self, ch, min_pulse=750, max_pulse=2250, actuation_range=180):
+        """ Gets the angle the servo on the channel would be at, or None if it is off. """
+        pulse = self.pulse(ch)
+        if pulse is None:
+            return None
+        return (pulse - min_pulse) * actuation_range / (max_pulse - min_pulse)
+
+
+class PCF8575Model(SimDevice):
+    """
+    Model of a PCF8575 16-bit I/O expander.
+    The pins are quasi-bidirectional: writing 0 drives a pin low; writing 1 turns on
+    a weak pull-up, so the pin can be read as an input and something outside
+    (a button) can pull it low. A read gives the port with both taken into account.
+    INT goes active when an input changes, and is cleared by a read or a write.
+    """
+    def __init__(self, addr, **kwargs):
+        super().__init__(addr, **kwargs)
+        self.latch = 0xFFFF       # what was last written; all high at power up
+        self.external = 0xFFFF    # pins pulled low from outside are 0
+        self.last_read = 0xFFFF
+        self.interrupt = False    # True when INT is active (the real pin is active low)
+        self.lock = threading.Lock()
+
+    def port(self):
+        return self.latch & self.external
+
+    def write(self, data):
+        if len(data) >= 2:
+            self.latch = data[0] | (data[1] << 8)
+        elif len(data) == 1:
+            self.latch = (self.latch & 0xFF00) | data[0]
+        self.interrupt = False
+
+    def read(self, n):
+        with self.lock:
+            value = self.port()
+            self.last_read = value
+            self.interrupt = False
+        return bytes([value & 0xFF, value >> 8, value & 0xFF, value >> 8][:n])
+
+    def _set_external(self, pin, level):
+        with self.lock:
+            if level:
+                self.external |= 1 << pin
+            else:
+                self.external &= ~(1 << pin)
+            if self.port() != self.last_read:
+                self.interrupt = True
+
+    def press(self, pin):
+        """ Pulls the pin low from outside, as a button would. """
+        self._set_external(pin, False)
+
+    def release(self, pin):
+        self._set_external(pin, True)
+
+    def output(self, pin):
+        """ Gets the level the board is driving the pin to (False is low, which lights an LED). """
+        return bool(self.latch & (1 << pin))
+
+
+class INA219Model(SimDevice):
+    """
+    Model of an INA219 current monitor, as on the UPS.
+    Voltage (in volts) and current (in mA) can each be:
+      a number
+      a function that takes the time in seconds since the start and returns a number
+      a list of (time, value) pairs; values in between are interpolated, and the last one holds
+    """
+    CONFIG = 0x00
+    SHUNT_VOLTAGE = 0x01
+    BUS_VOLTAGE = 0x02
+    POWER = 0x03
+    CURRENT = 0x04
+    CALIBRATION = 0x05
+
+    def __init__(self, addr, voltage=12.0, current=300.0, shunt=0.1, **kwargs):
+        super().__init__(addr, **kwargs)
+        self.voltage = voltage
+        self.current = current
+        self.shunt = shunt
+        self.regs = {INA219Model.CONFIG:0x399F, INA219Model.CALIBRATION:0}
+        self.pointer = 0
+        self.start_time = time.perf_counter()
+
+    def _value(self, curve):
+        t = time.perf_counter() - self.start_time
+        if callable(curve):
+            return curve(t)
+        if isinstance(curve, (list, tuple)):
+            if t <= curve[0][0]:
+                return curve[0][1]
+            for (t0, v0), (t1, v1) in zip(curve, curve[1:]):
+                if t < t1:
+                    return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+            return curve[-1][1]
+        return curve
+
+    def current_lsb(self):
+        # In mA, from the calibration register; 0.1 mA if never calibrated
+        cal = self.regs[INA219Model.CALIBRATION]
+        if not cal:
+            return 0.1
+        return 0.04096 / (cal * self.shunt) * 1000
+
+    def _register(self, reg):
+        volts = self._value(self.voltage)
+        milliamps = self._value(self.current)
+        match reg:
+            case INA219Model.BUS_VOLTAGE:
+                # Bits 15-3 in 4 mV steps, bit 1 is conversion ready
+                return ((max(0, round(volts * 250)) & 0x1FFF) << 3) | 0x02
+            case INA219Model.SHUNT_VOLTAGE:
+                return round(milliamps * self.shunt * 100)    # 10 uV steps
+            case INA219Model.CURRENT:
+                return round(milliamps / self.current_lsb())
+            case INA219Model.POWER:
+                return round(volts * abs(milliamps) / (20 * self.current_lsb()))
+            case _:
+                return self.regs.get(reg, 0)
+
+    def write(self, data):
+        if not data:
+            return
+        self.pointer = data[0]
+        if len(data) >= 3:
+            self.regs[self.pointer] = (data[1] << 8) | data[2]
+
+    def read(self, n):
+        value = self._register(self.pointer) & 0xFFFF
+        return bytes([value >> 8, value & 0xFF] * ((n + 1) // 2))[:n]
+
+
+class HD44780Model(SimDevice):
+    """
+    Model of an HD44780 LCD on a PCF8574 backpack, as driven by I2C_LCD_driver.
+    Each byte written sets the eight backpack pins: RS, RW, EN, backlight and
+    the top four data lines. Data is latched when EN goes low. The display starts
+    in eight-bit mode and switches to four-bit mode on the function set command,
+    after which each byte is sent as two nibbles.
+    """
+    RS = 0x01
+    EN = 0x04
+    BACKLIGHT = 0x08
+    LINE_ADDRESSES = (0x00, 0x40, 0x14, 0x54)
+
+    def __init__(self, addr, columns=20, rows=4, **kwargs):
+        super().__init__(addr, **kwargs)
+        self.columns = columns
+        self.rows = rows
+        self.pins = 0
+        self.four_bit = False
+        self.high_nibble = None
+        self.address = 0
+        self.ddram = bytearray(b' ' * 0x80)
+        self.backlight = False
+        self.commands = 0
+        self.characters = 0
+
+    def write(self, data):
+        for b in data:
+            if self.pins & HD44780Model.EN and not b & HD44780Model.EN:
+                self._latch(self.pins & 0xF0, bool(self.pins & HD44780Model.RS))
+            self.pins = b
+            self.backlight = bool(b & HD44780Model.BACKLIGHT)
+
+    def read(self, n):
+        return bytes([self.pins] * n)
+
+    def _latch(self, nibble, rs):
+        if not self.four_bit:
+            # In eight-bit mode the low data lines are not connected, so just the top four count
+            self._execute(nibble, rs)
+            return
+        if self.high_nibble is None:
+            self.high_nibble = nibble
+        else:
+            self._execute(self.high_nibble | (nibble >> 4), rs)
+            self.high_nibble = None
+
+    def _execute(self, b, rs):
+        if rs:
+            self.ddram[self.address & 0x7F] = b
+            self.address = (self.address + 1) & 0x7F
+            self.characters += 1
+            return
+        # The command is identified by its highest set bit
+        self.commands += 1
+        if b & 0x80:
+            self.address = b & 0x7F
+        elif b & 0x40:
+            pass    # CGRAM address, for custom characters
+        elif b & 0x20:
+            # Function set; DL bit clear is four-bit mode
+            self.four_bit = not b & 0x10
+            self.high_nibble = None
+        elif b >= 0x04:
+            pass    # Shift, display control or entry mode
+        elif b & 0x02:
+            self.address = 0
+        elif b == 0x01:
+            self.ddram[:] = b' ' * 0x80
+            self.address = 0
+
+    def lines(self):
+        """ Gets the text on the display as a list of strings, one per row. """
+        return [self.ddram[a:a + self.columns].decode('latin-1') for a in HD44780Model.LINE_ADDRESSES[:self.rows]]
+
+
+
+#################################################################################
+# DRIVERS
+
+class _Device:
+    # Like adafruit_bus_device.I2CDevice; holds the bus and address
+    def __init__(self, i2c, addr):
+        self.i2c = i2c
+        self.device_address = addr
+
+    def write(self, data):
+        self.i2c.writeto(self.device_address, bytes(data))
+
+    def write_then_read(self, data, n):
+        buf = bytearray(n)
+        self.i2c.writeto_then_readfrom(self.device_address, bytes(data), buf)
+        return buf
+
+
+class _PCA9685:
+    """ Driver for the PCA9685, like the one in adafruit_pca9685. """
+    def __init__(self, i2c, addr, frequency=50):
+        self.i2c_device = _Device(i2c, addr)
+        # Sleep, set the prescaler, then wake with auto-increment on
+        prescale = round(PCA9685Model.OSC / 4096 / frequency) - 1
+        self.i2c_device.write([PCA9685Model.MODE1, PCA9685Model.SLEEP | PCA9685Model.AI])
+        self.i2c_device.write([PCA9685Model.PRESCALE, prescale])
+        self.i2c_device.write([PCA9685Model.MODE1, PCA9685Model.AI])
+        self.frequency = PCA9685Model.OSC / 4096 / (prescale + 1)
+
+    @property
+    def mode1_reg(self):
+        return self.i2c_device.write_then_read([PCA9685Model.MODE1], 1)[0]
+
+    def set_pwm(self, ch, on, off):
+        self.i2c_device.write([PCA9685Model.LED0_ON_L + 4 * ch, on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+
+
+class _Servo:
+    """ One servo on a ServoKit, like adafruit_motor.servo.Servo. """
+    def __init__(self, pca, ch, min_pulse=750, max_pulse=2250, actuation_range=180):
+        self._pca = pca
+        self.ch = ch
+        self.min_pulse = min_pulse
+        self.max_pulse = max_pulse
+        self.actuation_range = actuation_range
+        self._angle = None
+
+    @property
+    def angle(self):
+        return self._angle
+
+    @angle.setter
+    def angle(self, value):
+        if value is None:
+            self._pca.set_pwm(self.ch, 0, 0x1000)
+        else:
+            if not 0 <= value <= self.actuation_range:
+                raise ValueError("Angle out of range")
+            pulse = self.min_pulse + (self.max_pulse - self.min_pulse) * value / self.actuation_range
+            off = round(pulse * self._pca.frequency * 4096 / 1000000)
+            self._pca.set_pwm(self.ch, 0, off)
+        self._angle = value
+
+
+class ServoKit:
+    """ Simulated version of adafruit_servokit.ServoKit. """
+    def __init__(self, i2c, address=0x40, channels=16):
+        self.addr = address
+        self._pca = _PCA9685(i2c, address)
+        self.servo = [_Servo(self._pca, ch) for ch in range(channels)]
+
+
+class _Pin:
+    """ One pin on a PCF8575, like adafruit_pcf8575.DigitalInOut. """
+    def __init__(self, pcf, pin):
+        self._pcf = pcf
+        self._pin = pin
+
+    def switch_to_output(self, value=False, **kwargs):
+        self.value = value
+
+    def switch_to_input(self, pull=None, **kwargs):
+        # Quasi-bidirectional, so an input is just an output set high
+        self.value = True
+
+    @property
+    def value(self):
+        return bool(self._pcf.read_gpio() & (1 << self._pin))
+
+    @value.setter
+    def value(self, val):
+        self._pcf.write_pin(self._pin, val)
+
+
+class PCF8575:
+    """ Simulated version of adafruit_pcf8575.PCF8575. """
+    def __init__(self, i2c, address=0x20):
+        self.addr = address
+        self.i2c_device = _Device(i2c, address)
+        self._gpio = 0xFFFF
+
+    def read_gpio(self):
+        buf = bytearray(2)
+        self.i2c_device.i2c.readfrom_into(self.addr, buf)
+        return buf[0] | (buf[1] << 8)
+
+    def write_gpio(self, val):
+        self._gpio = val & 0xFFFF
+        self.i2c_device.write([self._gpio & 0xFF, self._gpio >> 8])
+
+    def write_pin(self, pin, val):
+        if val:
+            self.write_gpio(self._gpio | (1 << pin))
+        else:
+            self.write_gpio(self._gpio & ~(1 << pin))
+
+    def get_pin(self, pin):
+        return _Pin(self, pin)
+
+
+class UPS:
+    """ Simulated version of adafruit_ina219.INA219, as far as servo.py uses it. """
+    def __init__(self, i2c, addr=0x42):
+        self.addr = addr
+        self.i2c_device = _Device(i2c, addr)
+        # Calibration for 32V 2A with a 0.1 ohm shunt, so the current LSB is 0.1 mA
+        self.i2c_device.write([INA219Model.CALIBRATION, 0x10, 0x00])
+        self.current_lsb = 0.1
+
+    def _read(self, reg):
+        buf = self.i2c_device.write_then_read([reg], 2)
+        return (buf[0] << 8) | buf[1]
+
+    @property
+    def bus_voltage(self):
+        return (self._read(INA219Model.BUS_VOLTAGE) >> 3) * 0.004
+
+    @property
+    def current(self):
+        raw = self._read(INA219Model.CURRENT)
+        if raw > 0x7FFF:
+            raw -= 0x10000
+        return raw * self.current_lsb
+
+
+class _LCDDevice:
+    # Like i2c_device in I2C_LCD_driver
+    def __init__(self, i2c, addr):
+        self.i2c = i2c
+        self.addr = addr
+
+    def write_cmd(self, cmd):
+        self.i2c.writeto(self.addr, bytes([cmd]))
+
+    def read(self):
+        buf = bytearray(1)
+        self.i2c.readfrom_into(self.addr, buf)
+        return buf[0]
+
+
+class LCD:
+    """ Simulated version of I2C_LCD_driver.lcd; sends the same bytes, without the sleeps. """
+    def __init__(self, i2c, addr=0x27):
+        self.addr = addr
+        self.lcd_device = _LCDDevice(i2c, addr)
+        for cmd in [0x03, 0x03, 0x03, 0x02, 0x28, 0x0C, 0x01, 0x06]:
+            self.lcd_write(cmd)
+
+    def lcd_strobe(self, data):
+        self.lcd_device.write_cmd(data | HD44780Model.EN | HD44780Model.BACKLIGHT)
+        self.lcd_device.write_cmd((data & ~HD44780Model.EN) | HD44780Model.BACKLIGHT)
+
+    def lcd_write_four_bits(self, data):
+        self.lcd_device.write_cmd(data | HD44780Model.BACKLIGHT)
+        self.lcd_strobe(data)
+
+    def lcd_write(self, cmd, mode=0):
+        self.lcd_write_four_bits(mode | (cmd & 0xF0))
+        self.lcd_write_four_bits(mode | ((cmd << 4) & 0xF0))
+
+    def lcd_display_string(self, string, line=1, pos=0):
+        self.lcd_write(0x80 + HD44780Model.LINE_ADDRESSES[line - 1] + pos)
+        for char in string:
+            self.lcd_write(ord(char), HD44780Model.RS)
+
+    def lcd_clear(self):
+        self.lcd_write(0x01)
+        self.lcd_write(0x02)
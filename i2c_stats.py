@@ -0,0 +1,188 @@
+"""
+Instrumentation for the I2C bus.
+
+Every access ServoMaster makes to a board goes through I2CStats.timed, which
+counts transactions, bytes, errors and time taken, per device address and per
+operation type. Use it to find a busy bus or a flaky board on a live layout.
+
+    with stats.timed(0x41, SERVO_WRITE, 5):
+        servo.angle = 90
+
+Counters can be viewed from the GUI (I2C - Statistics...) or dumped to a JSON
+file for other tools to read.
+"""
+
+import time
+import json
+import threading
+from collections import deque
+
+
+# Operation types
+SERVO_WRITE = 'servo write'
+BUTTON_READ = 'button read'
+LED_WRITE = 'LED write'
+RELAY_WRITE = 'relay write'
+LCD_WRITE = 'LCD write'
+UPS_READ = 'UPS read'
+
+# Approximate bytes on the wire for each operation, not counting the address byte
+# PCA9685 - register pointer then four bytes for ON_L, ON_H, OFF_L, OFF_H
+# PCF8575 - two bytes for the port, in or out
+# INA219 - pointer write, then two bytes back, for each register read
+# LCD - each character is two nibbles, each written three times to strobe EN
+BYTES = {
+    SERVO_WRITE: 5,
+    BUTTON_READ: 2,
+    LED_WRITE: 2,
+    RELAY_WRITE: 2,
+    UPS_READ: 3,
+    LCD_WRITE: 6,
+}
+
+SAMPLES = 1000    # Keep this many recent latencies for each address/operation for percentiles
+
+
+class Counter:
+    """
+    The counts for one device address and one operation type.
+    Latencies are in seconds; the most recent are kept for percentiles.
+    """
+    def __init__(self, addr, op):
+        self.addr = addr
+        self.op = op
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last_error = None
+        self.samples = deque(maxlen=SAMPLES)
+
+    def percentile(self, p):
+        """ Gets the given percentile (0-100) of recent latencies, in seconds, by nearest rank. """
+        if not self.samples:
+            return 0.0
+        lst = sorted(self.samples)
+        n = max(1, round(p / 100 * len(lst)))
+        return lst[n - 1]
+
+    def as_dict(self):
+        """ A plain dictionary for dumping to JSON. Times are in milliseconds. """
+        return {
+            'address':hex(self.addr) if isinstance(self.addr, int) else str(self.addr),
+            'op':self.op,
+            'count':self.count,
+            'errors':self.errors,
+            'bytes':self.bytes,
+            'total_ms':round(self.total * 1000, 3),
+            'mean_ms':round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            'p50_ms':round(self.percentile(50) * 1000, 3),
+            'p95_ms':round(self.percentile(95) * 1000, 3),
+            'p99_ms':round(self.percentile(99) * 1000, 3),
+            'max_ms':round(self.max * 1000, 3),
+            'last_error':self.last_error,
+        }
+
+
+class _Timer:
+    """
+    Context manager returned by I2CStats.timed. Records the time taken,
+    and an error if an OSError or ValueError comes out, which is then re-raised.
+    """
+    __slots__ = ('stats', 'addr', 'op', 'nbytes', 'start')
+
+    def __init__(self, stats, addr, op, nbytes):
+        self.stats = stats
+        self.addr = addr
+        self.op = op
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        error = None
+        if exc_type and issubclass(exc_type, (OSError, ValueError)):
+            error = str(exc)
+        self.stats.record(self.addr, self.op, self.nbytes, time.perf_counter() - self.start, error)
+        return False
+
+
+class _NoTimer:
+    """ Does nothing, used when statistics are turned off. """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class I2CStats:
+    """
+    Collects the counters. Written to from the main loop thread, read from the GUI,
+    so access is under a lock.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self._no_timer = _NoTimer()
+
+    def timed(self, addr, op, nbytes=None):
+        """ Gets a context manager that will record one transaction. """
+        if not self.enabled:
+            return self._no_timer
+        return _Timer(self, addr, op, BYTES.get(op, 0) if nbytes is None else nbytes)
+
+    def record(self, addr, op, nbytes, elapsed, error=None):
+        """ Records one transaction. The error should be a string or None. """
+        with self.lock:
+            counter = self.counters.get((addr, op))
+            if not counter:
+                counter = Counter(addr, op)
+                self.counters[(addr, op)] = counter
+            counter.count += 1
+            counter.bytes += nbytes
+            counter.total += elapsed
+            if elapsed > counter.max:
+                counter.max = elapsed
+            counter.samples.append(elapsed)
+            if error:
+                counter.errors += 1
+                counter.last_error = error
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.start_time = time.time()
+
+    def snapshot(self):
+        """ Gets a list of dictionaries, one for each address/operation, sorted by address. """
+        with self.lock:
+            counters = sorted(self.counters.values(), key=lambda c: (str(c.addr), c.op))
+            return [c.as_dict() for c in counters]
+
+    def busy_fraction(self):
+        """ Gets the fraction of time since the start (or reset) spent in I2C calls. """
+        with self.lock:
+            total = sum(c.total for c in self.counters.values())
+        elapsed = time.time() - self.start_time
+        return total / elapsed if elapsed > 0 else 0.0
+
+    def dump(self, filename):
+        """ Writes the counters to a JSON file. """
+        data = {
+            'time':time.time(),
+            'elapsed':time.time() - self.start_time,
+            'busy_fraction':round(self.busy_fraction(), 5),
+            'devices':self.snapshot(),
+        }
+        with open(filename, 'w', encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+
+# The one everything uses
+stats = I2CStats()
@@ -0,0 +1,129 @@
+"""
+Tracing of the latency from a button being pressed to the servo moving.
+
+When PButton sees a press it starts a Trace, which is handed to each servo the button
+sets. The trace is stamped as it goes:
+
+  edge      - the start of the button read that saw the press
+  dispatch  - the button has decided what to do and is about to tell the servos
+  set       - Servo.set has been called
+  first     - the first write to the servo board has completed
+  last      - the last write, as the servo settles
+
+Each stage is measured from the edge and added to a histogram, so the GUI can show
+p50/p95/p99 and they can be dumped to a JSON file.
+Note that the edge is when the press was seen; it may have happened up to one pass of
+the main loop earlier.
+"""
+
+import time
+import json
+import threading
+from collections import deque
+
+
+STAGES = ('dispatch', 'set', 'first', 'last')
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)   # upper bounds in ms; anything more goes in the last
+SAMPLES = 1000
+
+
+class Trace:
+    """ The times for one button press and one servo, from time.perf_counter. """
+    __slots__ = ('button', 'edge', 'dispatch', 'set', 'first', 'last')
+
+    def __init__(self, button, edge):
+        self.button = button
+        self.edge = edge
+        self.dispatch = None
+        self.set = None
+        self.first = None
+        self.last = None
+
+    def copy(self):
+        # Each servo on a button gets its own copy, as they move independently
+        trace = Trace(self.button, self.edge)
+        trace.dispatch = self.dispatch
+        return trace
+
+
+class Histogram:
+    """ Latencies for one stage, in seconds; keeps recent ones for percentiles and counts all in buckets. """
+    def __init__(self, stage):
+        self.stage = stage
+        self.samples = deque(maxlen=SAMPLES)
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, t):
+        self.samples.append(t)
+        self.count += 1
+        if t > self.max:
+            self.max = t
+        ms = t * 1000
+        for i, bound in enumerate(BUCKETS):
+            if ms < bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        lst = sorted(self.samples)
+        return lst[max(1, round(p / 100 * len(lst))) - 1]
+
+    def as_dict(self):
+        """ Times are in milliseconds. """
+        return {
+            'stage':self.stage,
+            'count':self.count,
+            'p50_ms':round(self.percentile(50) * 1000, 3),
+            'p95_ms':round(self.percentile(95) * 1000, 3),
+            'p99_ms':round(self.percentile(99) * 1000, 3),
+            'max_ms':round(self.max * 1000, 3),
+            'buckets_ms':{f'<{b}':n for b, n in zip(BUCKETS, self.buckets)} | {f'>={BUCKETS[-1]}':self.buckets[-1]},
+        }
+
+
+class LatencyTracer:
+    """ Collects the histograms. Written to from the main loop, read from the GUI. """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {stage:Histogram(stage) for stage in STAGES}
+
+    def start(self, button, edge):
+        """ Starts a trace for a button press seen by a read that began at the given time. """
+        if not self.enabled:
+            return None
+        return Trace(button, edge)
+
+    def stamp(self, trace, stage):
+        """ Records the current time for the stage of the trace, unless already done. """
+        if not trace or getattr(trace, stage) is not None:
+            return
+        t = time.perf_counter()
+        setattr(trace, stage, t)
+        with self.lock:
+            self.histograms[stage].add(t - trace.edge)
+
+    def snapshot(self):
+        with self.lock:
+            return [self.histograms[stage].as_dict() for stage in STAGES]
+
+    def dump(self, filename):
+        data = {
+            'time':time.time(),
+            'stages':self.snapshot(),
+        }
+        with open(filename, 'w', encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+
+# The one everything uses
+tracer = LatencyTracer()
@@ -0,0 +1,132 @@
+"""
+Shows what a running ServoMaster is doing, from the status file it writes (config.STATUS_FILE).
+
+This only reads the file, so it never touches the I2C bus, and any number can run
+without slowing the main loop. If ServoMaster is restarted, the new file is picked up.
+
+    python monitor.py                       # refresh every second
+    python monitor.py --once                # print once and stop
+    python monitor.py --moving              # only list servos that are moving
+    python monitor.py --layout servo.txt    # show board.pin and description for each servo
+    python monitor.py --json                # one JSON object per refresh, for other scripts
+"""
+
+import argparse
+import json
+import mmap
+import os
+import re
+import time
+
+import config
+import state_block
+from state_block import StateBlock
+
+
+STALE = 5.0     # Seconds without an update before saying ServoMaster seems to have stopped
+
+
+class StatusFile:
+    """ The status file, mapped read-only; reopened if ServoMaster makes a new one. """
+    def __init__(self, filename):
+        self.filename = filename
+        self.inode = None
+        self.block = None
+
+    def read(self):
+        """ Gets a snapshot of the state, or None if there is no file. """
+        try:
+            inode = os.stat(self.filename).st_ino
+        except FileNotFoundError:
+            self.inode = None
+            self.block = None
+            return None
+        if inode != self.inode:
+            with open(self.filename, 'rb') as f:
+                self.block = StateBlock(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self.inode = inode
+        return self.block.snapshot()
+
+
+def read_layout(filename):
+    """ Gets the board.pin and description of each servo in the file, in order. """
+    lst = []
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            if line[0:1] != 's':
+                continue
+            # As in Servo.create
+            md = re.match(r's (\d+)\.(\d+),? (\d+),? (\d+),? (\d+),? (\d+),?(?: ?\[(.*?)\])? ?(.*)', line)
+            if md:
+                lst.append((f'{md.group(1)}.{md.group(2)}', md.group(8).strip()))
+            else:
+                lst.append(('?', ''))
+    return lst
+
+
+def servo_state(flags):
+    if flags & state_block.CENTRED:
+        state = 'CENTRE'
+    elif flags & state_block.TURN_ON:
+        state = 'ON'
+    else:
+        state = 'OFF'
+    if flags & state_block.MOVING:
+        state += ' moving'
+    if flags & state_block.QUARANTINED:
+        state += ' QUARANTINED'
+    return state
+
+
+def show(snapshot, layout, moving_only):
+    age = time.time() - snapshot['time']
+    print(f"Loop count {snapshot['loop_count']}, {round(snapshot['loop_rate'])} loops/s, updated {round(age, 1)} s ago")
+    if age > STALE:
+        print('WARNING: No updates for a while; ServoMaster may have stopped.')
+    if snapshot['power_state'] != 'unknown':
+        print(f"Power {snapshot['power_state']}, {round(snapshot['ups_voltage'], 2)} V, {round(snapshot['ups_current'])} mA")
+    for i, (current, target, flags) in enumerate(snapshot['servos']):
+        if moving_only and not flags & state_block.MOVING:
+            continue
+        ident, desc = layout[i] if i < len(layout) else (str(i), '')
+        print(f'  {ident:>6} {desc:<{config.DESC_WIDTH}} {servo_state(flags):<20} {round(current):>4}° -> {round(target):>4}°')
+    for name in ('buttons', 'leds', 'relays', 'flashers'):
+        bits = ''.join('1' if b else '.' for b in snapshot[name])
+        print(f'{name.capitalize():>9}: {bits}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shows the state of a running ServoMaster, without using the I2C bus.')
+    parser.add_argument('--file', default=config.STATUS_FILE, help='The status file')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between refreshes')
+    parser.add_argument('--once', action='store_true', help='Print once and stop')
+    parser.add_argument('--moving', action='store_true', help='Only list servos that are moving')
+    parser.add_argument('--layout', help='The servo.txt in use, to show which servo is which')
+    parser.add_argument('--json', action='store_true', help='Print JSON, one line per refresh')
+    args = parser.parse_args()
+
+    if not args.file:
+        print('ERROR: There is no status file; set STATUS_FILE in config.py.')
+        return
+    layout = read_layout(args.layout) if args.layout else []
+    status = StatusFile(args.file)
+    try:
+        while True:
+            snapshot = status.read()
+            if snapshot is None:
+                print(f'WARNING: No status file at {args.file}; is ServoMaster running?')
+            elif args.json:
+                print(json.dumps(snapshot), flush=True)
+            else:
+                show(snapshot, layout, args.moving)
+            if args.once:
+                return
+            time.sleep(args.interval)
+            if not args.json:
+                print()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
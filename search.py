@@ -0,0 +1,81 @@
+"""
+An index for finding servos by description, ID, or the IDs of their buttons and LEDs.
+
+Each servo is broken into tokens, which are kept in a sorted list so any token
+starting with what has been typed can be found with a binary search, without
+looking at every servo.
+
+    index = SearchIndex()
+    index.add(servo, ['FY-R Anti 3', '2.5', '0.3'])
+    index.find('anti fy')      # servos with a token starting "anti" and a token starting "fy"
+
+Descriptions are split on spaces and on punctuation, so "St X-over 2/1" can be found
+with "x-over", "over" or "2/1"; IDs like "2.5" are kept whole so "2." finds board 2.
+"""
+
+import re
+import bisect
+
+
+def tokenise(s):
+    """ Gets the tokens in a string: each word, lower case, and the parts of it. """
+    tokens = set()
+    for word in s.lower().split():
+        tokens.add(word)
+        for part in re.split(r'[^\w.]+', word):
+            if part:
+                tokens.add(part)
+    return tokens
+
+
+class SearchIndex:
+    """
+    Maps tokens to the objects that have them. Objects can be added again when
+    their text changes, and only their own tokens are updated.
+    Only use from one thread.
+    """
+    def __init__(self):
+        self.objects = {}       # token to set of objects
+        self.tokens = []        # all tokens, sorted
+        self.tokens_for = {}    # object to its tokens
+
+    def add(self, obj, strings):
+        """ Indexes the object under the given strings, replacing what it had before. """
+        self.remove(obj)
+        tokens = set()
+        for s in strings:
+            if s:
+                tokens |= tokenise(s)
+        self.tokens_for[obj] = tokens
+        for token in tokens:
+            if token not in self.objects:
+                self.objects[token] = set()
+                bisect.insort(self.tokens, token)
+            self.objects[token].add(obj)
+
+    def remove(self, obj):
+        for token in self.tokens_for.pop(obj, ()):
+            objects = self.objects[token]
+            objects.discard(obj)
+            if not objects:
+                del self.objects[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+    def starting(self, prefix):
+        """ Gets the set of objects with a token starting with the prefix. """
+        result = set()
+        i = bisect.bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            result |= self.objects[self.tokens[i]]
+            i += 1
+        return result
+
+    def find(self, text):
+        """ Gets the set of objects that match every word in the text. Nothing matches empty text. """
+        result = None
+        for word in text.lower().split():
+            found = self.starting(word)
+            result = found if result is None else result & found
+            if not result:
+                return set()
+        return result or set()
@@ -24,6 +24,7 @@ f - flasher
 
 
 VERSION = '1.5'
+FILENAME = '/home/f2andy/pdmrs/servo.txt'
 
 
 
@@ -33,14 +34,45 @@ VERSION = '1.5'
 
 import time
 import re
+import argparse
+import signal
 import sys
 import random
 import math
 import traceback
 import os
-from threading import Thread
+import mmap
+import hashlib
+import io
+import queue
+import asyncio
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import config
+import latency
+import i2c_stats
+from i2c_stats import stats
+stats.enabled = config.I2C_STATS
+import i2c_guard
+from i2c_guard import BoardGuard
+import i2c_bus
+from i2c_bus import Bus, together
+from latency import tracer
+tracer.enabled = config.LATENCY_TRACE
+import events
+from events import bus
+from search import SearchIndex
+from control import ControlServer
+from streaming import StreamServer
+from web import Dashboard
+from cluster import Cluster
+from standby import Replicator, Standby
+import state_block
+from state_block import StateBlock
 
 
 if config.ON_LINE:
@@ -60,13 +92,18 @@ if config.ON_LINE:
         print('This is likely because you have not activated the environment.\nTo do so, type "source pdmrs/bin/activate", then try again.')
         print('Also check the I2C bus is turned on (click on the raspberry icon, top left, and  select Preferences - Raspberry Pi Configuration, then go to the "Interfaces" tab, and turn on I2C; will need a reboot)')
         exit()
+elif config.SIMULATE:
+    import i2c_sim
+
+# True if there are boards to talk to, whether real or simulated
+USE_BUS = config.ON_LINE or config.SIMULATE
         
         
 # Imports for GUI
 import tkinter as tk
 import tkinter.ttk as ttk
 from tkinter import font, Menu, messagebox, PhotoImage, Toplevel, Scrollbar, TclError
-from PIL import Image, ImageTk
+from PIL import Image, ImageTk, ImageDraw, ImageFont
 
 
 
@@ -100,13 +137,50 @@ class ServoConfigException(Exception):
 
 
 
+#################################################################################
+
+class GuiUpdates:
+    """
+    The main loop must not touch Tk, so instead the GUI's event handlers mark a device as dirty here,
+    and the GUI thread picks up the dirty ones on a timer (see ServoWindow.flush)
+    and updates the grid row showing each. A device marked several times between frames
+    is only updated once.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.dirty = set()
+
+    def mark(self, obj):
+        with self.lock:
+            self.dirty.add(obj)
+
+    def take(self):
+        """ Gets the dirty objects, and clears the list. """
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = set()
+        return dirty
+
+
+def configure(widget, **kwargs):
+    """
+    Configures the widget, but only if that changes it, as far as we know.
+    Only call from the GUI thread.
+    """
+    if getattr(widget, 'last_config', None) == kwargs:
+        return
+    widget.config(**kwargs)
+    widget.last_config = kwargs
+
+
+
+
 #################################################################################
 
 class Device:
     def __init__(self):
         global comments
         self.comments = list(comments)
-        self.widget = None
         comments = []
         
     def write_to_file(self, f, newline=False):
@@ -115,13 +189,6 @@ class Device:
         for s in self.comments:
             f.write(s)
 
-    def set_widget(self, widget):
-        """
-        Set a Label widget that the servo can report its angle to.
-        Or set to None.
-        """
-        self.widget = widget
-
 
 
 #################################################################################
@@ -159,7 +226,7 @@ class Servo(Device):
             return None
    
     def quiet_all():
-        for servo in servos:
+        for servo in local_servos:
             servo.quiet()
             
 
@@ -198,6 +265,8 @@ class Servo(Device):
         self.off_buttons = []
         self.main_colour = None
         self.branch_colour = None
+        self.items = None       # Canvas item IDs for the main and branch lines, and the blade
+        self.blade_drawn = None
         self.relay = None
         self.relay_state = None
        
@@ -216,34 +285,55 @@ class Servo(Device):
         else:
             self.graphic = None
 
-        if config.ON_LINE:
-            self.servo = servo_boards[self.board_no].servo[self.pin_no]
-            # Do we need these lines?!?
-            #print('..' + str(self.current_angle / 100))
-            #self.servo.angle = self.current_angle / 100
+        self.guard = servo_guards[self.board_no]
+        self.node = remote_node(servo_nodes[self.board_no])    # None if the board is on this node
+        self.needs_sync = False
+        self.trace = None    # Latency trace for the button press that set this servo moving
+        if USE_BUS and not self.node:
+            self.attach()
         self.turn_on = False
         self.index = Servo.count
         Servo.count += 1
+
+    def attach(self):
+        """ Gets the servo on the I2C board. """
+        self.servo = servo_boards[self.board_no].servo[self.pin_no]
+        # Do we need these lines?!?
+        #print('..' + str(self.current_angle / 100))
+        #self.servo.angle = self.current_angle / 100
        
        
-    def is_here(self, x, y):
+    def cells(self):
+        """ Gets the trackplan grid cells the point covers, as (x, y) tuples. """
         if not self.graphic:
-            return False
+            return []
+        x = self.graphic['x']
+        y = self.graphic['y']
+        lst = [(x, y)]
+        # This type of point goes above the line
+        if self.graphic['shape'] == 'Y' or self.graphic['shape'] == 'A':
+            lst.append((x, y + 1))
+        # This type of point goes below the line
+        if self.graphic['shape'] == 'Y' or self.graphic['shape'] == 'B':
+            lst.append((x, y - 1))
+        return lst
 
-        if self.graphic['x'] != x:
-            return False
-           
-        if self.graphic['y'] == y:
-            return True
-        # This type opf point goes above the line
-        if (self.graphic['shape'] == 'Y' or self.graphic['shape'] == 'A') and self.graphic['y'] == y - 1:
-            return True
-        # This type opf point goes below the line
-        if (self.graphic['shape'] == 'Y' or self.graphic['shape'] == 'B') and self.graphic['y'] == y + 1:
-            return True
-        return False
+    def is_here(self, x, y):
+        return (x, y) in self.cells()
+
+    def search_strings(self):
+        """ Gets what the servo can be searched for by - description, ID, and its buttons and LEDs. """
+        lst = [self.desc, self.id()]
+        for device in self.on_buttons + self.off_buttons + self.on_leds + self.off_leds:
+            lst.append(device.id())
+        return lst
        
     def draw(self, trackplan, full=False):
+        """
+        Draws the point on the trackplan. The lines are created on a full redraw,
+        which must follow clearing the canvas; otherwise the existing lines are recoloured
+        and the blade moved if the state has changed, so the number of items on the canvas stays the same.
+        """
         if not self.graphic:
             return
            
@@ -251,33 +341,64 @@ class Servo(Device):
         branch_colour = 'silver'
         if self.current_angle == self.off_angle:
             main_colour = config.POINT_COLOUR
-            if self.widget:
-                self.state_label.config(text='OFF', foreground='black', background='white')
         if self.current_angle == self.on_angle:
             branch_colour = config.POINT_COLOUR
-            if self.widget:
-                self.state_label.config(text='ON', foreground='white', background='black')
+        blade = self.blade()
+        # The blade is only shown part way
+        moving = main_colour == branch_colour
            
-        if self.main_colour != main_colour or self.branch_colour != branch_colour or full:
+        if self.items and not full:
+            if self.main_colour != main_colour:
+                trackplan.recolour(self.items[0], main_colour)
+                self.main_colour = main_colour
+            if self.branch_colour != branch_colour:
+                trackplan.recolour(self.items[1], branch_colour)
+                self.branch_colour = branch_colour
+            if self.blade_drawn != (blade if moving else None):
+                trackplan.move_blade(self.items[2], blade, moving)
+                self.blade_drawn = blade if moving else None
+        else:
             if self.graphic['reverse']:
                 # Main
                 # For Y, 
                 offset = -1 if self.graphic['shape'] == 'Y' else 0
-                trackplan.r_line(self.graphic['x'], self.graphic['y'], offset, main_colour)
+                main = trackplan.r_line(self.graphic['x'], self.graphic['y'], offset, main_colour)
                
                 # Branch
                 offset = -1 if self.graphic['shape'] == 'B' else 1
-                trackplan.r_line(self.graphic['x'], self.graphic['y'], offset, branch_colour)
+                branch = trackplan.r_line(self.graphic['x'], self.graphic['y'], offset, branch_colour)
             else:      
                 # Main
                 offset = -1 if self.graphic['shape'] == 'Y' else 0
-                trackplan.line(self.graphic['x'], self.graphic['y'], offset, main_colour)
+                main = trackplan.line(self.graphic['x'], self.graphic['y'], offset, main_colour)
                
                 # Branch
                 offset = -1 if self.graphic['shape'] == 'B' else 1
-                trackplan.line(self.graphic['x'], self.graphic['y'], offset, branch_colour)
+                branch = trackplan.line(self.graphic['x'], self.graphic['y'], offset, branch_colour)
+            self.items = (main, branch, trackplan.blade(blade, moving))
             self.main_colour = main_colour
             self.branch_colour = branch_colour
+            self.blade_drawn = blade if moving else None
+
+    def blade(self):
+        """
+        Gets the line for the blade on the trackplan, as grid positions (x0, y0, x1, y1),
+        from the toe of the point to somewhere between the end of the main and
+        the end of the branch, depending on how far the servo has got.
+        """
+        x = self.graphic['x']
+        y = self.graphic['y']
+        main_offset = -1 if self.graphic['shape'] == 'Y' else 0
+        branch_offset = -1 if self.graphic['shape'] == 'B' else 1
+        if self.on_angle == self.off_angle:
+            fraction = 0
+        else:
+            fraction = (self.current_angle - self.off_angle) / (self.on_angle - self.off_angle)
+            fraction = min(max(fraction, 0), 1)
+        end_y = y + main_offset + (branch_offset - main_offset) * fraction
+        if self.graphic['reverse']:
+            return (x + 1, y, x, end_y)
+        return (x, y, x + 1, end_y)
      
     def id(self):
         """ The ID is the 'board.pin'. """
@@ -304,14 +425,7 @@ class Servo(Device):
         for b in self.off_buttons:
             f.write(f'b off {b.board_no}.{b.pin_no}\n')
        
-    def set_widget(self, angle_label, state_label):
-        """
-        Set a Label widget that the servo can report its angle to.
-        Or set to None to stop it.
-        """
-        self.widget = angle_label
-        self.state_label = state_label
-       
+
     def sanity_check(self):
         if self.centre_angle < self.off_angle and self.centre_angle < self.on_angle:
             print(f'WARNING: Centre position is less than both ON and OFF positions for servo {self.id()} ({self.desc}).')
@@ -352,15 +466,33 @@ class Servo(Device):
         else:
             self.off_buttons.append(button)
 
-    def set(self, _turn_on):
+    def set(self, _turn_on, trace=None):
         print(f'In set: {_turn_on} {self.id()}')
         """"
         Set the target angle to the on or off angle, which will cause the servo
         to move to that angle over a few seconds.
+        If a latency trace is given, it will be followed through to the servo settling.
+        If the servo is on another node, that node is asked to do it.
         """
-        self.target_angle = self.on_angle if _turn_on else self.off_angle
+        target = self.on_angle if _turn_on else self.off_angle
+        if self.node:
+            # A button held down sets it on every pass, so only ask once
+            if target != self.target_angle or self.centred:
+                send_to_node(self.node, dict(action='on' if _turn_on else 'off', servo=self.index))
+            self.target_angle = target
+            self.turn_on = _turn_on
+            self.centred = False
+            return
+        self.target_angle = target
         self.turn_on = _turn_on
         self.centred = False
+        if trace:
+            if self.current_angle == self.target_angle and not self.moving:
+                # Already there, so nothing to time
+                self.trace = None
+            else:
+                self.trace = trace.copy()
+                tracer.stamp(self.trace, 'set')
         if config.REPORT_SERVO_SWITCHING:
             state = 'ON' if _turn_on else 'OFF'
             #print(f'INFO: Setting servo {self.board_no}.{self.pin_no} ({self.desc}) to {state}')
@@ -371,6 +503,12 @@ class Servo(Device):
         Set the target angle to the centre angle, which will cause the servo
         to move to that angle over a few seconds.
         """
+        if self.node:
+            if not self.centred:
+                send_to_node(self.node, dict(action='centre', servo=self.index))
+            self.target_angle = self.centre_angle
+            self.centred = True
+            return
         self.target_angle = self.centre_angle
         self.centred = True
         if config.REPORT_SERVO_SWITCHING:
@@ -383,6 +521,8 @@ class Servo(Device):
         to move to that angle over a few seconds. Not used in normal running
         but can be accessed from the command line.
         """
+        if self.node:
+            send_to_node(self.node, dict(action='angle', servo=self.index, angle=angle))
         self.target_angle = angle * 100
 
     def get_target_angle(self):
@@ -405,15 +545,24 @@ class Servo(Device):
         """
         Updates the current angle given the elasped time.
         Also decides if LEDs should be changed, and
-        updates the current angle on the GUI if widget is set.
+        publishes events as the servo starts, moves and settles.
         """
+        if self.needs_sync:
+            # The board has been out of action, so send where we think it is
+            # then treat it as moving so it will settle and turn off again
+            self.needs_sync = False
+            self.moving = True
+            if USE_BUS:
+                self.write(self.current_angle / 100)
+
         diff = self.current_angle - self.target_angle
         if diff == 0:
             if self.moving:
                 self.moving = False
                 self.set_leds()
-                if config.ON_LINE:
-                    self.servo.angle = None
+                bus.publish(events.SETTLED, self, angle=self.current_angle / 100)
+                if USE_BUS:
+                    self.write(None)
                 if self.relay:
                     # Is relay ON and we are now between the centre and off position?
                     if self.off_angle < self.centre_angle and self.current_angle < self.centre_angle and self.relay_state:
@@ -437,6 +586,7 @@ class Servo(Device):
             # Could do this in set, but prefer here as set can be done repeatedly
             self.moving = True
             self.reset_leds()
+            bus.publish(events.MOVE_STARTED, self, target=self.target_angle / 100)
 
 
         increment = elapsed * self.speed * abs(self.on_angle - self.off_angle) / 10000
@@ -451,24 +601,26 @@ class Servo(Device):
                 diff = increment
             self.current_angle += diff
        
-        if config.ON_LINE:
+        if USE_BUS:
+            # Errors on the bus are handled by the guard; if the board is failing
+            # the servo keeps moving on paper and is re-synced when it recovers
+            # The trace is stamped when the write reaches the board, which with the
+            # scheduler is on the bus worker, some time after it is queued here
+            done = None
+            if self.trace:
+                done = partial(Servo.written, self.trace, self.current_angle == self.target_angle)
+                if self.current_angle == self.target_angle:
+                    self.trace = None
             try:
-                self.servo.angle = self.current_angle / 100
-            except OSError as err:
-                print("ERROR: OSError {err}")
-                print("This may be because there is no ground connection\nto the servo board on the I2C side")
-                print("Terminating!")
-                exit()
+                self.write(self.current_angle / 100, done=done)
             except ValueError as err:
-                print("ERROR: ValueError {err}")
+                print(f"ERROR: ValueError {err}")
                 print(f"Trying to set angle to {self.current_angle / 100}")
                 print(f"Target is {self.target_angle / 100}")
                 print(f"diff is {diff / 100}")
                 print("I will keep going but this needs resolving!")
-                 
-       
-        if self.widget:
-            self.widget.config(text=self.get_current_angle())
+
+        bus.publish(events.MOVED, self, angle=self.current_angle / 100)
         return True
 
     def reset_leds(self):
@@ -487,8 +639,23 @@ class Servo(Device):
             for led in self.off_leds:
                 led.set(True)
 
+    def write(self, angle, wait=False, done=None):
+        """
+        Sends the angle, in degrees, to the servo, or None to turn it off.
+        Returns False if it failed, in which case the board guard will have reported it.
+        Writes may be queued, see i2c_bus.py; to know if it worked, wait for it,
+        or give done, which is called once it has.
+        """
+        return self.guard.write(i2c_stats.SERVO_WRITE, self.servo, 'angle', angle, wait, done)
+
+    def written(trace, last):
+        # Called once a write of a traced move has reached the board
+        tracer.stamp(trace, 'first')
+        if last:
+            tracer.stamp(trace, 'last')
+
     def quiet(self):
-        self.servo.angle = None
+        self.write(None)
 
 
 """
@@ -537,9 +704,14 @@ class Connector(Device):
         self.desc = desc
         self.x = x
         self.y = y
+        self.run = None     # The connectors in a straight line with this one, see merge_connectors
        
     def draw(self, trackplan):
-        trackplan.line(self.x, self.y, self.offset, config.LINE_COLOUR)
+        # A run of connectors is drawn as one line, by the first in it
+        if not self.run:
+            trackplan.line(self.x, self.y, self.offset, config.LINE_COLOUR)
+        elif self.run[0] is self:
+            trackplan.line(self.x, self.y, self.offset, config.LINE_COLOUR, len(self.run))
 
     def write_to_file(self, f):
         super().write_to_file(f)
@@ -736,16 +908,30 @@ class Led(IOPin):
         super().__init__(board_no, pin_no)
         verify(self.board_no, 0, len(io_boards), 'I/O board number out of range for LED.')
         verify(self.pin_no, 0, 16, 'LED pin number out of range.')
-        if config.ON_LINE:
-            self.led = io_boards[self.board_no].get_pin(self.pin_no)
-            self.led.switch_to_output(value=True)
+        self.guard = io_guards[self.board_no]
+        self.node = remote_node(io_nodes[self.board_no])
+        self.state = False
+        if USE_BUS and not self.node:
+            self.attach()
         self.index = Led.count
         Led.count += 1
+
+    def attach(self):
+        """ Gets the pin on the I/O board, and sets it as it should be. """
+        self.led = io_boards[self.board_no].get_pin(self.pin_no)
+        self.led.switch_to_output(value=not self.state)
        
     def set(self, value):
         """ Sets the LED on or off. """
-        if config.ON_LINE:
-            self.led.value = not value
+        changed = value != self.state
+        self.state = value
+        if self.node:
+            if changed:
+                send_to_node(self.node, dict(action='LED on' if value else 'LED off', servo=self.index))
+        elif USE_BUS:
+            self.guard.write(i2c_stats.LED_WRITE, self.led, 'value', not value)
+        if changed:
+            bus.publish(events.LED_CHANGED, self, state=value)
 
 
 class Relay(IOPin):
@@ -774,16 +960,30 @@ class Relay(IOPin):
         super().__init__(board_no, pin_no)
         verify(self.board_no, 0, len(io_boards), 'I/O board number out of range for relay.')
         verify(self.pin_no, 0, 16, 'Relay pin number out of range.')
-        if config.ON_LINE:
-            self.relay = io_boards[self.board_no].get_pin(self.pin_no)
-            self.relay.switch_to_output(value=True)
+        self.guard = io_guards[self.board_no]
+        self.node = remote_node(io_nodes[self.board_no])
+        self.state = False
+        if USE_BUS and not self.node:
+            self.attach(True)
         self.index = Relay.count
         Relay.count += 1
+
+    def attach(self, value):
+        """ Gets the pin on the I/O board, and sets it to the value. """
+        self.relay = io_boards[self.board_no].get_pin(self.pin_no)
+        self.relay.switch_to_output(value=value)
        
     def set(self, value):
         """ Sets the relay on or off. """
-        if config.ON_LINE:
-            self.relay.value = value
+        changed = value != self.state
+        self.state = value
+        if self.node:
+            if changed:
+                send_to_node(self.node, dict(action='relay on' if value else 'relay off', servo=self.index))
+        elif USE_BUS:
+            self.guard.write(i2c_stats.RELAY_WRITE, self.relay, 'value', value)
+        if changed:
+            bus.publish(events.RELAY_CHANGED, self, state=value)
 
 
 #################################################################################
@@ -813,51 +1013,55 @@ class PButton(IOPin):
         super().__init__(board_no, pin_no)
         verify(self.board_no, 0, len(io_boards), 'I/O board number out of range for button.')
         verify(self.pin_no, 0, 16, 'Button pin number out of range.')
-        if config.ON_LINE:
-            self.button = io_boards[self.board_no].get_pin(self.pin_no)
-            self.button.switch_to_input(pull=digitalio.Pull.UP)
-        self.widget = None
+        self.guard = io_guards[self.board_no]
+        self.node = remote_node(io_nodes[self.board_no])
+        if USE_BUS and not self.node:
+            self.attach()
+        self.was_pressed = False
         self.index = PButton.count
         PButton.count += 1
+
+    def attach(self):
+        """ Gets the pin on the I/O board, as an input. """
+        self.button = io_boards[self.board_no].get_pin(self.pin_no)
+        # The simulated PCF8575 is quasi-bidirectional, so always pulled up
+        self.button.switch_to_input(pull=digitalio.Pull.UP if config.ON_LINE else None)
  
     def get(self):
         """
         Gets the button state.
         Only access the button state through this as it has exception handling
         to deal with issues (hopefully) and for testing with no I2C connected.
+        If the board cannot be read the button counts as not pressed.
         """
-        if not config.ON_LINE:
+        if not USE_BUS or self.node:
             return False
        
-        try:
-            return not self.button.value
-        except OSError:
-            print('ERROR: Got an OSError, possibly because I am trying to read a board that does not exist or is faulty?')
-            print(f'board={self.board} pin={self.pin}')
-            print(e)
+        # Pins are pulled up, so True means not pressed
+        return not self.guard.read(i2c_stats.BUTTON_READ, self.button, 'value', True)
 
-    def check_state(self):
+    def check_state(self, pressed=None, t=None):
         """
         Call this every loop to have the button check its state and act appropriately.        
+        A latency trace is started when the button is first seen to be pressed.
+        The state can be given, if it has already been read, with the time the read started.
         """
-        if self.get():
+        if t is None:
+            t = time.perf_counter()
+        if pressed is None:
+            pressed = self.get()
+        if pressed:
+            trace = None
+            if not self.was_pressed:
+                trace = tracer.start(self, t)
+                tracer.stamp(trace, 'dispatch')
             for servo in self.on_servos:
-                servo.set(True)
+                servo.set(True, trace)
             for servo in self.off_servos:
-                servo.set(False)
-       
-        # This seems not to work reliably because widget can get set to None after is is checked
-        # The exception handling deals with it... by ignoring it
-        if not self.widget:
-            return
-        try:
-            if self.get():
-                self.widget.config(text='ON!', foreground='white', background='black')
-            else:
-                self.widget.config(text='off', background='', foreground='black')
-        except (AttributeError, tk.TclError):
-            # seems to happen when closing the button window
-            print('*')
+                servo.set(False, trace)
+        if pressed != self.was_pressed:
+            bus.publish(events.PRESSED if pressed else events.RELEASED, self)
+        self.was_pressed = pressed
 
 
 
@@ -931,10 +1135,11 @@ class Flasher(Device):
         verify(pin_no, 0, 16, 'LED pin number out of range.')
         self.board_no = board_no
         self.pin_no = pin_no
+        self.guard = io_guards[self.board_no]
+        self.node = remote_node(io_nodes[self.board_no])
         self.state = False
-        if config.ON_LINE:
-            self.led = io_boards[self.board_no].get_pin(self.pin_no)
-            self.led.switch_to_output(value=True)
+        if USE_BUS and not self.node:
+            self.attach()
         self.index = Flasher.count
         Flasher.count += 1
         self.letter = letter
@@ -948,6 +1153,11 @@ class Flasher(Device):
             for c in pattern:
                 self.pattern.append(c == '*')
 
+    def attach(self):
+        """ Gets the pin on the I/O board, and sets it as it should be. """
+        self.led = io_boards[self.board_no].get_pin(self.pin_no)
+        self.led.switch_to_output(value=not self.state)
+
     def id(self):
         """ The ID is the 'board.pin'. """
         return f'{self.board_no}.{self.pin_no}'
@@ -958,14 +1168,12 @@ class Flasher(Device):
 
     def set(self, value):
         """ Sets the LED on or off. """
+        changed = value != self.state
         self.state = value
-        if config.ON_LINE:
-            self.led.value = not value
-        if self.widget:
-            if self.state:
-                self.widget.config(text='ON!', foreground='black', background='#80ff00')
-            else:
-                self.widget.config(text='---', foreground='black', background='#aaaaaa')
+        if USE_BUS and not self.node:
+            self.guard.write(i2c_stats.LED_WRITE, self.led, 'value', not value)
+        if changed:
+            bus.publish(events.FLASHER_CHANGED, self, state=value)
        
        
     def check(self, t):
@@ -1036,17 +1244,67 @@ previous_time = start_time
 
 if config.ON_LINE:
     i2c = board.I2C()  # uses board.SCL and board.SDA
+elif config.SIMULATE:
+    i2c = i2c_sim.SimBus(frequency=config.SIM_BUS_FREQUENCY)
+else:
+    i2c = None
 io_boards = []
 servo_boards = []
 lcd_board = None
 ups_board = None
+# Guards for the boards, in the same order; all I2C access goes through these
+io_guards = []
+servo_guards = []
+lcd_guard = None
+ups_guard = None
+i2c_devices = {}     # Bus number to the addresses found on it when loading
+buses = {}           # Bus number to Bus, for the buses this node's boards are on; see i2c_bus.py
+# With several nodes, the node that owns each board, in the same order; see cluster.py
+io_nodes = []
+servo_nodes = []
+
+lcd_pending = None   # With the async engine, lines waiting to go to the LCD, see write_lcd
 
 def print_lcd(n, s):
     #print(f'LCD{n}: {s}')
     #print(type(lcd_board))
     #print(lcd_board)
-    if config.ON_LINE and lcd_board:
-        lcd_board.lcd_display_string(s, n)
+    if lcd_pending is not None:
+        lcd_pending[n] = s
+        return
+    if USE_BUS and lcd_board:
+        # One extra "character" for setting the position
+        nbytes = i2c_stats.BYTES[i2c_stats.LCD_WRITE] * (len(s) + 1)
+        # Not waited for with the scheduler; a line that has not gone yet is replaced
+        lcd_guard.send(i2c_stats.LCD_WRITE, lcd_board.lcd_display_string, s, n, nbytes=nbytes, key=(lcd_board, n))
+
+
+def write_lcd():
+    """
+    Writes the lines waiting for the LCD. Only the latest for each line is written,
+    so a burst of changes costs one write.
+    """
+    global lcd_pending
+    pending = lcd_pending
+    lcd_pending = None
+    try:
+        for n, s in pending.items():
+            print_lcd(n, s)
+    finally:
+        lcd_pending = {}
+
+
+lcd_power_text = None   # What the LCD shows for the power state
+
+def lcd_power(event):
+    """ Shows the power state on the first line of the LCD when what it shows changes. """
+    global lcd_power_text
+    text = f"{event.data['state'].capitalize()} {round(event.data['voltage'], 1)} V"
+    if text != lcd_power_text:
+        lcd_power_text = text
+        print_lcd(1, text)
+
+bus.subscribe(events.POWER_STATE, lcd_power)
 
 
 servos = []
@@ -1056,21 +1314,36 @@ relays = []
 flashers = []
 io_lists = [leds, buttons, relays, flashers]
 decorators = []
+# Those on this node's boards, which the main loop looks after; the rest are on other nodes
+local_servos = []
+local_buttons = []
+local_flashers = []
+bus_buttons = {}    # Bus to the local buttons on it
 
 trackplan = None
-
-
-request = { 'action':False, 'testing':True}  # User input is done by changing this to request a change
+servo_cells = {}    # Trackplan grid cell to list of servos there, see index_servos
+search_index = SearchIndex()
+i2c_stats_window = None
+latency_window = None
+
+
+requests = queue.SimpleQueue()  # User input is done by adding a request here, see send_request
+terminated = False
+engine_conn = None      # When the engine is in its own process, the GUI sends requests down this
+engine_process = None   # ... and this is it
+state_publisher = None  # In the engine process, writes the state for the GUI to read
+state_follower = None   # In the GUI process, reads it
 loop_count = 0
+power_state = None     # The last state reported by the UPS
+power_reading = None   # The state, voltage and current when it was last reported
+gui_updates = GuiUpdates()
+trackplan_updates = GuiUpdates()    # Servos that have moved, for the trackplan, which updates at its own rate
 
 window = None
 
 comments = None
 
-servo_grid_rows = []
-button_grid_rows = []
-led_grid_rows = []
-flasher_grid_rows = []
+shown_rows = {}     # Device to the grid row showing it, see show_in_row
 
 
 
@@ -1083,27 +1356,25 @@ def save():
     """
     try:
         with open('servo.txt', 'w', encoding="utf-8") as f:
-            # Save the boards
+            # Save the nodes and boards
+            for name, (host, port) in nodes.items():
+                f.write(f'NODE {name} {host}:{port}\n')
+            for guard, node in zip(servo_guards, servo_nodes):
+                f.write(f'S{hex(guard.addr)}{bus_suffix(guard)}{"@" + node if node else ""}\n')
+            for guard, node in zip(io_guards, io_nodes):
+                f.write(f'IO{hex(guard.addr)}{bus_suffix(guard)}{"@" + node if node else ""}\n')
             if config.ON_LINE:
-                for servo_board in servo_boards:
-                    f.write(f'S{hex(servo_board._pca.i2c_device.device_address)}\n')
-                for io_board in io_boards:
-                    f.write(f'IO{hex(io_board.i2c_device.device_address)}\n')
                 if lcd_board:
-                    f.write(f'LCD{hex(lcd_board.lcd_device.addr)}\n')
+                    f.write(f'LCD{hex(lcd_board.lcd_device.addr)}{bus_suffix(lcd_guard)}\n')
                 if ups_board:
                     #f.write(f'UPS{hex(ups_board.addr)}\n')
-                    f.write(f'UPS0x42\n')
+                    f.write(f'UPS0x42{bus_suffix(ups_guard)}\n')
             else:
-                for servo_board in servo_boards:
-                    f.write(f'S{hex(servo_board.addr)}\n')
-                for io_board in io_boards:
-                    f.write(f'IO{hex(io_board.addr)}\n')
                 if lcd_board:
-                    f.write(f'LCD{hex(lcd_board.addr)}\n')
+                    f.write(f'LCD{hex(lcd_board.addr)}{bus_suffix(lcd_guard)}\n')
                 if ups_board:
                     #f.write(f'UPS{hex(ups_board.addr)}\n')
-                    f.write(f'UPS0x42\n')
+                    f.write(f'UPS0x42{bus_suffix(ups_guard)}\n')
 
             # Now save the servos and related data
             for lst in [servos, flashers, decorators]:
@@ -1120,14 +1391,12 @@ def save():
 
 
 
-# We can check devices are connected as they are loaded from file
-# so first get a list of addresses on the I2C bus
-if config.ON_LINE:
-    i2c_devices = i2c.scan()
-    print("INFO: Found I2C devices:", [hex(device_address) for device_address in i2c_devices])
-else:
-    print("WARNING: Running in off-line mode, not connecting to I2C bus.")
+def bus_suffix(guard):
+    """ How servo.txt says which bus the board is on; nothing for the usual one. """
+    return f'/{guard.bus.number}' if guard.bus.number != config.I2C_BUS else ''
+
 
+BOARD_NAMES = {'S':'servo board', 'IO':'I/O board', 'LCD':'LCD', 'UPS':'UPS'}
 
 class fake_board:
     def __init__(self, addr):
@@ -1136,6 +1405,8 @@ class fake_board:
 class fake_ups_board:
     def __init__(self, addr):
         self.addr = addr
+        self.bus_voltage = 7.368
+        self.current = -327.7
     def getBusVoltage_V(self):
         return 7.368
     def getCurrent_mA(self):
@@ -1146,120 +1417,324 @@ def load_device(line):
     Adds an I2C board, given a string.
     The string should consist of the board type identifier - one or more letters in upper case
     followed directly by the addess in hexadecimal (use lower case letters if required!).
+    This can be followed by / and the number of the I2C bus it is on, e.g. S0x40/3 for
+    /dev/i2c-3, otherwise it is on config.I2C_BUS.
+    With several nodes, this can be followed by @ and the node the board is on, otherwise it is on
+    the first node.
    
     This is in a function of its own so we can readily exit it it a problem is encountered.
     """
     
-    md = re.match('([A-Z]+)(?:0x|)([0-9a-f]+)', line)
+    md = re.match(r'([A-Z]+)(?:0x|)([0-9a-f]+)(?:/(\d+))?(?:@(\S+))?', line)
     if not md:
         print('ERROR: Badly formatted line: ' + line)
         return
    
     address = int(md.group(2), 16)
+    number = int(md.group(3)) if md.group(3) else config.I2C_BUS
+    node = md.group(4) or next(iter(nodes), None)
+    if node and node not in nodes:
+        print(f'ERROR: Board on a node with no NODE line: ' + line)
+        exit()
+    if node and node != this_node:
+        # Another node drives it; just keep track of what is on it
+        match md.group(1):
+            case 'S':
+                servo_boards.append(fake_board(address))
+                servo_guards.append(BoardGuard(address, f'servo board on {node}'))
+                servo_nodes.append(node)
+            case 'IO':
+                io_boards.append(fake_board(address))
+                io_guards.append(BoardGuard(address, f'I/O board on {node}'))
+                io_nodes.append(node)
+            case _:
+                return
+        # Not one of ours, so just remembered for saving
+        (servo_guards if md.group(1) == 'S' else io_guards)[-1].bus = Bus(number, None)
+        return
+    if md.group(1) == 'S':
+        servo_nodes.append(node)
+    elif md.group(1) == 'IO':
+        io_nodes.append(node)
+    bus = get_bus(number)
     # If a device not found - other than LCD or UPS - give up
-    if config.ON_LINE and not address in i2c_devices and not md.group(1) in ['LCD', 'UPS']:
+    if USE_BUS and config.ON_LINE and not address in i2c_devices[number] and not md.group(1) in ['LCD', 'UPS']:
         print('ERROR: Device not found: ' + line)
         print('This is not going well; I am giving up!\nYou need to ensure the I2C boards are connected\nand correctly configured in "servo.txt".\nGood luck...')
         exit()
-                        
+    if md.group(1) not in BOARD_NAMES:
+        print('ERROR: Device code not recognised: ' + line)
+        return
+
+    global lcd_board, ups_board, lcd_guard, ups_guard
+    if USE_BUS:
+        board, probe = connect_board(md.group(1), address, bus)
+    elif md.group(1) == 'UPS':
+        board, probe = fake_ups_board(address), None
+    else:
+        board, probe = fake_board(address), None
+    # Each board gets a guard, with a harmless read to probe it if it gets quarantined
+    guard = BoardGuard(address, BOARD_NAMES[md.group(1)], probe)
+    guard.bus = bus
+    match md.group(1):
+        case 'S':
+            servo_boards.append(board)
+            servo_guards.append(guard)
+        case 'IO':
+            io_boards.append(board)
+            io_guards.append(guard)
+        case 'LCD':
+            lcd_board = board
+            lcd_guard = guard
+        case 'UPS':
+            ups_board = board
+            ups_guard = guard
+    print(f'Done')
+
+
+def get_bus(number):
+    """ Gets the bus with the given number, connecting to it the first time. """
+    if number in buses:
+        return buses[number]
+    if not USE_BUS:
+        bus = Bus(number, None)
+    elif number == config.I2C_BUS:
+        bus = Bus(number, i2c)
+    elif config.ON_LINE:
+        try:
+            from adafruit_extended_bus import ExtendedI2C
+        except ModuleNotFoundError as err:
+            print(f"ERROR: ModuleNotFoundError {err}")
+            print(f'Boards on I2C bus {number} need adafruit-extended-bus; type "pip install adafruit-extended-bus", then try again.')
+            exit()
+        bus = Bus(number, ExtendedI2C(number))
+    else:
+        bus = Bus(number, i2c_sim.SimBus(frequency=config.SIM_BUS_FREQUENCY))
+    if USE_BUS and config.ON_LINE:
+        i2c_devices[number] = bus.i2c.scan()
+        print(f"INFO: Found I2C devices on bus {number}:", [hex(device_address) for device_address in i2c_devices[number]])
+    buses[number] = bus
+    return bus
+
+
+def connect_board(code, address, bus):
+    """
+    Connects to a board on the I2C bus, or the simulated one, given its code as in servo.txt.
+    Returns the board, and a function that reads something harmless from it.
+    """
     if config.ON_LINE:
-        match md.group(1):
+        match code:
             case 'S':
-                servo_boards.append(ServoKit(channels=16, address=address))
+                board = ServoKit(channels=16, i2c=bus.i2c, address=address)
+                return board, lambda: board._pca.mode1_reg
             case 'IO':
-                io_boards.append(adafruit_pcf8575.PCF8575(i2c, address))
+                board = adafruit_pcf8575.PCF8575(bus.i2c, address)
+                return board, board.read_gpio
             case 'LCD':
-                global lcd_board
-                lcd_board = I2C_LCD_driver.lcd()
+                board = I2C_LCD_driver.lcd(bus.number)
+                return board, board.lcd_device.read
             case 'UPS':
-                global ups_board
-                ups_board = INA219(i2c, addr=address)
-                #print(ups_board.addr)
-            case _:
-                print('ERROR: Device code not recognised: ' + line)
+                board = INA219(bus.i2c, addr=address)
+                return board, lambda: board.bus_voltage
     else:
-        match md.group(1):
+        # Put a model of the board on the simulated bus, then connect to it just as on-line
+        match code:
             case 'S':
-                servo_boards.append(fake_board(address))
+                bus.i2c.attach(i2c_sim.PCA9685Model(address, latency=config.SIM_LATENCY, fault_rate=config.SIM_FAULT_RATE))
+                board = i2c_sim.ServoKit(bus.i2c, address)
+                return board, lambda: board._pca.mode1_reg
             case 'IO':
-                io_boards.append(fake_board(address))
+                bus.i2c.attach(i2c_sim.PCF8575Model(address, latency=config.SIM_LATENCY, fault_rate=config.SIM_FAULT_RATE))
+                board = i2c_sim.PCF8575(bus.i2c, address)
+                return board, board.read_gpio
             case 'LCD':
-                lcd_board = fake_board(address)
+                bus.i2c.attach(i2c_sim.HD44780Model(address, latency=config.SIM_LATENCY, fault_rate=config.SIM_FAULT_RATE))
+                board = i2c_sim.LCD(bus.i2c, address)
+                return board, board.lcd_device.read
             case 'UPS':
-                ups_board = fake_ups_board(address)
-            case _:
-                print('ERROR: Device code not recognised: ' + line)
-    print(f'Done')
+                bus.i2c.attach(i2c_sim.INA219Model(address, latency=config.SIM_LATENCY, fault_rate=config.SIM_FAULT_RATE))
+                board = i2c_sim.UPS(bus.i2c, address)
+                return board, lambda: board.bus_voltage
 
 
 
 
-try:
+def load(filename):
     """
-    File access can be problematic, so wrap in a try/except block
+    Loads the boards, servos and everything else from the given file.
+    If there is a problem, the program will quit.
     """
-    with open('/home/f2andy/pdmrs/servo.txt', encoding="utf-8") as f:
-        print('opened')
-        servo = None
-        comments = []
-        for line in f:
-            if line.isspace():
-                continue
-            if line[0:1] == '#':
-                comments.append(line)
-            elif line[0:1] == 's':
-                servo = Servo.create(servos, line)
-            elif line[0:1] == '-':
-                Decorator.create(line)
-            elif line[0:1] == 'b':
-                PButton.create(line, servo)
-            elif line[0:1] == 'r':
-                Relay.create(line, servo)
-            elif line[0:1] == 'l':
-                Led.create(line, servo)
-            elif line[0:1] == 'f':
-                Flasher.create(line)
-            else:
-                load_device(line)
-except FileNotFoundError as ex:
-    print(ex)
-    print('ERROR: Failed to open the configuration file, servo.txt.')
-    print('Should be a text file in the same directory as this program.')
-    print('Not much I can do with it, so giving up...')
-    exit()
-except ServoConfigException as ex:
-    print(ex)
-    print('Failed to load data file.')
-    exit()
+    global servo, comments, layout_hash
+
+    # We can check devices are connected as they are loaded from file
+    # so first get a list of addresses on the I2C bus
+    if primary:
+        print("INFO: Standing by, so not connecting to the I2C bus until taking over.")
+    elif config.ON_LINE:
+        print("INFO: Looking for I2C devices on each bus as it is found in servo.txt.")
+    elif config.SIMULATE:
+        print("WARNING: Running in off-line mode, using a simulated I2C bus.")
+    else:
+        print("WARNING: Running in off-line mode, not connecting to I2C bus.")
+
+    try:
+        """
+        File access can be problematic, so wrap in a try/except block
+        """
+        with open(filename, encoding="utf-8") as f:
+            print('opened')
+            servo = None
+            comments = []
+            digest = hashlib.sha1()
+            for line in f:
+                digest.update(line.encode('utf-8'))
+                if line.isspace():
+                    continue
+                if line[0:1] == '#':
+                    comments.append(line)
+                elif line[0:1] == 's':
+                    servo = Servo.create(servos, line)
+                elif line[0:1] == '-':
+                    Decorator.create(line)
+                elif line[0:1] == 'b':
+                    PButton.create(line, servo)
+                elif line[0:1] == 'r':
+                    Relay.create(line, servo)
+                elif line[0:1] == 'l':
+                    Led.create(line, servo)
+                elif line[0:1] == 'f':
+                    Flasher.create(line)
+                elif line[0:5] == 'NODE ':
+                    load_node(line)
+                else:
+                    load_device(line)
+    except FileNotFoundError as ex:
+        print(ex)
+        print('ERROR: Failed to open the configuration file, servo.txt.')
+        print('Should be a text file in the same directory as this program.')
+        print('Not much I can do with it, so giving up...')
+        exit()
+    except ServoConfigException as ex:
+        print(ex)
+        print('Failed to load data file.')
+        exit()
 
+    layout_hash = digest.hexdigest()
+    index_servos()
+    index_local()
+    merge_connectors()
+    TrackPlan.update_transform()
 
-               
-# report how it went for diagostics
-print(f"INFO: Found {len(servo_boards)} servo board(s).")
-print(f"INFO: Found {len(io_boards)} I/O board(s).")
+    # The simulation can be scripted, to set curves for the UPS, inject faults, press buttons, etc.
+    if not config.ON_LINE and config.SIMULATE and config.SIM_SETUP:
+        __import__(config.SIM_SETUP).setup(i2c)
+
+
+def load_node(line):
+    """
+    Adds a node, for a layout shared between several, given a string such as "NODE west 192.168.1.20:8770".
+    These must come before the boards. A node listens for the others on its own address, so use
+    one the others can reach it on, not localhost.
+    """
+    md = re.match(r'NODE (\S+) (\S+):(\d+)', line)
+    if not md:
+        print('ERROR: Badly formatted line for node: ' + line)
+        exit()
+    nodes[md.group(1)] = (md.group(2), int(md.group(3)))
+    if this_node is None:
+        print('ERROR: The layout is shared between nodes, so say which this is, with --node or config.NODE.')
+        exit()
+
+
+def remote_node(node):
+    """ Gets the node a board is on, or None if it is on this one. """
+    return node if node != this_node else None
 
-print(f"INFO: Found {'one' if lcd_board else 'no'} LCD board; sending welcome message.")
-print_lcd(1, "Hello P&D MRS!")
 
-print(f"INFO: Found {'one' if ups_board else 'no'} UPS board.")
+def index_local():
+    """ Finds the servos, buttons and flashers on this node's boards. """
+    if nodes and this_node not in nodes:
+        print(f'ERROR: This node, {this_node}, is not in the layout.')
+        exit()
+    if primary:
+        # Standing by, so the primary is doing it all
+        local_servos[:] = local_buttons[:] = local_flashers[:] = []
+        return
+    local_servos[:] = [servo for servo in servos if not servo.node]
+    local_buttons[:] = [button for button in buttons if not button.node]
+    local_flashers[:] = [flasher for flasher in flashers if not flasher.node]
+    bus_buttons.clear()
+    for button in local_buttons:
+        bus_buttons.setdefault(button.guard.bus, []).append(button)
+
+
+def index_servos():
+    """
+    Builds the index from trackplan grid cell to the servos there, so a click can be
+    matched to a point without checking every servo, and the index for searching.
+    Needs calling again if the graphic for a servo changes.
+    """
+    servo_cells.clear()
+    for servo in servos:
+        for cell in servo.cells():
+            servo_cells.setdefault(cell, []).append(servo)
+        search_index.add(servo, servo.search_strings())
+
 
-print(f"INFO: Found {len(servos)} servo(s).")
-print(f"INFO: Found {len(buttons)} button(s).")
-print(f"INFO: Found {len(leds)} indicator LED(s).")
-print(f"INFO: Found {len(relays)} relay(s).")
-print(f"INFO: Found {len(flashers)} flashing LED(s).")
-for servo in servos:
-    servo.sanity_check()
+def merge_connectors():
+    """
+    Finds connectors that carry on from each other in a straight line,
+    and gives each the list of connectors in its run, from the left,
+    so the run can be drawn as a single line.
+    """
+    starts = {}
+    for el in decorators:
+        if isinstance(el, Connector):
+            el.run = None
+            # If two are in the same place, the second is just drawn on its own
+            starts.setdefault((el.x, el.y, el.offset), el)
+
+    for conn in starts.values():
+        if (conn.x - 1, conn.y - conn.offset, conn.offset) in starts:
+            # Not the first in its run
+            continue
+        run = [conn]
+        key = (conn.x + 1, conn.y + conn.offset, conn.offset)
+        while key in starts:
+            run.append(starts[key])
+            key = (key[0] + 1, key[1] + conn.offset, conn.offset)
+        for el in run:
+            el.run = run
+
+
+def report():
+    """ Reports how loading went for diagnostics, and checks the servos make sense. """
+    print(f"INFO: Found {len(servo_boards)} servo board(s).")
+    print(f"INFO: Found {len(io_boards)} I/O board(s).")
+
+    print(f"INFO: Found {'one' if lcd_board else 'no'} LCD board; sending welcome message.")
+    print_lcd(1, "Hello P&D MRS!")
+
+    print(f"INFO: Found {'one' if ups_board else 'no'} UPS board.")
+
+    print(f"INFO: Found {len(servos)} servo(s).")
+    print(f"INFO: Found {len(buttons)} button(s).")
+    print(f"INFO: Found {len(leds)} indicator LED(s).")
+    print(f"INFO: Found {len(relays)} relay(s).")
+    print(f"INFO: Found {len(flashers)} flashing LED(s).")
+    for servo in servos:
+        servo.sanity_check()
 
-print(f"INFO: Passed sanity check.")
+    print(f"INFO: Passed sanity check.")
 
        
 
 #################################################################################
 # COMMAND LINE
 
-# For testing it is good to be able to type requests to set the servo, and this function handles that
-# It runs in its own thread, and sets the global variable "request" when a request is made
+# For testing it is good to be able to type requests to set the servo, and these functions handle that
+# Commands come from the control socket (see control.py and servoctl.py), on its own threads,
+# and are passed on to the main loop with send_request
 patterns = [
     re.compile("^(exit|quit|x)$", re.IGNORECASE),
     re.compile("^(\\d+) (\\d+)$"),
@@ -1268,6 +1743,70 @@ patterns = [
     re.compile("^l(\\d+) on$", re.IGNORECASE),
     re.compile("^l(\\d+) off$", re.IGNORECASE),
 ]
+control_server = None
+
+
+def parse_command(s):
+    """ Gets the request for a command, or raises ValueError if it is not understood or out of range. """
+    if patterns[0].match(s):
+        return {'action':'terminate'}
+    for i, action in ((1, 'angle'), (2, 'on'), (3, 'off')):
+        md = patterns[i].match(s)
+        if md:
+            n = int(md.group(1))
+            if n >= len(servos):
+                raise ValueError(f'Servo out of range (0-{len(servos) - 1}): {s}')
+            if action == 'angle':
+                angle = int(md.group(2))
+                if angle > 180:
+                    raise ValueError(f'Angle out of range (0-180): {s}')
+                return {'action':action, 'servo':n, 'angle':angle}
+            return {'action':action, 'servo':n}
+    for i, action in ((4, 'LED on'), (5, 'LED off')):
+        md = patterns[i].match(s)
+        if md:
+            n = int(md.group(1))
+            if n >= len(leds):
+                raise ValueError(f'LED out of range (0-{len(leds) - 1}): {s}')
+            return {'action':action, 'servo':n}
+    raise ValueError(f'Not understood: {s}')
+
+
+def execute_commands(commands, allow_exit=True):
+    """
+    Checks the commands, then has the main loop do them all in one pass, or none of them if any is bad.
+    """
+    lst = [parse_command(s) for s in commands]
+    if not allow_exit and any(request['action'] == 'terminate' for request in lst):
+        raise ValueError('Cannot exit from here')
+    if len(lst) == 1:
+        send_request(**lst[0])
+    elif lst:
+        send_request('batch', requests=lst)
+
+
+def start_control_server():
+    """ Listens for commands on the control socket, if there is one, on its own thread. """
+    global control_server
+    if not config.CONTROL_SOCKET:
+        return
+    try:
+        control_server = ControlServer(config.CONTROL_SOCKET, execute_commands)
+    except OSError as ex:
+        print(f'WARNING: Could not open the control socket, so carrying on without it: {ex}')
+        return
+    thread = Thread(target=control_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print(f'INFO: Listening for commands on {config.CONTROL_SOCKET}')
+
+
+def stop_control_server():
+    global control_server
+    if control_server:
+        control_server.shutdown()
+        control_server.server_close()
+        control_server = None
 
 
 
@@ -1275,193 +1814,1376 @@ patterns = [
 #################################################################################
 # MAIN LOOP
 
-def main_loop():
+def resync(guard):
     """
-    Handles time,
-    checks if buttons have been pressed,
-    responds to requests from the command line/GUI,
-    moves servo...
-    But most of the work is done elsewhere.
+    Sends the current state to every device on the board with the given guard,
+    used when a board comes out of quarantine.
     """
-    global previous_time, loop_count
-    print('INFO: Starting the main loop.')
-    while not request['action'] == 'terminate':
-   
-        # HANDLE TIME
-        now_time = time.time()
-        elapsed = now_time - previous_time
-        previous_time = now_time
-        increment = config.TIME_FACTOR * elapsed
-       
-        # If the GUI is up, then count_label is a Label object
-        # and can be updated with the loop count to show it is going
-        # and indicate how fast. Cap at a million so no chance of overflow.
-        if window and window.count_label:
-            try:
-                window.count_label.config(text=str(loop_count))
-            except tk.TclError:
-                # Seems to happen when quiting, I guess if the label is destroyed after the test
-                # but part way through the tkinter stuff.
-                print('*')
-            loop_count += 1
-            if loop_count > 999999:
-                loop_count = 0
+    for servo in servos:
+        if servo.guard is guard:
+            servo.needs_sync = True
+    for lst in [leds, relays, flashers]:
+        for el in lst:
+            if el.guard is guard:
+                el.set(el.state)
 
-       
-        # HANDLE UPS
-        # Only do this every 100 loops; it is not going to change much
-        # Get values from device
-        # If below config.SHUTDOWN_AT% and draining, shutdown
-        # Otherwise report to GUI
-        # https://github.com/adafruit/Adafruit_CircuitPython_INA219/blob/main/examples/ina219_simpletest.py
-        if loop_count % 100 == 0 and ups_board:
-            bus_voltage = ups_board.bus_voltage            # voltage on V- (load side)
-            current = ups_board.current                    # current in mA
-            if window and window.power_label:
-                #print(f"v(bus)={'%.2f' % bus_voltage}, I={'%.2f' % current}")
-                try:
-                    if current < config.ON_BATTERY:
-                        window.power_label.config(text=f'On batteries, at {round(bus_voltage, 2)} V')
-                        #print('draining')
-                        if bus_voltage < config.SHUTDOWN_VOLTAGE:
-                            print("Battery supply about to expire - shutting down.")
-                            os.system(f". {config.SHUTDOWN_FILE}")
-                    elif current > config.CHARGING:
-                        window.power_label.config(text=f'Battery charging, at {round(bus_voltage, 2)} V')
-                        #print('charging')
-                    else:
-                        window.power_label.config(text=f'Power normal, at {round(bus_voltage, 2)} V')
-                        #print('normal')
-                except tk.TclError:
-                    print('*')
-            # also want to do LCD
-
-
-        # HANDLE INPUTS
-        for button in buttons:
-            button.check_state()
-       
-           
-        # HANDLE INPUT REQUESTS
-        if request['action'] == 'angle':
-            if request['servo'] >= len(servos):
-                print("WARNING: Servo out of range (0-" + str(len(servos)) + ")")
-            else:
-                servos[request['servo']].set_angle(request['angle'])
-            request['action'] = False
 
-        if request['action'] == 'on':
-            if request['servo'] >= len(servos):
-                print("WARNING: Servo out of range (0-" + str(len(servos)) + ")")
-            else:
-                servos[request['servo']].set(True)
-            request['action'] = False
+def send_request(action, **kwargs):
+    """
+    Asks the main loop to do something, such as turn a servo on, from another thread or process.
+    Requests are dictionaries, with the action and whatever else it needs, usually "servo", the index.
+    """
+    request = dict(action=action, **kwargs)
+    if engine_conn:
+        try:
+            engine_conn.send(request)
+        except (BrokenPipeError, OSError):
+            print(f"ERROR: The engine process has gone, so cannot do: {request}")
+    else:
+        requests.put(request)
 
-        if request['action'] == 'off':
-            if request['servo'] >= len(servos):
-                print("WARNING: Servo out of range (0-" + str(len(servos)) + ")")
-            else:
-                servos[request['servo']].set(False)
-            request['action'] = False
 
-        if request['action'] == 'LED on':
-            if request['servo'] >= len(leds):
-                print("WARNING: LED out of range (0-" + str(len(leds)) + ")")
-            else:
-                leds[request['servo']].set(True)
-                if config.REPORT_SERVO_SWITCHING:
-                    ident = leds[request['servo']].id()
-                    print(f'INFO: LED on {ident}')
-            request['action'] = False
-        if request['action'] == 'LED off':
-            if request['servo'] >= len(leds):
-                print("WARNING: LED out of range (0-" + str(len(leds)) + ")")
-            else:
-                leds[request['servo']].set(False)
-                if config.REPORT_SERVO_SWITCHING:
-                    ident = leds[request['servo']].id()
-                    print(f'INFO: LED off {ident}')
-            request['action'] = False
-        if request['action'] == 'all LED on':
-            for led in leds:
-                led.set(True)
-            request['action'] = False
-        if request['action'] == 'all LED off':
-            for led in leds:
-                led.set(False)
-            request['action'] = False
+def handle_request(request):
+    """ Does what was asked. Called by the main loop, which is the only thing that touches the hardware. """
+    global terminated
+    if primary and request['action'] not in ('replica', 'take over', 'terminate'):
+        print(f"WARNING: Standing by, so leaving it to the primary: {request}")
+        return
+    if request['action'] == 'angle':
+        if request['servo'] >= len(servos):
+            print("WARNING: Servo out of range (0-" + str(len(servos)) + ")")
+        else:
+            servos[request['servo']].set_angle(request['angle'])
+    elif request['action'] == 'on':
+        if request['servo'] >= len(servos):
+            print("WARNING: Servo out of range (0-" + str(len(servos)) + ")")
+        else:
+            servos[request['servo']].set(True)
+    elif request['action'] == 'off':
+        if request['servo'] >= len(servos):
+            print("WARNING: Servo out of range (0-" + str(len(servos)) + ")")
+        else:
+            servos[request['servo']].set(False)
+    elif request['action'] == 'LED on':
+        if request['servo'] >= len(leds):
+            print("WARNING: LED out of range (0-" + str(len(leds)) + ")")
+        else:
+            leds[request['servo']].set(True)
+            if config.REPORT_SERVO_SWITCHING:
+                ident = leds[request['servo']].id()
+                print(f'INFO: LED on {ident}')
+    elif request['action'] == 'LED off':
+        if request['servo'] >= len(leds):
+            print("WARNING: LED out of range (0-" + str(len(leds)) + ")")
+        else:
+            leds[request['servo']].set(False)
+            if config.REPORT_SERVO_SWITCHING:
+                ident = leds[request['servo']].id()
+                print(f'INFO: LED off {ident}')
+    elif request['action'] == 'all LED on':
+        for led in leds:
+            led.set(True)
+    elif request['action'] == 'all LED off':
+        for led in leds:
+            led.set(False)
+    elif request['action'] == 'centre':
+        servos[request['servo']].centre()
+    elif request['action'] == 'angles':
+        # Up/Down in the GUI, which has already worked out the new values
+        servo = servos[request['servo']]
+        servo.off_angle = request['off']
+        servo.centre_angle = request['centre']
+        servo.on_angle = request['on']
+        servo.target_angle = request['target']
+        if servo.node:
+            send_to_node(servo.node, request)
+    elif request['action'] == 'relay on':
+        relays[request['servo']].set(True)
+    elif request['action'] == 'relay off':
+        relays[request['servo']].set(False)
+    elif request['action'] == 'replica':
+        apply_replica(request['message'])
+    elif request['action'] == 'take over':
+        take_over()
+    elif request['action'] == 'quiet':
+        Servo.quiet_all()
+    elif request['action'] == 'batch':
+        # From the control socket; all done now, so in the same pass of the main loop
+        for r in request['requests']:
+            handle_request(r)
+    elif request['action'] == 'terminate':
+        terminated = True
+    else:
+        print(f"WARNING: Unknown request: {request}")
 
 
-        # HANDLE FLASHERS
-        if loop_count % 100 == 10:
-            t = (time.time() - start_time) * 10
-            for flasher in flashers:
-                flasher.check(t)
+def power_text(state, voltage):
+    """ Describes the power state for the GUI. """
+    if state == 'battery':
+        return f'On batteries, at {round(voltage, 2)} V'
+    if state == 'charging':
+        return f'Battery charging, at {round(voltage, 2)} V'
+    return f'Power normal, at {round(voltage, 2)} V'
 
 
-        # HANDLE SERVOS
-        moving_flag = False;
-        for servo in servos:
+def check_ups():
+    """
+    Gets values from the UPS.
+    If below config.SHUTDOWN_AT% and draining, shutdown
+    Otherwise report to GUI, etc. if the state or voltage has changed
+    https://github.com/adafruit/Adafruit_CircuitPython_INA219/blob/main/examples/ina219_simpletest.py
+    """
+    global power_state, power_reading
+    if primary:
+        # Still the primary's UPS
+        return
+    bus_voltage = ups_guard.read(i2c_stats.UPS_READ, ups_board, 'bus_voltage')    # voltage on V- (load side)
+    current = ups_guard.read(i2c_stats.UPS_READ, ups_board, 'current')            # current in mA
+    if bus_voltage is not None and current is not None:
+        #print(f"v(bus)={'%.2f' % bus_voltage}, I={'%.2f' % current}")
+        if current < config.ON_BATTERY:
+            state = 'battery'
+            #print('draining')
+            if bus_voltage < config.SHUTDOWN_VOLTAGE:
+                print("Battery supply about to expire - shutting down.")
+                os.system(f". {config.SHUTDOWN_FILE}")
+        elif current > config.CHARGING:
+            state = 'charging'
+            #print('charging')
+        else:
+            state = 'normal'
+            #print('normal')
+        # The voltage changes a little with almost every reading, so only report it
+        # when the state changes or the voltage has really moved
+        if power_reading and state == power_reading[0] and abs(bus_voltage - power_reading[1]) < config.POWER_HYSTERESIS:
+            return
+        power_reading = (state, bus_voltage, current)
+        power_state = power_text(state, bus_voltage)
+        bus.publish(events.POWER_STATE, ups_board, state=state, voltage=bus_voltage, current=current, text=power_state)
+
+
+def check_recovered():
+    """
+    A board that was quarantined needs to be told what it should be doing.
+    Returns True if any has recovered, as servos may need to move.
+    """
+    recovered = False
+    while not i2c_guard.recovered.empty():
+        resync(i2c_guard.recovered.get())
+        recovered = True
+    return recovered
+
+
+def check_buttons():
+    """ Reads the buttons, and sets the servos for any pressed. Returns True if any is pressed. """
+    pressed = False
+    if USE_BUS and (len(buses) > 1 or config.I2C_SCHEDULER):
+        # Each bus reads its buttons at the same time, then we act on them in order
+        t = time.perf_counter()
+        futures = [bus.submit(i2c_stats.BUTTON_READ, None, partial(read_buttons, lst)) for bus, lst in bus_buttons.items()]
+        readings = {}
+        for future in futures:
+            readings.update(future.result())
+        for button in local_buttons:
+            button.check_state(readings[button], t)
+            if button.was_pressed:
+                pressed = True
+        return pressed
+    for button in local_buttons:
+        button.check_state()
+        if button.was_pressed:
+            pressed = True
+    return pressed
+
+
+def read_buttons(lst):
+    """
+    Reads the buttons, on the worker for their bus. Each board is read once, for all its pins,
+    so polling leaves the bus free for the servos; if a board cannot be read, its buttons count
+    as not pressed, as with PButton.get.
+    """
+    ports = {}
+    for button in lst:
+        if button.board_no not in ports:
+            ports[button.board_no] = button.guard.call(i2c_stats.BUTTON_READ, io_boards[button.board_no].read_gpio)
+    # Pins are pulled up, so 0 means pressed
+    return {button:ports[button.board_no] is not None and not ports[button.board_no] & (1 << button.pin_no) for button in lst}
+
+
+def handle_requests():
+    with together(buses.values()):
+        while not requests.empty():
+            handle_request(requests.get())
+
+
+def check_flashers():
+    t = (time.time() - start_time) * 10
+    with together(buses.values()):
+        for flasher in local_flashers:
+            flasher.check(t)
+
+
+def move_servos(increment):
+    """ Moves the servos on by the increment. Returns True if any is still moving. """
+    moving_flag = False;
+    if config.I2C_SCHEDULER:
+        # Buttons read meanwhile go ahead of the frames still waiting
+        for bus in buses.values():
+            bus.drain(i2c_bus.SERVO)
+    with together(buses.values()):
+        for servo in local_servos:
             if servo.adjust(increment):
                 moving_flag = True
+    return moving_flag
 
 
-        if loop_count % 100 == 50 and trackplan:
-            trackplan.redraw()
+def count_loop():
+    """
+    The GUI shows the loop count to show it is going and indicate how fast.
+    Cap at a million so no chance of overflow.
+    The count goes up with or without the GUI as the UPS, etc. depend on it.
+    """
+    global loop_count
+    loop_count += 1
+    if loop_count > 999999:
+        loop_count = 0
 
-        time.sleep(config.SLEEP)
 
-    print("INFO: Main loop terminated.")
+def tick():
+    """
+    Does one pass of the main loop:
+    handles time,
+    checks if buttons have been pressed,
+    responds to requests from the command line/GUI,
+    moves servo...
+    But most of the work is done elsewhere.
+    """
+    global previous_time
 
- 
-# We have the main_loop on a separate thread. It is set to a daemon thread so
-# should ensure it stops when the main thread ends
+    # HANDLE TIME
+    now_time = time.time()
+    elapsed = now_time - previous_time
+    previous_time = now_time
+    increment = config.TIME_FACTOR * elapsed
+    count_loop()
 
-main_thread = Thread(target = main_loop)
-main_thread.daemon = True
-main_thread.start()
+    # HANDLE UPS
+    # Only do this every 100 loops; it is not going to change much
+    if loop_count % 100 == 0 and ups_board:
+        check_ups()
 
-print("INFO: Main loop thread started.")
+    # HANDLE RECOVERED BOARDS
+    check_recovered()
 
+    # HANDLE INPUTS
+    check_buttons()
 
+    # HANDLE INPUT REQUESTS
+    handle_requests()
 
+    # HANDLE FLASHERS
+    if loop_count % 100 == 10:
+        check_flashers()
 
+    # HANDLE SERVOS
+    return move_servos(increment)
 
 
-######################################################################
-# GUI
+def main_loop():
+    """
+    Calls tick repeatedly until the GUI asks for it to terminate.
+    """
+    print('INFO: Starting the main loop.')
+    while not terminated:
+        tick()
+        if state_publisher:
+            state_publisher.tick()
+        heartbeat()
+        time.sleep(config.SLEEP)
+
+    print("INFO: Main loop terminated.")
+
+
+def run_engine():
+    """ Runs the engine until told to terminate, as one loop or as coroutines; see config.ASYNC_ENGINE. """
+    if config.ASYNC_ENGINE:
+        asyncio.run(AsyncEngine().run())
+    else:
+        main_loop()
+    # With the scheduler, the last writes may still be waiting
+    for bus in buses.values():
+        bus.finish()
 
 
-class ButtonsWindow(tk.Toplevel):
+def start_main_loop():
     """
-    Define a special child window that stops buttons trying to update labels in it when it is destroyed.
-    More specifically, it sets the widget in the buttons to None, and then tells each row to
-    destroy the label. Hopefully the program will then exit gracefully.
+    We have the main_loop on a separate thread. It is set to a daemon thread so
+    should ensure it stops when the main thread ends
     """
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-       
-    def destroy(self):
-        for i in range(len(buttons)):
-            buttons[i].set_widget(None)        
-        for row in button_grid_rows:
-            row.destroy_button()
-        return super().destroy()
+    main_thread = Thread(target = run_engine)
+    main_thread.daemon = True
+    main_thread.start()
 
+    print("INFO: Main loop thread started.")
+    return main_thread
 
-class TrackPlan(tk.Toplevel):
+
+def wait_for_engine(main_thread):
     """
+    Without the GUI, waits for the main loop to stop, when told to by the control socket,
+    Ctrl-C or a SIGTERM, or if it fails.
     """
-    def show():
-        global trackplan
-        if not trackplan:
-            trackplan = TrackPlan(window)
-            trackplan.redraw(True)
-            trackplan.geometry("+%d+%d" %(10,80))       
-       
-       
-    def left_click(event):
-        TrackPlan._mouse_click(event, False)
+    signal.signal(signal.SIGTERM, lambda signum, frame: send_request('terminate'))
+    try:
+        while main_thread.is_alive():
+            main_thread.join(0.5)
+    except KeyboardInterrupt:
+        send_request('terminate')
+        main_thread.join(5)
+
+
+
+
+#################################################################################
+# ASYNC RUNTIME
+# With config.ASYNC_ENGINE, rather than one loop doing everything and checking loop_count
+# to decide what is due, each part of the engine is a coroutine that runs at its own rate,
+# and the event loop sleeps until something is due.
+# Anything that touches the boards or the state of the servos, etc. is run on a single
+# thread, the I2C executor, so just as with the main loop, only one thread ever does that.
+
+class AsyncEngine:
+    """
+    Runs the buttons, servos, flashers, UPS, LCD, requests and status as coroutines.
+    Adding another is just a matter of adding a coroutine in run.
+    """
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='i2c')
+
+    async def run(self):
+        global lcd_pending
+        print('INFO: Starting the async engine.')
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()     # Set when servos may need to move
+        self.stopped = asyncio.Event()
+        lcd_pending = {}
+        coroutines = [
+            self.serve_requests(),
+            self.move_servos(),
+            self.every('buttons', config.BUTTON_PERIOD, check_buttons),
+            self.every('recovered boards', config.I2C_PROBE_INTERVAL / 4, check_recovered),
+            self.every('flashers', config.FLASHER_PERIOD, check_flashers),
+            self.every('heartbeat', config.HEARTBEAT_INTERVAL, heartbeat),
+        ]
+        if ups_board:
+            coroutines.append(self.every('UPS', config.UPS_PERIOD, check_ups))
+        if lcd_board:
+            coroutines.append(self.every('LCD', config.LCD_PERIOD, write_lcd))
+        if state_publisher:
+            coroutines.append(self.every('status', config.STATUS_PERIOD, state_publisher.tick))
+        tasks = [asyncio.create_task(c) for c in coroutines]
+
+        await self.stopped.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.executor.shutdown()
+        lcd_pending = None
+        print("INFO: Async engine terminated.")
+
+    async def i2c(self, fn, *args):
+        """ Runs the function on the I2C thread, and waits for it. """
+        return await self.loop.run_in_executor(self.executor, fn, *args)
+
+    async def every(self, name, period, fn):
+        """
+        Calls the function on the I2C thread every period seconds; if it returns True servos may need to move.
+        If it falls behind it skips rather than trying to catch up.
+        """
+        next_time = self.loop.time()
+        while True:
+            try:
+                if await self.i2c(fn):
+                    self.wake.set()
+            except Exception:
+                print(traceback.format_exc())
+                print(f'ERROR: The {name} failed; carrying on.')
+            next_time += period
+            delay = next_time - self.loop.time()
+            if delay < 0:
+                next_time -= delay
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def move_servos(self):
+        """ Moves the servos every config.SERVO_PERIOD while any are moving, otherwise waits to be woken. """
+        global previous_time
+        previous_time = time.time()
+        while True:
+            # Clear first, so nothing that happens while the servos are moved is missed
+            self.wake.clear()
+            now_time = time.time()
+            increment = config.TIME_FACTOR * (now_time - previous_time)
+            previous_time = now_time
+            count_loop()
+            if await self.i2c(move_servos, increment):
+                await asyncio.sleep(config.SERVO_PERIOD)
+            else:
+                await self.wake.wait()
+                previous_time = time.time()
+
+    async def serve_requests(self):
+        """ Does the requests from the GUI, etc. as they arrive. """
+        inbox = asyncio.Queue()
+
+        def forward():
+            # The queue is not asyncio's, so wait for it on a thread of its own
+            while True:
+                request = requests.get()
+                self.loop.call_soon_threadsafe(inbox.put_nowait, request)
+
+        Thread(target=forward, daemon=True).start()
+        while not terminated:
+            request = await inbox.get()
+            try:
+                await self.i2c(handle_request, request)
+            except Exception:
+                print(traceback.format_exc())
+                print(f'ERROR: Request failed; carrying on: {request}')
+            self.wake.set()
+        self.stopped.set()
+
+
+
+
+#################################################################################
+# SEPARATE PROCESSES
+# With config.SEPARATE_GUI, the main loop runs in its own process, so the GUI cannot slow it down.
+# The engine writes the state of everything to shared memory (see state_block.py), and the
+# GUI process reads it and publishes events on its own bus, so the windows work as they
+# always have. Requests from the GUI go the other way, down a pipe.
+# The same state is also written to config.STATUS_FILE, if set, for monitor.py and the like,
+# so they can see what is going on without going near the I2C bus.
+
+def servo_flags(servo):
+    """ The state of the servo, as the flags in state_block.py. """
+    flags = 0
+    if servo.turn_on:
+        flags |= state_block.TURN_ON
+    if servo.centred:
+        flags |= state_block.CENTRED
+    if servo.moving:
+        flags |= state_block.MOVING
+    if servo.guard.quarantined:
+        flags |= state_block.QUARANTINED
+    return flags
+
+
+class StatePublisher:
+    """
+    Writes the state to one or more blocks as it changes, in the engine.
+    Only written to from the main loop, as the events come from there.
+    """
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.rate = 0.0
+        self.rate_count = loop_count
+        self.rate_time = time.time()
+        for servo in servos:
+            self.write_servo(servo)
+        for block in blocks:
+            for button in buttons:
+                block.set_button(button.index, button.was_pressed)
+            for led in leds:
+                block.set_led(led.index, led.state)
+            for relay in relays:
+                block.set_relay(relay.index, relay.state)
+            for flasher in flashers:
+                block.set_flasher(flasher.index, flasher.state)
+        self.handlers = [
+            (events.MOVE_STARTED, self.servo_changed),
+            (events.MOVED, self.servo_changed),
+            (events.SETTLED, self.servo_changed),
+            (events.PRESSED, self.button_changed),
+            (events.RELEASED, self.button_changed),
+            (events.LED_CHANGED, self.led_changed),
+            (events.RELAY_CHANGED, self.relay_changed),
+            (events.FLASHER_CHANGED, self.flasher_changed),
+            (events.POWER_STATE, self.power_changed),
+        ]
+        for kind, fn in self.handlers:
+            bus.subscribe(kind, fn)
+
+    def write_servo(self, servo):
+        flags = servo_flags(servo)
+        for block in self.blocks:
+            block.set_servo(servo.index, servo.current_angle / 100, servo.target_angle / 100, flags)
+
+    def servo_changed(self, event):
+        self.write_servo(event.source)
+
+    def button_changed(self, event):
+        for block in self.blocks:
+            block.set_button(event.source.index, event.kind == events.PRESSED)
+
+    def led_changed(self, event):
+        for block in self.blocks:
+            block.set_led(event.source.index, event.data['state'])
+
+    def relay_changed(self, event):
+        for block in self.blocks:
+            block.set_relay(event.source.index, event.data['state'])
+
+    def flasher_changed(self, event):
+        for block in self.blocks:
+            block.set_flasher(event.source.index, event.data['state'])
+
+    def power_changed(self, event):
+        for block in self.blocks:
+            block.set_power(event.data['state'], event.data['voltage'], event.data['current'])
+
+    def tick(self):
+        """ Called after each pass of the main loop; works out the loops per second once a second. """
+        now = time.time()
+        if now - self.rate_time >= 1.0:
+            self.rate = ((loop_count - self.rate_count) % 1000000) / (now - self.rate_time)
+            self.rate_count = loop_count
+            self.rate_time = now
+        for block in self.blocks:
+            block.set_loop(loop_count, self.rate)
+
+    def stop(self):
+        for kind, fn in self.handlers:
+            bus.unsubscribe(kind, fn)
+
+
+class StateFollower:
+    """
+    Keeps the servos, buttons, etc. in the GUI process in step with the block the engine writes,
+    publishing events on the bus here for anything that has changed.
+    Call follow from the GUI thread, before flushing.
+    If the engine is writing too often to get a consistent read, follow skips the frame.
+    """
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # The engine created it and will remove it; stop Python here thinking it has leaked
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.block = StateBlock(self.shm.buf)
+        if self.block.counts != state_counts():
+            raise ServoConfigException('The engine and GUI have loaded different layouts')
+        self.seq = None
+        self.servos = [None] * len(servos)    # Servo records as last read
+        self.power = None
+
+    def follow(self):
+        global loop_count
+        if self.block.sequence() == self.seq:
+            return
+        try:
+            state = self.block.snapshot()
+        except TimeoutError:
+            # Such as the engine stalling mid-write; try again next frame
+            return
+        self.seq = state['seq']
+        loop_count = state['loop_count']
+
+        for servo, record in zip(servos, state['servos']):
+            if record == self.servos[servo.index]:
+                continue
+            self.servos[servo.index] = record
+            current, target, flags = record
+            servo.current_angle = current * 100
+            servo.target_angle = target * 100
+            servo.turn_on = bool(flags & state_block.TURN_ON)
+            servo.centred = bool(flags & state_block.CENTRED)
+            servo.moving = bool(flags & state_block.MOVING)
+            bus.publish(events.MOVED, servo, angle=current)
+
+        for button, pressed in zip(buttons, state['buttons']):
+            if button.was_pressed != bool(pressed):
+                button.was_pressed = bool(pressed)
+                bus.publish(events.PRESSED if pressed else events.RELEASED, button)
+        for lst, values, kind in ((leds, state['leds'], events.LED_CHANGED),
+                                  (relays, state['relays'], events.RELAY_CHANGED),
+                                  (flashers, state['flashers'], events.FLASHER_CHANGED)):
+            for device, value in zip(lst, values):
+                if device.state != bool(value):
+                    device.state = bool(value)
+                    bus.publish(kind, device, state=device.state)
+
+        power = (state['power_state'], state['ups_voltage'], state['ups_current'])
+        if power != self.power and power[0] != 'unknown':
+            self.power = power
+            bus.publish(events.POWER_STATE, ups_board, state=power[0], voltage=power[1], current=power[2],
+                        text=power_text(power[0], power[1]))
+
+    def close(self):
+        self.block = None
+        self.shm.close()
+
+
+def state_counts():
+    """ Gets the numbers of servos, buttons, LEDs, relays and flashers, as a state block needs them. """
+    return (len(servos), len(buttons), len(leds), len(relays), len(flashers))
+
+
+def open_status_file():
+    """
+    Creates the status file and gets a block for it, or None if it cannot be created.
+    It is made under another name then renamed, so a monitor never sees it half made.
+    """
+    filename = config.STATUS_FILE
+    counts = state_counts()
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename + '.new', 'w+b') as f:
+            f.truncate(state_block.size(*counts))
+            block = StateBlock(mmap.mmap(f.fileno(), 0), counts)
+        os.replace(filename + '.new', filename)
+    except OSError as ex:
+        print(f'WARNING: Could not create the status file, so carrying on without it: {ex}')
+        return None
+    print(f'INFO: Writing the state to {filename}')
+    return block
+
+
+def start_publishing(blocks):
+    """ Starts writing the state to the given blocks, and the status file if there is one. """
+    global state_publisher
+    if config.STATUS_FILE:
+        block = open_status_file()
+        if block:
+            blocks = blocks + [block]
+    if blocks:
+        state_publisher = StatePublisher(blocks)
+
+
+def remove_status_file():
+    """ Removes the status file, so monitors know ServoMaster has stopped. """
+    if config.STATUS_FILE:
+        try:
+            os.remove(config.STATUS_FILE)
+        except OSError:
+            pass
+
+
+stream_server = None
+dashboard = None
+streams = []        # The stream server and dashboard, whichever are running
+
+
+def stream_snapshot():
+    """ The state of everything, for a follower that has just connected to the stream. """
+    power = None
+    if power_reading:
+        power = power_fields(*power_reading, power_state)
+    return {
+        't':'snapshot',
+        'servos':[{'i':servo.index, 'id':servo.id(), 'desc':servo.desc or '', 'on':int(servo.turn_on),
+                   'c':int(servo.centred), 'm':int(servo.moving), 'a':round(servo.current_angle / 100, 1)} for servo in servos],
+        'buttons':[int(button.was_pressed) for button in buttons],
+        'leds':[int(led.state) for led in leds],
+        'power':power,
+    }
+
+
+def stream_publish(message):
+    for stream in streams:
+        stream.publish(message)
+
+
+def stream_servo(event):
+    servo = event.source
+    stream_publish({'t':'s', 'i':servo.index, 'on':int(servo.turn_on), 'c':int(servo.centred),
+                    'm':int(servo.moving), 'a':round(servo.current_angle / 100, 1)})
+
+
+def stream_button(event):
+    stream_publish({'t':'b', 'i':event.source.index, 'p':int(event.kind == events.PRESSED)})
+
+
+def stream_led(event):
+    stream_publish({'t':'l', 'i':event.source.index, 'v':int(event.data['state'])})
+
+
+def power_fields(state, voltage, current, text):
+    """ The power state as streamed, the same in the snapshot as in the changes. """
+    return {'state':state, 'v':round(voltage, 2), 'ma':round(current), 'text':text}
+
+
+def stream_power(event):
+    stream_publish({'t':'p', **power_fields(event.data['state'], event.data['voltage'], event.data['current'], event.data['text'])})
+
+
+STREAM_HANDLERS = [
+    (events.MOVE_STARTED, stream_servo),
+    (events.SETTLED, stream_servo),
+    (events.PRESSED, stream_button),
+    (events.RELEASED, stream_button),
+    (events.LED_CHANGED, stream_led),
+    (events.POWER_STATE, stream_power),
+]
+
+
+def add_stream(stream):
+    """ Starts sending changes to the stream; the first one added starts listening for them. """
+    if not streams:
+        for kind, fn in STREAM_HANDLERS:
+            bus.subscribe(kind, fn)
+    streams.append(stream)
+
+
+def remove_stream(stream):
+    streams.remove(stream)
+    if not streams:
+        for kind, fn in STREAM_HANDLERS:
+            bus.unsubscribe(kind, fn)
+
+
+def start_stream_server():
+    """ Streams the state to followers on the network, if config.STREAM_PORT is set. """
+    global stream_server
+    if config.STREAM_PORT is None:
+        return
+    try:
+        stream_server = StreamServer(config.STREAM_HOST, config.STREAM_PORT, stream_snapshot)
+    except OSError as ex:
+        print(f'WARNING: Could not listen on port {config.STREAM_PORT} for streaming, so carrying on without it: {ex}')
+        return
+    add_stream(stream_server)
+    stream_server.start()
+    print(f'INFO: Streaming the state on port {stream_server.port}')
+
+
+def stop_stream_server():
+    global stream_server
+    if stream_server:
+        remove_stream(stream_server)
+        stream_server.stop()
+        stream_server = None
+
+
+def dashboard_layout():
+    """ Where each point is drawn on the trackplan, in pixels, and the IDs of the buttons and LEDs, for the web dashboard. """
+    points = []
+    for servo in servos:
+        if not servo.graphic:
+            continue
+        x = servo.graphic['x']
+        y = servo.graphic['y']
+        lines = []
+        # As in Servo.draw
+        for offset in (-1 if servo.graphic['shape'] == 'Y' else 0, -1 if servo.graphic['shape'] == 'B' else 1):
+            if servo.graphic['reverse']:
+                coords = (x + 1, y, x, y + offset)
+            else:
+                coords = (x, y, x + 1, y + offset)
+            lines.append([round(n, 1) for n in (TrackPlan._derive_x(coords[0]), TrackPlan._derive_y(coords[1]),
+                                                TrackPlan._derive_x(coords[2]), TrackPlan._derive_y(coords[3]))])
+        points.append({'i':servo.index, 'main':lines[0], 'branch':lines[1]})
+    return {
+        'width_px':config.WIDTH,
+        'height_px':config.HEIGHT,
+        'line_width':config.LINE_WIDTH,
+        'colour':config.POINT_COLOUR,
+        'points':points,
+        'buttons':[button.id() for button in buttons],
+        'leds':[led.id() for led in leds],
+    }
+
+
+trackplan_pngs = {}     # StaticLayer key to the image as a PNG
+
+def dashboard_trackplan():
+    """ Gets the static trackplan as (key, PNG bytes), drawing it only if it has changed. """
+    key = StaticLayer.key('white')
+    if key not in trackplan_pngs:
+        f = io.BytesIO()
+        StaticLayer.get('white').save(f, format='PNG')
+        trackplan_pngs[key] = f.getvalue()
+    return key, trackplan_pngs[key]
+
+
+def execute_dashboard_commands(commands):
+    # Anyone who can see the dashboard can change the points, but not stop everything
+    execute_commands(commands, allow_exit=False)
+
+
+def start_dashboard():
+    """ Serves the web dashboard, if config.WEB_PORT is set. """
+    global dashboard
+    if config.WEB_PORT is None:
+        return
+    try:
+        dashboard = Dashboard(config.WEB_HOST, config.WEB_PORT, stream_snapshot, dashboard_layout,
+                              dashboard_trackplan, execute_dashboard_commands)
+    except OSError as ex:
+        print(f'WARNING: Could not listen on port {config.WEB_PORT} for the dashboard, so carrying on without it: {ex}')
+        return
+    add_stream(dashboard)
+    dashboard.start()
+    print(f'INFO: Web dashboard on port {dashboard.port}')
+
+
+def stop_dashboard():
+    global dashboard
+    if dashboard:
+        remove_stream(dashboard)
+        dashboard.stop()
+        dashboard = None
+
+
+
+
+#################################################################################
+# NODES
+# A layout can be shared between several nodes, each with its own I2C bus, listed with NODE lines
+# in servo.txt; each board says which node it is on. A node only drives its own boards, so the
+# main loop only looks at the local servos, buttons and flashers. A change to anything on
+# another node's board is sent to that node as a request, and each node tells the others about
+# changes to what it owns, which are applied here as if they had happened here, so the GUI,
+# trackplan, status file, etc. show the whole layout. See cluster.py for how they are sent.
+
+nodes = {}              # Node name to (host, port), in the order in servo.txt
+this_node = config.NODE
+layout_hash = None      # Of servo.txt, so nodes can check they have the same layout
+cluster = None
+replicated_at = {}      # Servo to when its movement was last sent to the other nodes, and any standby, or received
+replicating = False
+
+
+def send_to_node(node, request):
+    """ Asks another node to do something to a device on its boards; the request is as for handle_request. """
+    if cluster:
+        cluster.send(node, {'m':'request', 'request':request})
+
+
+def replica_servo(servo):
+    return {'m':'s', 'i':servo.index, 'c':servo.current_angle, 't':servo.target_angle, 'f':servo_flags(servo)}
+
+
+def replicate_servo(event):
+    servo = event.source
+    if servo.node:
+        return
+    if event.kind == events.MOVED:
+        # Others only need to see it moving, not every step
+        now = time.perf_counter()
+        if now - replicated_at.get(servo, 0) < config.NODE_MOVE_INTERVAL:
+            return
+        replicated_at[servo] = now
+    send_replica(replica_servo(servo))
+
+
+def replicate_button(event):
+    if not event.source.node:
+        send_replica({'m':'b', 'i':event.source.index, 'v':int(event.kind == events.PRESSED)})
+
+
+def replicate_io(letter):
+    """ Gets an event handler that sends the new state of an LED, relay or flasher. """
+    def replicate(event):
+        if not event.source.node:
+            send_replica({'m':letter, 'i':event.source.index, 'v':int(event.data['state'])})
+    return replicate
+
+
+def send_replica(message):
+    """ Sends a change to something this node drives to the other nodes, and any standby. """
+    if cluster:
+        cluster.broadcast(message)
+    if replicator:
+        replicator.publish(message)
+
+
+def start_replicating():
+    """ Tells the other nodes, or the standby, about changes from now on. """
+    global replicating
+    if replicating:
+        return
+    replicating = True
+    bus.subscribe(events.MOVE_STARTED, replicate_servo)
+    bus.subscribe(events.MOVED, replicate_servo)
+    bus.subscribe(events.SETTLED, replicate_servo)
+    bus.subscribe(events.PRESSED, replicate_button)
+    bus.subscribe(events.RELEASED, replicate_button)
+    bus.subscribe(events.LED_CHANGED, replicate_io('l'))
+    bus.subscribe(events.RELAY_CHANGED, replicate_io('r'))
+    bus.subscribe(events.FLASHER_CHANGED, replicate_io('f'))
+
+
+def node_snapshot():
+    """ The state of everything on this node's boards, for another node that has just connected. """
+    messages = [replica_servo(servo) for servo in local_servos]
+    messages += [{'m':'b', 'i':button.index, 'v':int(button.was_pressed)} for button in local_buttons]
+    for letter, lst in [('l', leds), ('r', relays), ('f', flashers)]:
+        messages += [{'m':letter, 'i':el.index, 'v':int(el.state)} for el in lst if not el.node]
+    return messages
+
+
+# What another node can ask this one to do, see send_to_node, and what to
+NODE_REQUESTS = {
+    'on':servos, 'off':servos, 'angle':servos, 'centre':servos, 'angles':servos,
+    'LED on':leds, 'LED off':leds,
+    'relay on':relays, 'relay off':relays,
+}
+# What each kind of replica message is about
+REPLICAS = {'s':servos, 'b':buttons, 'l':leds, 'r':relays, 'f':flashers}
+
+
+def check_number(message, name, top):
+    if type(message.get(name)) not in (int, float) or not 0 <= message[name] <= top:
+        raise ValueError(f'{name} out of range (0-{top})')
+
+
+def check_node_request(request):
+    """
+    Checks a request from another node, as parse_command does for commands; raises ValueError if
+    it is not something a node would send, or is for something that is not on this node's boards.
+    """
+    lst = NODE_REQUESTS.get(request.get('action')) if isinstance(request, dict) else None
+    if lst is None:
+        raise ValueError('not something a node can ask for')
+    n = request.get('servo')
+    if type(n) is not int or not 0 <= n < len(lst):
+        raise ValueError(f'out of range (0-{len(lst) - 1})')
+    if lst[n].node:
+        raise ValueError('not on this node')
+    if request['action'] == 'angle':
+        check_number(request, 'angle', 180)
+    elif request['action'] == 'angles':
+        for name in ('off', 'centre', 'on', 'target'):
+            check_number(request, name, 18000)
+
+
+def check_replica(node, message):
+    """ Checks a change sent by another node, raising ValueError unless it is to something on that node's boards. """
+    lst = REPLICAS.get(message.get('m'))
+    if lst is None:
+        raise ValueError('unknown message')
+    n = message.get('i')
+    if type(n) is not int or not 0 <= n < len(lst) or lst[n].node != node:
+        raise ValueError('not on that node')
+    if message['m'] == 's':
+        check_number(message, 'c', 18000)
+        check_number(message, 't', 18000)
+        if type(message.get('f')) is not int:
+            raise ValueError('bad flags')
+    elif message.get('v') not in (0, 1):
+        raise ValueError('bad value')
+
+
+def node_receive(node, message):
+    """
+    Called on the cluster's threads; the main loop does the work.
+    Anything bad is refused here, with ValueError, so it never gets to the main loop.
+    """
+    if message.get('m') == 'request':
+        check_node_request(message.get('request'))
+        requests.put(message['request'])
+    else:
+        check_replica(node, message)
+        requests.put({'action':'replica', 'message':message})
+
+
+def apply_replica(message):
+    """ Updates a device on another node's board to the state that node sent, and tells everyone here. """
+    kind = message['m']
+    if kind == 's':
+        servo = servos[message['i']]
+        was_moving = servo.moving
+        flags = message['f']
+        servo.current_angle = message['c']
+        servo.target_angle = message['t']
+        servo.turn_on = bool(flags & state_block.TURN_ON)
+        servo.centred = bool(flags & state_block.CENTRED)
+        servo.moving = bool(flags & state_block.MOVING)
+        replicated_at[servo] = time.perf_counter()
+        if servo.moving and not was_moving:
+            bus.publish(events.MOVE_STARTED, servo, target=servo.target_angle / 100)
+        elif was_moving and not servo.moving:
+            bus.publish(events.SETTLED, servo, angle=servo.current_angle / 100)
+        else:
+            bus.publish(events.MOVED, servo, angle=servo.current_angle / 100)
+    elif kind == 'b':
+        button = buttons[message['i']]
+        pressed = bool(message['v'])
+        if pressed != button.was_pressed:
+            button.was_pressed = pressed
+            bus.publish(events.PRESSED if pressed else events.RELEASED, button)
+    else:
+        lst, kind = {'l':(leds, events.LED_CHANGED), 'r':(relays, events.RELAY_CHANGED),
+                     'f':(flashers, events.FLASHER_CHANGED)}[kind]
+        el = lst[message['i']]
+        value = bool(message['v'])
+        if value != el.state:
+            el.state = value
+            bus.publish(kind, el, state=value)
+
+
+def start_cluster():
+    """ Connects to the other nodes, if the layout is shared between several. """
+    global cluster
+    if not nodes:
+        return
+    try:
+        cluster = Cluster(this_node, nodes, layout_hash, node_receive, node_snapshot)
+    except OSError as ex:
+        print(f'ERROR: Could not listen on port {nodes[this_node][1]} for the other nodes: {ex}')
+        exit()
+    start_replicating()
+    cluster.start()
+    print(f'INFO: Node {this_node} of {len(nodes)}; driving {len(local_servos)} of {len(servos)} servo(s).')
+
+
+def stop_cluster():
+    global cluster
+    if cluster:
+        cluster.stop()
+        cluster = None
+
+
+
+
+#################################################################################
+# HOT STANDBY
+# A second Pi can stand by, following the state of the primary, and take over the boards if the
+# primary fails; see standby.py. While standing by it loads the layout without the bus, like the
+# GUI process with config.SEPARATE_GUI, and the main loop just applies what the primary sends.
+
+primary = None          # With --standby, the primary as "host:port", until we take over
+replicator = None       # On the primary, sending to the standby
+standby = None          # On the standby, following the primary
+
+
+def standby_snapshot():
+    """ The state of everything, for a standby that has just connected. """
+    return {'m':'snapshot', 'layout':layout_hash, 'messages':node_snapshot()}
+
+
+def start_replicator():
+    """ Lets a standby follow us, if config.STANDBY_PORT is set. """
+    global replicator
+    if config.STANDBY_PORT is None or primary:
+        return
+    try:
+        replicator = Replicator(config.STANDBY_HOST, config.STANDBY_PORT, standby_snapshot)
+    except OSError as ex:
+        print(f'WARNING: Could not listen on port {config.STANDBY_PORT} for a standby, so carrying on without one: {ex}')
+        return
+    start_replicating()
+    replicator.start()
+    print(f'INFO: A standby can follow on port {replicator.port}')
+
+
+def heartbeat():
+    """ Tells any standby the main loop is still going; see standby.py. """
+    if replicator:
+        replicator.beat()
+
+
+def stop_replicator():
+    global replicator
+    if replicator:
+        replicator.stop()
+        replicator = None
+
+
+def start_standby():
+    """ Follows the primary, if this is a standby. """
+    global standby
+    if not primary:
+        return
+    if nodes:
+        print('ERROR: A standby for one of several nodes is not supported.')
+        exit()
+    host, port = primary.rsplit(':', 1)
+    standby = Standby(host, int(port), layout_hash, standby_receive, lambda: requests.put({'action':'take over'}))
+    standby.start()
+
+
+def standby_receive(message):
+    """ Called on the standby's thread; the main loop applies it. Raises ValueError if it is bad, as for node_receive. """
+    if not isinstance(message, dict):
+        raise ValueError('not an object')
+    check_replica(None, message)
+    requests.put({'action':'replica', 'message':message})
+
+
+def take_over():
+    """
+    The primary has gone, so connect to the boards and carry on from where it was, without homing.
+    Called by the main loop, which has been applying what the primary sent.
+    """
+    global primary, standby, USE_BUS, lcd_board, ups_board
+    t = time.perf_counter()
+    print(f'WARNING: Taking over from the primary at {primary}.')
+    primary = None
+    standby = None
+    USE_BUS = config.ON_LINE or config.SIMULATE
+    if not USE_BUS:
+        print('WARNING: Off-line, so there is no bus to take over.')
+    else:
+        # The buses were only placeholders while standing by
+        for number, old in list(buses.items()):
+            del buses[number]
+            bus = get_bus(number)
+            for guard in i2c_guard.guards:
+                if guard.bus is old:
+                    guard.bus = bus
+        for i, guard in enumerate(servo_guards):
+            servo_boards[i], guard.probe = connect_board('S', guard.addr, guard.bus)
+        for i, guard in enumerate(io_guards):
+            io_boards[i], guard.probe = connect_board('IO', guard.addr, guard.bus)
+            # Set all the outputs as they were in one write, so none flickers; inputs stay high
+            port = 0xFFFF
+            for lst in [leds, flashers]:
+                for el in lst:
+                    if el.board_no == i and el.state:
+                        port &= ~(1 << el.pin_no)
+            for relay in relays:
+                if relay.board_no == i and not relay.state:
+                    port &= ~(1 << relay.pin_no)
+            guard.call(i2c_stats.LED_WRITE, io_boards[i].write_gpio, port)
+        if lcd_board:
+            lcd_board, lcd_guard.probe = connect_board('LCD', lcd_guard.addr, lcd_guard.bus)
+        if ups_board:
+            ups_board, ups_guard.probe = connect_board('UPS', ups_guard.addr, ups_guard.bus)
+        for servo in servos:
+            servo.attach()
+            if servo.moving:
+                # Catch up with where it will have got to since the primary last said
+                servo.adjust(config.TIME_FACTOR * (time.perf_counter() - replicated_at.get(servo, t)))
+        for lst in [leds, buttons, flashers]:
+            for el in lst:
+                el.attach()
+        for relay in relays:
+            relay.attach(relay.state)
+    index_local()
+    start_replicator()
+    print(f'INFO: Took over in {round((time.perf_counter() - t) * 1000)} ms; {sum(servo.moving for servo in servos)} servo(s) still moving.')
+    print_lcd(2, 'Took over')
+
+
+def receive_requests(conn):
+    """ In the engine process, passes requests from the GUI on to the main loop. """
+    while True:
+        try:
+            requests.put(conn.recv())
+        except EOFError:
+            print('WARNING: Lost the connection to the GUI; carrying on without it.')
+            return
+
+
+def engine_main(conn):
+    """ The engine process: loads the layout, shares its state, and runs the main loop until told to stop. """
+    global state_publisher
+    if config.LOG_EVENTS:
+        bus.subscribe(None, events.log)
+    load(FILENAME)
+    report()
+    home_servos()
+
+    counts = state_counts()
+    shm = shared_memory.SharedMemory(create=True, size=state_block.size(*counts))
+    start_publishing([StateBlock(shm.buf, counts)])
+    Thread(target=receive_requests, args=(conn,), daemon=True).start()
+    start_control_server()
+    start_stream_server()
+    start_dashboard()
+    start_cluster()
+    start_replicator()
+    start_standby()
+    conn.send(('ready', shm.name))
+    try:
+        run_engine()
+    finally:
+        stop_replicator()
+        stop_cluster()
+        stop_dashboard()
+        stop_stream_server()
+        stop_control_server()
+        state_publisher.stop()
+        state_publisher = None
+        remove_status_file()
+        shm.close()
+        shm.unlink()
+
+
+def engine_stopped():
+    """ Returns True if the engine has stopped, for example told to exit through the control socket. """
+    if engine_process:
+        return not engine_process.is_alive()
+    return terminated
+
+
+def start_engine():
+    """
+    Starts the engine process, and waits for it to be ready; the GUI process then loads the
+    layout for itself, but leaves the boards to the engine.
+    """
+    global engine_conn, engine_process, state_follower, USE_BUS
+    engine_conn, child_conn = multiprocessing.Pipe()
+    engine = multiprocessing.Process(target=engine_main, args=(child_conn,), name='engine')
+    engine.start()
+    try:
+        message, name = engine_conn.recv()
+    except EOFError:
+        print('ERROR: The engine process failed to start.')
+        exit()
+    print(f'INFO: Engine process {engine.pid} ready.')
+    engine_process = engine
+
+    config.ON_LINE = False
+    config.SIMULATE = False
+    USE_BUS = False
+    load(FILENAME)
+    state_follower = StateFollower(name)
+    return engine
+
+
+
+
+######################################################################
+# GUI
+
+
+def show_in_row(row, old, new):
+    """
+    Records that a grid row is now showing a new device instead of the old one,
+    so changes to the device can be shown; either can be None.
+    A row in a hidden window shows nothing, even if paged, see DiagnosticWindow.hide.
+    """
+    if old is not None and shown_rows.get(old) is row:
+        del shown_rows[old]
+    if new is not None and not (row.window and row.window.hidden):
+        shown_rows[new] = row
+
+
+class DiagnosticWindow(tk.Toplevel):
+    """
+    A window listing the buttons, LEDs or flashers, a page at a time, with rows of the given class.
+    Each is created the first time it is asked for, then hidden rather than destroyed when closed,
+    so the rows are reused, and showing it again just means updating them.
+    """
+    def open(row_class, title):
+        if row_class.window:
+            row_class.window.reshow()
+        else:
+            row_class.window = DiagnosticWindow(row_class, title)
+
+    def __init__(self, row_class, title):
+        super().__init__(window)
+        self.title(f'{title}: {config.TITLE}')
+        self.row_class = row_class
+        self.hidden = False
+        self.protocol('WM_DELETE_WINDOW', self.hide)
+        row_class.headers(self)
+        row_class.rows = [row_class(self, i) for i in range(config.NUMBER_OF_ROWS)]
+
+    def reshow(self):
+        self.hidden = False
+        for row in self.row_class.rows:
+            row.update()
+        self.deiconify()
+        self.lift()
+
+    def hide(self):
+        # Rows that are not seen do not need to be told about changes
+        self.hidden = True
+        for row in self.row_class.rows:
+            row.stop_showing()
+        self.withdraw()
+
+
+class StaticLayer:
+    """
+    The parts of the trackplan that never change - the grid, connectors, platforms and text -
+    drawn once into a PIL image, so the canvas only needs one item for all of them.
+    It has the same drawing methods as TrackPlan, so decorators can draw themselves on either.
+    The image is cached in memory, and on disk in config.TRACKPLAN_CACHE, keyed by the decorators
+    and the config settings that affect it, so is only redrawn when one of them changes.
+    """
+    VERSION = 1    # Change if the drawing changes, so old cached files are not used
+    images = {}
+
+    def get(background='white'):
+        """ Gets the image for the current layout, on the given background colour. """
+        key = StaticLayer.key(background)
+        if key in StaticLayer.images:
+            return StaticLayer.images[key]
+
+        filename = os.path.join(config.TRACKPLAN_CACHE, f'{key}.png') if config.TRACKPLAN_CACHE else None
+        img = None
+        if filename and os.path.exists(filename):
+            try:
+                img = Image.open(filename)
+                img.load()
+            except OSError as err:
+                print(f'WARNING: Failed to read cached trackplan "{filename}" ({err}), drawing it again.')
+                img = None
+        if not img:
+            img = StaticLayer(background).render()
+            if filename:
+                try:
+                    os.makedirs(config.TRACKPLAN_CACHE, exist_ok=True)
+                    img.save(filename)
+                except OSError as err:
+                    print(f'WARNING: Failed to save trackplan to "{filename}" ({err}), but carrying on regardless!')
+        StaticLayer.images[key] = img
+        return img
+
+    def key(background):
+        data = [StaticLayer.VERSION, background, config.SHOW_GRID, config.LINE_WIDTH, config.LINE_COLOUR,
+                config.WIDTH, config.HEIGHT, config.X_SCALE, config.Y_SCALE,
+                config.X_OFFSET, config.Y_OFFSET, config.X_MIRROR, config.Y_MIRROR]
+        for el in decorators:
+            data.append((type(el).__name__, el.x, el.y, getattr(el, 'shape', None), el.desc))
+        return hashlib.sha1(repr(data).encode('utf-8')).hexdigest()
+
+    def __init__(self, background):
+        self.img = Image.new('RGB', (config.WIDTH, config.HEIGHT), background)
+        self.draw = ImageDraw.Draw(self.img)
+        try:
+            # Tk's "Helvetica 15 bold" is 15 points, about 20 pixels
+            self.font = ImageFont.truetype('DejaVuSans-Bold.ttf', 20)
+        except OSError:
+            self.font = ImageFont.load_default()
+
+    def render(self):
+        if config.SHOW_GRID:
+            for i in range(math.floor(config.WIDTH / config.X_SCALE)):
+                for j in range(math.floor(config.HEIGHT / config.Y_SCALE)):
+                    self.draw.point((TrackPlan._derive_x(i), TrackPlan._derive_y(j)), fill='black')
+        for el in decorators:
+            el.draw(self)
+        return self.img
+
+    def line(self, x, y, dy, c, length=1):
+        self.draw.line((TrackPlan._derive_x(x), TrackPlan._derive_y(y), TrackPlan._derive_x(x + length), TrackPlan._derive_y(y + dy * length)), fill=c, width=config.LINE_WIDTH)
+
+    def r_line(self, x, y, dy, c):
+        self.draw.line((TrackPlan._derive_x(x + 1), TrackPlan._derive_y(y), TrackPlan._derive_x(x), TrackPlan._derive_y(y + dy)), fill=c, width=config.LINE_WIDTH)
+
+    def platform(self, x, y):
+        self.draw.line((TrackPlan._derive_x(x), TrackPlan._derive_y(y + 0.5), TrackPlan._derive_x(x + 1), TrackPlan._derive_y(y + 0.5)), fill='grey', width=config.Y_SCALE)
+
+    def text(self, x, y, s):
+        self.draw.text((TrackPlan._derive_x(x), TrackPlan._derive_y(y + 0.5)), s, fill='black', font=self.font, anchor='mm')
+
+
+class TrackPlan(tk.Toplevel):
+    """
+    """
+    def show():
+        global trackplan
+        if not trackplan:
+            trackplan = TrackPlan(window)
+            trackplan.geometry("+%d+%d" %(10,80))       
+       
+       
+    def left_click(event):
+        TrackPlan._mouse_click(event, False)
        
     def right_click(event):
         TrackPlan._mouse_click(event, True)
@@ -1469,15 +3191,14 @@ class TrackPlan(tk.Toplevel):
     def _mouse_click(event, right_click):
         x = TrackPlan._underive_x(event.x)
         y = TrackPlan._underive_y(event.y)
-        for servo in servos:
-            if servo.is_here(x, y):
-                if config.LEFT_CLICK_ONLY:
-                    if servo.current_angle == servo.on_angle:
-                        servo.set(False)
-                    if servo.current_angle == servo.off_angle:
-                        servo.set(True)
-                else:
-                    servo.set(right_click)
+        for servo in servo_cells.get((x, y), []):
+            if config.LEFT_CLICK_ONLY:
+                if servo.current_angle == servo.on_angle:
+                    send_request('off', servo=servo.index)
+                if servo.current_angle == servo.off_angle:
+                    send_request('on', servo=servo.index)
+            else:
+                send_request('on' if right_click else 'off', servo=servo.index)
        
 
     def __init__(self, window):
@@ -1504,262 +3225,503 @@ class TrackPlan(tk.Toplevel):
         self.canvas.bind('<Button-1>', TrackPlan.left_click)
         self.canvas.bind('<Button-3>', TrackPlan.right_click)
         self.redraw(True)
+        self.animate_id = self.after(round(1000 / config.TRACKPLAN_FPS), self.animate)
+
+    def animate(self):
+        """
+        Redraws the points that have moved since last time, then sets a timer to go again,
+        so moving points are animated at up to config.TRACKPLAN_FPS frames a second.
+        """
+        for servo in trackplan_updates.take():
+            servo.draw(self)
+        self.animate_id = self.after(round(1000 / config.TRACKPLAN_FPS), self.animate)
        
        
     def redraw(self, full=False):
+        """
+        A full redraw clears the canvas and creates everything again,
+        otherwise only points that have changed are recoloured.
+        """
         if full:
             self.canvas.delete(tk.ALL)
-            if config.SHOW_GRID:
-                for i in range(math.floor(config.WIDTH / config.X_SCALE)):
-                    for j in range(math.floor(config.HEIGHT / config.Y_SCALE)):
-                        self.canvas.create_line(TrackPlan._derive_x(i), TrackPlan._derive_y(j), TrackPlan._derive_x(i) + 1, TrackPlan._derive_y(j), fill='black', width=1)
-            for el in decorators:
-                el.draw(self)
+            # Match the canvas background, which may be a system colour PIL does not know
+            r, g, b = self.canvas.winfo_rgb(self.canvas.cget('background'))
+            background = f'#{r // 256:02x}{g // 256:02x}{b // 256:02x}'
+            # Have to keep a reference to the PhotoImage or it gets garbage collected
+            self.background = ImageTk.PhotoImage(StaticLayer.get(background))
+            self.canvas.create_image(0, 0, image=self.background, anchor=tk.NW)
 
         for servo in servos:
             servo.draw(self, full)
            
+    def update_transform():
+        """
+        Works out the mapping from grid to pixels from the config settings once,
+        as pixel_x = ax * x + bx and pixel_y = ay * y + by.
+        Done when the layout is loaded; call again if the settings change.
+        """
+        if config.X_MIRROR:
+            TrackPlan.ax = -config.X_SCALE
+            TrackPlan.bx = config.WIDTH - config.X_OFFSET
+        else:
+            TrackPlan.ax = config.X_SCALE
+            TrackPlan.bx = config.X_OFFSET
+        if config.Y_MIRROR:
+            TrackPlan.ay = config.Y_SCALE
+            TrackPlan.by = config.Y_OFFSET
+        else:
+            TrackPlan.ay = -config.Y_SCALE
+            TrackPlan.by = config.HEIGHT - config.Y_OFFSET
+
     # Convert a grid position to pixels
     def _derive_x(x):
-        n = x * config.X_SCALE + config.X_OFFSET
-        return config.WIDTH - n if config.X_MIRROR else n
+        return TrackPlan.ax * x + TrackPlan.bx
 
     def _derive_y(y):
-        n = config.HEIGHT - y * config.Y_SCALE - config.Y_OFFSET
-        return config.HEIGHT - n if config.Y_MIRROR else n
+        return TrackPlan.ay * y + TrackPlan.by
            
            
     # Convert a pixel position to grid
     def _underive_x(x):
-        if config.X_MIRROR:
-            x = config.WIDTH - x
-        return math.floor((x - config.X_OFFSET) / config.X_SCALE)
+        return math.floor((x - TrackPlan.bx) / TrackPlan.ax)
 
     def _underive_y(y):
-        if config.Y_MIRROR:
-            y = config.HEIGHT - y
-        return math.floor((config.HEIGHT - y - config.Y_OFFSET) / config.Y_SCALE)
+        return math.floor((y - TrackPlan.by) / TrackPlan.ay)
 
 
 
 
            
-    def line(self, x, y, dy, c):
-        self.canvas.create_line(TrackPlan._derive_x(x), TrackPlan._derive_y(y), TrackPlan._derive_x(x + 1), TrackPlan._derive_y(y + dy), fill=c, width=config.LINE_WIDTH)
+    # Each of these returns the ID of the new canvas item
+    def line(self, x, y, dy, c, length=1):
+        return self.canvas.create_line(TrackPlan._derive_x(x), TrackPlan._derive_y(y), TrackPlan._derive_x(x + length), TrackPlan._derive_y(y + dy * length), fill=c, width=config.LINE_WIDTH)
 
     def r_line(self, x, y, dy, c):
-        self.canvas.create_line(TrackPlan._derive_x(x + 1), TrackPlan._derive_y(y), TrackPlan._derive_x(x), TrackPlan._derive_y(y + dy), fill=c, width=config.LINE_WIDTH)
+        return self.canvas.create_line(TrackPlan._derive_x(x + 1), TrackPlan._derive_y(y), TrackPlan._derive_x(x), TrackPlan._derive_y(y + dy), fill=c, width=config.LINE_WIDTH)
 
     def platform(self, x, y):
-        self.canvas.create_line(TrackPlan._derive_x(x), TrackPlan._derive_y(y + 0.5), TrackPlan._derive_x(x + 1), TrackPlan._derive_y(y + 0.5), fill='grey', width=config.Y_SCALE)
+        return self.canvas.create_line(TrackPlan._derive_x(x), TrackPlan._derive_y(y + 0.5), TrackPlan._derive_x(x + 1), TrackPlan._derive_y(y + 0.5), fill='grey', width=config.Y_SCALE)
 
     def text(self, x, y, s):
-        self.canvas.create_text(TrackPlan._derive_x(x), TrackPlan._derive_y(y + 0.5), text=s, fill="black", font=('Helvetica 15 bold'))
+        return self.canvas.create_text(TrackPlan._derive_x(x), TrackPlan._derive_y(y + 0.5), text=s, fill="black", font=('Helvetica 15 bold'))
+
+    def recolour(self, item, c):
+        self.canvas.itemconfig(item, fill=c)
+
+    def flash(self, servo, n=6):
+        """ Flashes the point so it can be found; n is the number of times it changes colour. """
+        if not servo.items:
+            return
+        on = n > 0 and n % 2 == 0
+        self.recolour(servo.items[0], config.FLASH_COLOUR if on else servo.main_colour)
+        self.recolour(servo.items[1], config.FLASH_COLOUR if on else servo.branch_colour)
+        if n > 0:
+            self.after(250, self.flash, servo, n - 1)
+
+    def blade(self, coords, visible):
+        """ Creates a line for a moving blade, given grid positions (x0, y0, x1, y1). """
+        item = self.canvas.create_line(*self._derive_coords(coords), fill=config.POINT_COLOUR, width=config.LINE_WIDTH)
+        if not visible:
+            self.canvas.itemconfig(item, state=tk.HIDDEN)
+        return item
+
+    def move_blade(self, item, coords, visible):
+        if visible:
+            self.canvas.coords(item, *self._derive_coords(coords))
+        self.canvas.itemconfig(item, state=tk.NORMAL if visible else tk.HIDDEN)
+
+    def _derive_coords(self, coords):
+        x0, y0, x1, y1 = coords
+        return TrackPlan._derive_x(x0), TrackPlan._derive_y(y0), TrackPlan._derive_x(x1), TrackPlan._derive_y(y1)
 
 
     def destroy(self):
         global trackplan
         trackplan = None
+        self.after_cancel(self.animate_id)
         return super().destroy()
 
 
-class ServoGridRow():
+class I2CStatsWindow(tk.Toplevel):
     """
-    Represents a row on the grid of the GUI. This will correspond to one servo,
-    and buttons and labels on the row will change and reflect its state, but
-    which servo that is can _vary depending on what self.offset is.
+    Shows the I2C statistics, one row per device address and operation type.
+    Refreshes itself once a second while open.
     """
-   
+    columns = ('address', 'op', 'count', 'errors', 'bytes', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+    headings = ('Address', 'Operation', 'Count', 'Errors', 'Bytes', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms')
+    # The scheduler's queues, see i2c_bus.py
+    queue_columns = ('bus', 'priority', 'depth', 'max_depth', 'done', 'replaced', 'overdue', 'mean_wait_ms', 'max_wait_ms')
+    queue_headings = ('Bus', 'Priority', 'Waiting', 'Most waiting', 'Done', 'Replaced', 'Overdue', 'Mean wait ms', 'Max wait ms')
+
+    def show():
+        global i2c_stats_window
+        if not i2c_stats_window:
+            i2c_stats_window = I2CStatsWindow(window)
+        i2c_stats_window.lift()
+
+    def dump():
+        """ Menu response. Writes the statistics to file. """
+        try:
+            stats.dump(config.I2C_STATS_FILE)
+            print(f'INFO: I2C statistics written to {config.I2C_STATS_FILE}')
+        except OSError as err:
+            print(f'ERROR: Failed to write I2C statistics to {config.I2C_STATS_FILE}: {err}')
+
+    def reset():
+        """ Menu response. """
+        stats.reset()
+        for bus in buses.values():
+            bus.reset_stats()
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.title('I2C statistics: ' + config.TITLE)
+        self.tree = ttk.Treeview(self, columns=I2CStatsWindow.columns, show='headings', height=20)
+        for col, heading in zip(I2CStatsWindow.columns, I2CStatsWindow.headings):
+            self.tree.heading(col, text=heading)
+            self.tree.column(col, width=90, anchor='e')
+        self.tree.column('op', width=110, anchor='w')
+        self.tree.grid(column=0, row=0)
+        self.busy_label = ttk.Label(self, text='---', font=window.heading_font)
+        self.busy_label.grid(column=0, row=1, sticky='w')
+        self.guard_label = ttk.Label(self, text='---', font=window.label_font, justify=tk.LEFT)
+        self.guard_label.grid(column=0, row=2, sticky='w')
+        if config.I2C_SCHEDULER:
+            self.queues = ttk.Treeview(self, columns=I2CStatsWindow.queue_columns, show='headings', height=4 * len(buses))
+            for col, heading in zip(I2CStatsWindow.queue_columns, I2CStatsWindow.queue_headings):
+                self.queues.heading(col, text=heading)
+                self.queues.column(col, width=90, anchor='e')
+            self.queues.column('priority', width=110, anchor='w')
+            self.queues.grid(column=0, row=3)
+        self.refresh()
+
+    def refresh(self):
+        self.tree.delete(*self.tree.get_children())
+        for row in stats.snapshot():
+            self.tree.insert('', tk.END, values=[row[col] for col in I2CStatsWindow.columns])
+        s = f'Time spent in I2C calls: {round(stats.busy_fraction() * 100, 2)}%'
+        if not config.ON_LINE and config.SIMULATE:
+            for bus in buses.values():
+                s += f'\nSimulated {bus} utilisation: {round(bus.i2c.utilisation() * 100, 2)}%, {bus.i2c.transactions} transactions, {bus.i2c.errors} errors'
+        self.busy_label.config(text=s)
+        self.guard_label.config(text='\n'.join(guard.status() for guard in i2c_guard.guards))
+        if config.I2C_SCHEDULER:
+            self.queues.delete(*self.queues.get_children())
+            for bus in buses.values():
+                for row in bus.stats():
+                    self.queues.insert('', tk.END, values=[row[col] for col in I2CStatsWindow.queue_columns])
+        self.after_id = self.after(1000, self.refresh)
+
+    def destroy(self):
+        global i2c_stats_window
+        i2c_stats_window = None
+        self.after_cancel(self.after_id)
+        return super().destroy()
+
+
+class LatencyWindow(tk.Toplevel):
     """
-    def up_button_pressed(self, event):
-        ServoGridRow.find_row(event.widget).up_button()
-   
-    def find_row(widget):
-        for row in servo_grid_rows:
-            if row.btn_up == widget or row.btn_down == widget or row.btn_on_off == widget:
-                return row
+    Shows the latency from button presses to servo writes, as percentiles for each stage
+    and a histogram for the first write. Refreshes itself once a second while open.
     """
+    columns = ('stage', 'count', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+    headings = ('From press to', 'Count', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms')
+    descs = {
+        'dispatch':'dispatch',
+        'set':'servo set',
+        'first':'first write',
+        'last':'last write',
+    }
+    HIST_WIDTH = 500
+    HIST_HEIGHT = 120
 
-    offset = 0
+    def show():
+        global latency_window
+        if not latency_window:
+            latency_window = LatencyWindow(window)
+        latency_window.lift()
+
+    def dump():
+        """ Menu response. Writes the latencies to file. """
+        try:
+            tracer.dump(config.LATENCY_FILE)
+            print(f'INFO: Latencies written to {config.LATENCY_FILE}')
+        except OSError as err:
+            print(f'ERROR: Failed to write latencies to {config.LATENCY_FILE}: {err}')
 
-    def centre_all():
+    def __init__(self, window):
+        super().__init__(window)
+        self.title('Button latency: ' + config.TITLE)
+        self.tree = ttk.Treeview(self, columns=LatencyWindow.columns, show='headings', height=len(latency.STAGES))
+        for col, heading in zip(LatencyWindow.columns, LatencyWindow.headings):
+            self.tree.heading(col, text=heading)
+            self.tree.column(col, width=80, anchor='e')
+        self.tree.column('stage', width=120, anchor='w')
+        self.tree.grid(column=0, row=0)
+        ttk.Label(self, text='Press to first write (ms)', font=window.heading_font).grid(column=0, row=1, sticky='w')
+        self.canvas = tk.Canvas(self, width=LatencyWindow.HIST_WIDTH, height=LatencyWindow.HIST_HEIGHT, background='white')
+        self.canvas.grid(column=0, row=2)
+        self.refresh()
+
+    def refresh(self):
+        self.tree.delete(*self.tree.get_children())
+        stages = tracer.snapshot()
+        for row in stages:
+            values = [row[col] for col in LatencyWindow.columns]
+            values[0] = LatencyWindow.descs[row['stage']]
+            self.tree.insert('', tk.END, values=values)
+        self.draw_histogram(stages[latency.STAGES.index('first')]['buckets_ms'])
+        self.after_id = self.after(1000, self.refresh)
+
+    def draw_histogram(self, buckets):
+        self.canvas.delete(tk.ALL)
+        biggest = max(buckets.values()) or 1
+        w = LatencyWindow.HIST_WIDTH / len(buckets)
+        h = LatencyWindow.HIST_HEIGHT - 20
+        for i, (label, n) in enumerate(buckets.items()):
+            top = h - h * n / biggest
+            self.canvas.create_rectangle(i * w + 4, top + 2, (i + 1) * w - 4, h, fill=config.POINT_COLOUR, outline='')
+            self.canvas.create_text(i * w + w / 2, h + 10, text=label)
+
+    def destroy(self):
+        global latency_window
+        latency_window = None
+        self.after_cancel(self.after_id)
+        return super().destroy()
+
+
+class ServoTree():
+    """
+    The servos in the main window, shown in a Treeview so any number can be scrolled through.
+    Tk only draws the rows in view, and only rows in view are updated as servos move;
+    others are marked as stale, and updated when they are scrolled into view.
+    The list can be filtered with the search index, by the start of any word in the description,
+    the ID (so "2." gives board 2) or the IDs of its buttons and LEDs. Enter jumps to each match
+    in turn, and flashes it on the trackplan. Buttons under the list act on the selected servo.
+    """
+
+    COLUMNS = (
+        ('id', 'ID', 70),
+        ('desc', 'Description', 10 * config.DESC_WIDTH),
+        ('state', 'State', 90),
+        ('target', 'Target', 90),
+        ('current', 'Current', 90),
+    )
+
+    def __init__(self, parent, img, font):
+        if img:
+            ttk.Label(parent, image=img).grid(column=0, row=0)
+        ttk.Label(parent, text='Find:', font=font).grid(column=1, row=0, sticky='e')
+        self.filter_text = tk.StringVar()
+        self.filter_text.trace_add('write', lambda *args: self.filter())
+        entry = ttk.Entry(parent, textvariable=self.filter_text, width=config.DESC_WIDTH)
+        entry.grid(column=2, row=0, sticky='w')
+        entry.bind('<Return>', lambda event: self.find_next())
+        self.found = 0          # The match Enter will go to next
+
+        self.tree = ttk.Treeview(parent, columns=[c[0] for c in ServoTree.COLUMNS], show='headings',
+                                 height=config.NUMBER_OF_ROWS, selectmode='browse')
+        for name, heading, width in ServoTree.COLUMNS:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, stretch=(name == 'desc'))
+        self.tree.tag_configure('ON', foreground='white', background='black')
+        self.tree.tag_configure('OFF', foreground='black', background='white')
+        self.tree.tag_configure('CENTRE', foreground='blue', background='silver')
+        self.tree.grid(column=0, row=1, columnspan=8, sticky='nsew')
+        self.scrollbar = Scrollbar(parent, orient=tk.VERTICAL, command=self.tree.yview)
+        self.scrollbar.grid(column=8, row=1, sticky='ns')
+        self.tree.configure(yscrollcommand=self.scrolled)
+        self.tree.bind('<Double-1>', lambda event: self.on_off_button())
+
+        buttons = ttk.Frame(parent)
+        buttons.grid(column=0, row=2, columnspan=8)
+        ttk.Button(buttons, text="On/Off", command=self.on_off_button).pack(side=tk.LEFT)
+        ttk.Button(buttons, text="Up", command=self.up_button).pack(side=tk.LEFT)
+        ttk.Button(buttons, text="Down", command=self.down_button).pack(side=tk.LEFT)
+
+        self.shown = []         # The IDs of the rows that pass the filter, in order
+        self.values = {}        # The values last shown for each row, so unchanged rows are left alone
+        self.stale = set()      # Rows that have changed while out of view
         for servo in servos:
-            servo.centre()
-        for row in servo_grid_rows:
-            row.update()
-   
-    def offset_plus_10():
-        if ServoGridRow.offset > len(servos) - config.INCREMENT:
-            print('BAD INPUT: Trying to go beyond end!')
-            return
-        ServoGridRow.offset += config.INCREMENT
-        ServoGridRow.set_offset()
+            iid = str(servo.index)
+            self.values[iid] = self.row_values(servo)
+            self.tree.insert('', tk.END, iid=iid, values=self.values[iid][1:], tags=self.values[iid][:1])
+            self.shown.append(iid)
+
+    def row_values(self, servo):
+        # The tag for the colour, then the columns
+        if servo.centred:
+            state = 'CENTRE'
+        elif servo.turn_on:
+            state = 'ON'
+        else:
+            state = 'OFF'
+        return (state, servo.id(), servo.desc, state, servo.get_target_angle(), servo.get_current_angle())
+
+    def in_view(self):
+        """ Gets the IDs of the rows that are currently in view (or nearly). """
+        first, last = self.tree.yview()
+        n = len(self.shown)
+        return self.shown[max(0, math.floor(first * n) - 1):math.ceil(last * n) + 1]
+
+    def show_states(self, lst):
+        """ Updates the rows for the given servos, if they are in view. Anything else in the list is ignored. """
+        in_view = set(self.in_view())
+        for device in lst:
+            if isinstance(device, Servo):
+                iid = str(device.index)
+                if iid in in_view:
+                    self.show_state(device)
+                else:
+                    self.stale.add(iid)
 
-    def offset_minus_10():
-        if ServoGridRow.offset == 0:
-            print('BAD INPUT: Trying to go beyond start!')
-            return
-        ServoGridRow.offset -= config.INCREMENT
-        ServoGridRow.set_offset()
+    def show_state(self, servo):
+        iid = str(servo.index)
+        values = self.row_values(servo)
+        if values != self.values[iid]:
+            self.tree.item(iid, values=values[1:], tags=values[:1])
+            self.values[iid] = values
+        self.stale.discard(iid)
 
-    def set_offset():
+    def show_all(self):
         for servo in servos:
-            servo.set_widget(None, None)
-        for row in servo_grid_rows:
-            row.update()
+            self.show_state(servo)
+
+    def scrolled(self, first, last):
+        """ Called by the Treeview when the view changes; updates rows that have come into view. """
+        self.scrollbar.set(first, last)
+        if self.stale:
+            for iid in self.in_view():
+                if iid in self.stale:
+                    self.show_state(servos[int(iid)])
+
+    def filter(self):
+        """ Shows only the servos that match the text in the find box. """
+        text = self.filter_text.get().strip()
+        self.tree.detach(*self.tree.get_children())
+        if text:
+            found = sorted(servo.index for servo in search_index.find(text))
+        else:
+            found = range(len(servos))
+        self.shown = [str(i) for i in found]
+        for i, iid in enumerate(self.shown):
+            self.tree.move(iid, '', i)
+        self.tree.yview_moveto(0)
+        self.found = 0
+
+    def find_next(self):
+        """ Selects the next servo in the list, scrolling to it and flashing it on the trackplan. """
+        if not self.shown:
+            return
+        iid = self.shown[self.found % len(self.shown)]
+        self.found += 1
+        self.tree.see(iid)
+        self.tree.selection_set(iid)
+        servo = servos[int(iid)]
+        if servo.graphic:
+            TrackPlan.show()
+            trackplan.flash(servo)
 
-    def headers(img, font):
-        """ Set the first row. """
-        if img:
-            ttk.Label(width=5, font=font, image=img).grid(column=0, row=0)
-        ttk.Label(text='ID', width=7, font=font).grid(column=1, row=0)
-        ttk.Label(text='Description', width=config.DESC_WIDTH, font=font).grid(column=2, row=0)
-        ttk.Label(text='Switch', font=font).grid(column=3, row=0)
-        ttk.Label(text='State', width=10, font=font).grid(column=4, row=0)
-        ttk.Label(text='Target', width=10, font=font).grid(column=7, row=0)
-        ttk.Label(text='Current', width=10, font=font).grid(column=8, row=0)
-
-    def __init__(self, row, font):
-        # When creating, the first servo is 0
-        self.row = row             # The row in the table in the GUI
-        #self.servo = servos[row]   # The current servo - but can change
-        #self.lbl_index = ttk.Label(text=str(row), font=font) # row number turns out to be confusing!
-        #self.lbl_index.grid(column=0, row=1 + row, pady=5)
-       
-        self.lbl_id = ttk.Label(text='---', width=7, font=font)
-        self.lbl_id.grid(column=1, row=1 + row)
+    def scroll(self, n):
+        self.tree.yview_scroll(n, 'units')
 
-        self.lbl_desc = ttk.Label(text='---', width=config.DESC_WIDTH, font=font)
-        self.lbl_desc.grid(column=2, row=1 + row)
+    def next_page(self):
+        self.scroll(config.INCREMENT)
 
-        self.btn_on_off = ttk.Button(text="On/Off")
-        self.btn_on_off.grid(column=3, row=1 + row)
-        self.btn_on_off.bind("<Button-1>", self.on_off_button)
-       
-        self.lbl_state = ttk.Label(text='OFF', width=10, font=font)    
-        self.lbl_state.grid(column=4, row=1 + row)
-       
-        self.btn_up = ttk.Button(text="Up")
-        self.btn_up.grid(column=5, row=1 + row)
-        self.btn_up.bind("<Button-1>", self.up_button)
-        self.btn_up.index = row
-       
-        self.btn_down = ttk.Button(text="Down")
-        self.btn_down.grid(column=6, row=1 + row)
-        self.btn_down.bind("<Button-1>", self.down_button)
-       
-        self.lbl_target_angle = ttk.Label(text='---', width=10, font=font)
-        self.lbl_target_angle.grid(column=7, row=1 + row)
-       
-        self.lbl_current_angle = ttk.Label(text='---', width=10, font=font)
-        self.lbl_current_angle.grid(column=8, row=1 + row)
-        #self.servo.set_widget(self.lbl_current_angle)
-       
-        self.update()
+    def previous_page(self):
+        self.scroll(-config.INCREMENT)
 
-    def update(self):
-        """
-        Updates the row for a new servo (or no servo) when offset changes
-        """
-        if 0 <= (self.row + self.offset) < len(servos):
-            self.servo = servos[self.row + self.offset]
-            #self.lbl_index.config(text=str(self.row + self.offset))
-            self.lbl_id.config(text=self.servo.id())
-            self.lbl_desc.config(text=self.servo.desc)
-            state = 'ON' if self.servo.turn_on else 'OFF'
-            if servo.centred:
-                self.lbl_state.config(text='CENTRE', foreground='blue', background='silver')
-            elif self.servo.turn_on:
-                self.lbl_state.config(text='ON', foreground='white', background='black')
-            else:
-                self.lbl_state.config(text='OFF', foreground='black', background='white')
-           
-            self.lbl_target_angle.config(text=self.servo.get_target_angle())
-            self.lbl_current_angle.config(text=self.servo.get_current_angle())
-            #print(f'set widget {self.row} for servo {self.servo.index}')
-            self.servo.set_widget(self.lbl_current_angle, self.lbl_state)
-        else:
-            self.servo = None
-            #self.lbl_index.config(text='---')
-            self.lbl_id.config(text='---')
-            self.lbl_desc.config(text='---')
-            self.lbl_state.config(text='---')    
-            self.lbl_target_angle.config(text='---')
-            self.lbl_current_angle.config(text='---')
-
-    def on_off_button(self, event):
-        """ When the On/Off button for this row is pressed. """
-        if not self.servo:
-            print('BAD INPUT: No servo at row')
+    def centre_all(self):
+        for servo in servos:
+            send_request('centre', servo=servo.index)
+
+    def selected(self):
+        """ Gets the selected servo, or None. """
+        selection = self.tree.selection()
+        if not selection:
+            print('BAD INPUT: No servo selected')
+            return None
+        return servos[int(selection[0])]
+
+    def on_off_button(self):
+        """ When the On/Off button is pressed. """
+        servo = self.selected()
+        if not servo:
             return
 
-        if self.servo.turn_on:
+        if servo.turn_on:
             print('Turning off')
-            self.lbl_state.config(text='OFF', foreground='black', background='white')
-            self.lbl_target_angle.config(text=self.servo.get_off_angle())
-            request['action'] = 'off'
-            request['servo'] = self.servo.index
+            send_request('off', servo=servo.index)
         else:
             print('Turning on')
-            self.lbl_state.config(text='ON', foreground='white', background='black')
-            self.lbl_target_angle.config(text=self.servo.get_on_angle())
-            request['action'] = 'on'
-            request['servo'] = self.servo.index
+            send_request('on', servo=servo.index)
 
 
-    def up_button(self, event):
-        """ When the Up button for this row is pressed. """
-        if not self.servo:
-            print('No servo at row')
+    def up_button(self):
+        """ When the Up button is pressed. """
+        servo = self.selected()
+        if not servo:
             return
 
-        if self.servo.centred:
-            if self.servo.centre_angle > 17500 - config.ANGLE_ADJUST * 100:
+        # Worked out here, but only the main loop changes the servo
+        off, centre, on = servo.off_angle, servo.centre_angle, servo.on_angle
+        if servo.centred:
+            if centre > 17500 - config.ANGLE_ADJUST * 100:
                 print('BAD INPUT: Cannot go over 175')
                 return
-            self.servo.centre_angle += config.ANGLE_ADJUST * 100
+            centre += config.ANGLE_ADJUST * 100
            
-        elif self.servo.turn_on:
-            if self.servo.on_angle > 17500 - config.ANGLE_ADJUST * 100:
+        elif servo.turn_on:
+            if on > 17500 - config.ANGLE_ADJUST * 100:
                 print('BAD INPUT: Cannot go over 175')
                 return
-            self.servo.on_angle += config.ANGLE_ADJUST * 100
+            on += config.ANGLE_ADJUST * 100
            
         else:
-            if self.servo.off_angle > 17500 - config.ANGLE_ADJUST * 100:
+            if off > 17500 - config.ANGLE_ADJUST * 100:
                 print('BAD INPUT: Cannot go over 175')
                 return
-            self.servo.off_angle += config.ANGLE_ADJUST * 100
+            off += config.ANGLE_ADJUST * 100
 
-        self.servo.target_angle += config.ANGLE_ADJUST * 100
-        self.lbl_target_angle.config(text=self.servo.get_target_angle())
+        self.send_angles(servo, off, centre, on, servo.target_angle + config.ANGLE_ADJUST * 100)
 
-    def down_button(self, event):
-        """ When the Down button for this row is pressed. """
-        if not self.servo:
-            print('No servo at row')
+    def down_button(self):
+        """ When the Down button is pressed. """
+        servo = self.selected()
+        if not servo:
             return
 
-        if self.servo.centred:
-            if self.servo.centre_angle < 500 + config.ANGLE_ADJUST * 100:
+        # Worked out here, but only the main loop changes the servo
+        off, centre, on = servo.off_angle, servo.centre_angle, servo.on_angle
+        if servo.centred:
+            if centre < 500 + config.ANGLE_ADJUST * 100:
                 print('BAD INPUT: Cannot go under 5')
                 return
-            self.servo.centre_angle -= config.ANGLE_ADJUST * 100
+            centre -= config.ANGLE_ADJUST * 100
            
-        elif self.servo.turn_on:
-            if self.servo.on_angle < 500 + config.ANGLE_ADJUST * 100:
+        elif servo.turn_on:
+            if on < 500 + config.ANGLE_ADJUST * 100:
                 print('BAD INPUT: Cannot go under 5')
                 return
-            self.servo.on_angle -= config.ANGLE_ADJUST * 100
+            on -= config.ANGLE_ADJUST * 100
            
         else:
-            if self.servo.off_angle < 500 + config.ANGLE_ADJUST * 100:
+            if off < 500 + config.ANGLE_ADJUST * 100:
                 print('BAD INPUT: Cannot go under 5')
                 return
-            self.servo.off_angle -= config.ANGLE_ADJUST * 100
+            off -= config.ANGLE_ADJUST * 100
 
-        self.servo.target_angle -= config.ANGLE_ADJUST * 100
-        self.lbl_target_angle.config(text=self.servo.get_target_angle())
+        self.send_angles(servo, off, centre, on, servo.target_angle - config.ANGLE_ADJUST * 100)
+
+    def send_angles(self, servo, off, centre, on, target):
+        """
+        Tells the main loop about the new angles; the row is updated as the servo moves.
+        With config.SEPARATE_GUI, the engine has its own servos, and the angles are not sent back,
+        so the ones here, which only this thread uses, are kept in step for the next press and saving.
+        """
+        send_request('angles', servo=servo.index, off=off, centre=centre, on=on, target=target)
+        if engine_conn:
+            servo.off_angle, servo.centre_angle, servo.on_angle = off, centre, on
 
 
 class ButtonGridRow():
@@ -1770,13 +3732,11 @@ class ButtonGridRow():
     """
    
     offset = 0
+    window = None
+    rows = []
 
     def show():
-        newWindow = ButtonsWindow(window)
-        newWindow.title('Buttons: ' + config.TITLE)
-        ButtonGridRow.headers(newWindow)
-        for i in range(config.NUMBER_OF_ROWS):
-            button_grid_rows.append(ButtonGridRow(newWindow, i))
+        DiagnosticWindow.open(ButtonGridRow, 'Buttons')
 
     def headers(win):
         """ Set the first row. """
@@ -1801,15 +3761,14 @@ class ButtonGridRow():
 
 
     def set_offset():
-        for button in buttons:
-            button.set_widget(None)
-        for row in button_grid_rows:
+        for row in ButtonGridRow.rows:
             row.update()
 
 
     def __init__(self, win, row):
         # When creating, the first button is 0
         self.row = row             # The row in the table in the GUI
+        self.button = None
         self.lbl_index = ttk.Label(win, text=str(row), font=window.label_font)
         self.lbl_index.grid(column=0, row=1 + row, pady=5)
        
@@ -1831,24 +3790,31 @@ class ButtonGridRow():
         """
         Updates the row for a new button (or no button) when offset changes
         """
+        old = self.button
         if 0 <= (self.row + ButtonGridRow.offset) < len(buttons):
             self.button = buttons[self.row + ButtonGridRow.offset]
             self.lbl_index.config(text=str(self.row + ButtonGridRow.offset))
             self.lbl_desc.config(text=self.button.id())
             self.lbl_off_list.config(text=self.button.list_servos(False))
             self.lbl_on_list.config(text=self.button.list_servos(True))
-            self.button.set_widget(self.lbl_state)
+            self.show_state()
         else:
             self.button = None
             self.lbl_index.config(text='---')
             self.lbl_desc.config(text='---')
-            self.lbl_state.config(text='---')    
             self.lbl_off_list.config(text='---')
             self.lbl_on_list.config(text='---')
-            self.lbl_state.config(text='---')
-           
-    def destroy_button(self):
-        self.lbl_state.destroy()
+            configure(self.lbl_state, text='---', background='', foreground='black')
+        show_in_row(self, old, self.button)
+
+    def show_state(self):
+        if self.button.was_pressed:
+            configure(self.lbl_state, text='ON!', foreground='white', background='black')
+        else:
+            configure(self.lbl_state, text='off', background='', foreground='black')
+
+    def stop_showing(self):
+        show_in_row(self, self.button, None)
 
 class LedGridRow():
     """
@@ -1858,24 +3824,21 @@ class LedGridRow():
     """
 
     offset = 0
+    window = None
+    rows = []
 
 
     def show():
         """ Responds to a menu click to show the window for LEDs"""
-
-        newWindow = Toplevel(window)
-        newWindow.title('LEDs: ' +  + config.TITLE)
-        LedGridRow.headers(newWindow)
-        for i in range(config.NUMBER_OF_ROWS):
-            led_grid_rows.append(LedGridRow(newWindow, i))
+        DiagnosticWindow.open(LedGridRow, 'LEDs')
            
     def all_leds_on():
         """ Responds to a menu click to tirn on all LEDs"""
-        request['action'] = 'all LED on'
+        send_request('all LED on')
 
     def all_leds_off():
         """ Responds to a menu click to tirn off all LEDs"""
-        request['action'] = 'all LED off'
+        send_request('all LED off')
 
 
     def headers(win):
@@ -1900,14 +3863,13 @@ class LedGridRow():
 
 
     def set_offset():
-        for led in leds:
-            led.set_widget(None)
-        for row in button_grid_rows:
+        for row in LedGridRow.rows:
             row.update()
 
     def __init__(self, win, row):
         # When creating, the first button is 0
         self.row = row             # The row in the table in the GUI
+        self.led = None
         self.lbl_index = ttk.Label(win, text=str(row), font=window.label_font)
         self.lbl_index.grid(column=0, row=1 + row, pady=5)
        
@@ -1943,19 +3905,23 @@ class LedGridRow():
             self.lbl_off_list.config(text=self.led.list_servos(False))
             self.lbl_on_list.config(text=self.led.list_servos(True))
         else:
-            self.button = None
+            self.led = None
             self.lbl_index.config(text='---')
             self.lbl_desc.config(text='---')
             self.lbl_off_list.config(text='---')
             self.lbl_on_list.config(text='---')
 
+    def stop_showing(self):
+        # LED rows do not show the state
+        pass
+
     def led_on_button(self, event):
-        request['action'] = 'LED on'
-        request['servo'] = self.led.index
+        if self.led:
+            send_request('LED on', servo=self.led.index)
 
     def led_off_button(self, event):
-        request['action'] = 'LED off'
-        request['servo'] = self.led.index
+        if self.led:
+            send_request('LED off', servo=self.led.index)
 
 
 class FlasherGridRow():
@@ -1966,16 +3932,13 @@ class FlasherGridRow():
     """
 
     offset = 0
+    window = None
+    rows = []
 
 
     def show():
-        """ Responds to a menu click to show the window for LEDs"""
-
-        newWindow = Toplevel(window)
-        newWindow.title('Flashers: ' + config.TITLE)
-        FlasherGridRow.headers(newWindow)
-        for i in range(config.NUMBER_OF_ROWS):
-            led_grid_rows.append(FlasherGridRow(newWindow, i))
+        """ Responds to a menu click to show the window for flashers"""
+        DiagnosticWindow.open(FlasherGridRow, 'Flashers')
            
     def headers(win):
         """ Set the first row. """
@@ -1984,7 +3947,7 @@ class FlasherGridRow():
         #ttk.Label(win, text='On servos', width=20, font=window.heading_font).grid(column=3, row=0)
 
     def offset_plus_10():
-        if FlasherGridRow.offset > len(leds) - config.INCREMENT:
+        if FlasherGridRow.offset > len(flashers) - config.INCREMENT:
             print('BAD INPUT: Trying to go beyond end!')
             return
         FlasherGridRow.offset += config.INCREMENT
@@ -1999,14 +3962,13 @@ class FlasherGridRow():
 
 
     def set_offset():
-        for flasher in flashers:
-            flasher.set_widget(None)
-        for row in flasher_grid_rows:
+        for row in FlasherGridRow.rows:
             row.update()
 
     def __init__(self, win, row):
         # When creating, the first button is 0
         self.row = row             # The row in the table in the GUI
+        self.flasher = None
         self.lbl_index = ttk.Label(win, text=str(row), font=window.label_font)
         self.lbl_index.grid(column=0, row=1 + row, pady=5)
        
@@ -2034,15 +3996,28 @@ class FlasherGridRow():
         """
         Updates the row for a new led (or no led) when offset changes
         """
+        old = self.flasher
         if 0 <= (self.row + FlasherGridRow.offset) < len(flashers):
             self.flasher = flashers[self.row + FlasherGridRow.offset]
             self.lbl_index.config(text=str(self.row + FlasherGridRow.offset))
             self.lbl_desc.config(text=self.flasher.id())
-            self.flasher.set_widget(self.lbl_state)
+            self.show_state()
         else:
             self.flasher = None
             self.lbl_index.config(text='---')
             self.lbl_desc.config(text='---')
+            configure(self.lbl_state, text='---', background='', foreground='black')
+        show_in_row(self, old, self.flasher)
+
+    def show_state(self):
+        if self.flasher.state:
+            configure(self.lbl_state, text='ON!', foreground='black', background='#80ff00')
+        else:
+            configure(self.lbl_state, text='---', foreground='black', background='#aaaaaa')
+
+    def stop_showing(self):
+        show_in_row(self, self.flasher, None)
+
     """
     def led_on_button(self, event):
         request['action'] = 'LED on'
@@ -2058,13 +4033,15 @@ class ServoWindow(tk.Tk):
     Defines instances of a top-level window, whichis used to display servos
     in a grid. Buttons on the grid allow interaction with individual servos,
     while a menu bar gives other options.
-    Content of each grid row is done in ServoGridRow.    
+    The servos are shown in a ServoTree.
     """
     def __init__(self, *args, **kwargs):
        
         tk.Tk.__init__(self, *args, **kwargs)  # Note: super() does not work here
         if config.ON_LINE:
             self.title(f"ServoMaster ({VERSION}): {config.TITLE}")
+        elif config.SIMULATE:
+            self.title(f"ServoMaster ({VERSION}): {config.TITLE} (simulated)")
         else:
             self.title(f"ServoMaster ({VERSION}): {config.TITLE} (off-line)")
            
@@ -2083,17 +4060,75 @@ class ServoWindow(tk.Tk):
             print('WARNING: Failed to find icon file, "servo_icon.png", but carrying on regardless!')
 
         # The widgets that do the work
-        ServoGridRow.headers(self.img, self.heading_font)
-        for i in range(config.NUMBER_OF_ROWS):
-            servo_grid_rows.append(ServoGridRow(i, self.label_font))
+        self.servo_tree = ServoTree(self, self.img, self.heading_font)
+        self.columnconfigure(2, weight=1)
+        self.rowconfigure(1, weight=1)
 
-        ttk.Label(text='Power supply:', font=self.heading_font).grid(column=1, row=config.NUMBER_OF_ROWS + 1)
+        ttk.Label(text='Power supply:', font=self.heading_font).grid(column=1, row=3)
         self.power_label = ttk.Label(text='---', font=self.heading_font)
-        self.power_label.grid(column=2, row=config.NUMBER_OF_ROWS + 1)
+        self.power_label.grid(column=2, row=3)
 
-        ttk.Label(text='Cycle count:', font=self.heading_font).grid(column=6, row=config.NUMBER_OF_ROWS + 1)
+        ttk.Label(text='Cycle count:', font=self.heading_font).grid(column=6, row=3)
         self.count_label = ttk.Label(text='---', font=self.heading_font)
-        self.count_label.grid(column=7, row=config.NUMBER_OF_ROWS + 1)
+        self.count_label.grid(column=7, row=3)
+
+        self.power_text = '---'
+        self.subscribe()
+        self.flush_id = self.after(round(1000 / config.GUI_FPS), self.flush)
+
+    def subscribe(self):
+        """
+        Listens for changes from the main loop. The handlers run on that thread,
+        so just note what needs updating for flush to pick up.
+        """
+        bus.subscribe(events.MOVE_STARTED, ServoWindow.servo_changed)
+        bus.subscribe(events.MOVED, ServoWindow.servo_changed)
+        bus.subscribe(events.SETTLED, ServoWindow.servo_changed)
+        bus.subscribe(events.PRESSED, ServoWindow.device_changed)
+        bus.subscribe(events.RELEASED, ServoWindow.device_changed)
+        bus.subscribe(events.FLASHER_CHANGED, ServoWindow.device_changed)
+        bus.subscribe(events.POWER_STATE, self.power_changed)
+
+    def unsubscribe(self):
+        bus.unsubscribe(events.MOVE_STARTED, ServoWindow.servo_changed)
+        bus.unsubscribe(events.MOVED, ServoWindow.servo_changed)
+        bus.unsubscribe(events.SETTLED, ServoWindow.servo_changed)
+        bus.unsubscribe(events.PRESSED, ServoWindow.device_changed)
+        bus.unsubscribe(events.RELEASED, ServoWindow.device_changed)
+        bus.unsubscribe(events.FLASHER_CHANGED, ServoWindow.device_changed)
+        bus.unsubscribe(events.POWER_STATE, self.power_changed)
+
+    def servo_changed(event):
+        gui_updates.mark(event.source)
+        trackplan_updates.mark(event.source)
+
+    def device_changed(event):
+        gui_updates.mark(event.source)
+
+    def power_changed(self, event):
+        self.power_text = event.data['text']
+
+    def flush(self):
+        """
+        Applies the changes the main loop has marked since last time, then sets a timer to go again,
+        so the widgets are updated at most config.GUI_FPS times a second, and only ever from this thread.
+        """
+        if engine_stopped():
+            # Told to exit from elsewhere, so close just as if from the menu
+            print('INFO: The engine has stopped, so closing the GUI.')
+            self.terminate_gui()
+            return
+        if state_follower:
+            state_follower.follow()
+        configure(self.count_label, text=str(loop_count))
+        configure(self.power_label, text=self.power_text)
+        dirty = gui_updates.take()
+        self.servo_tree.show_states(dirty)
+        for device in dirty:
+            row = shown_rows.get(device)
+            if row:
+                row.show_state()
+        self.flush_id = self.after(round(1000 / config.GUI_FPS), self.flush)
 
 
     def create_menubar(self):
@@ -2107,11 +4142,11 @@ class ServoWindow(tk.Tk):
         menubar.add_cascade(label="File", menu=file_menu, font=menu_font)
 
         servos_menu = Menu(menubar, tearoff=0)
-        servos_menu.add_command(label="Centre all", command=ServoGridRow.centre_all, font=menu_font)
-        servos_menu.add_command(label="Next " + str(config.INCREMENT), command=ServoGridRow.offset_plus_10, font=menu_font)
-        servos_menu.add_command(label="Previous " + str(config.INCREMENT), command=ServoGridRow.offset_minus_10, font=menu_font)
+        servos_menu.add_command(label="Centre all", command=lambda: self.servo_tree.centre_all(), font=menu_font)
+        servos_menu.add_command(label="Next " + str(config.INCREMENT), command=lambda: self.servo_tree.next_page(), font=menu_font)
+        servos_menu.add_command(label="Previous " + str(config.INCREMENT), command=lambda: self.servo_tree.previous_page(), font=menu_font)
         servos_menu.add_command(label="Track plan...", command=TrackPlan.show, font=menu_font)
-        servos_menu.add_command(label="Quiet", command=Servo.quiet_all, font=menu_font)
+        servos_menu.add_command(label="Quiet", command=lambda: send_request('quiet'), font=menu_font)
         menubar.add_cascade(label="Servos", menu=servos_menu, font=menu_font)
 
         leds_menu = Menu(menubar, tearoff=0)
@@ -2124,16 +4159,24 @@ class ServoWindow(tk.Tk):
 
         buttons_menu = Menu(menubar, tearoff=0)
         buttons_menu.add_command(label="Buttons...", command=ButtonGridRow.show, font=menu_font)
+        buttons_menu.add_command(label="Latency...", command=LatencyWindow.show, font=menu_font)
+        buttons_menu.add_command(label="Dump latency to file", command=LatencyWindow.dump, font=menu_font)
         buttons_menu.add_command(label="Next " + str(config.INCREMENT), command=ButtonGridRow.offset_plus_10, font=menu_font)
         buttons_menu.add_command(label="Previous " + str(config.INCREMENT), command=ButtonGridRow.offset_minus_10, font=menu_font)
         menubar.add_cascade(label="Buttons", menu=buttons_menu, font=menu_font)
 
         flashers_menu = Menu(menubar, tearoff=0)
         flashers_menu.add_command(label="Flashers...", command=FlasherGridRow.show, font=menu_font)
-        flashers_menu.add_command(label="Next " + str(config.INCREMENT), command=LedGridRow.offset_plus_10, font=menu_font)
-        flashers_menu.add_command(label="Previous " + str(config.INCREMENT), command=LedGridRow.offset_minus_10, font=menu_font)
+        flashers_menu.add_command(label="Next " + str(config.INCREMENT), command=FlasherGridRow.offset_plus_10, font=menu_font)
+        flashers_menu.add_command(label="Previous " + str(config.INCREMENT), command=FlasherGridRow.offset_minus_10, font=menu_font)
         menubar.add_cascade(label="Flashers", menu=flashers_menu, font=menu_font)
 
+        i2c_menu = Menu(menubar, tearoff=0)
+        i2c_menu.add_command(label="Statistics...", command=I2CStatsWindow.show, font=menu_font)
+        i2c_menu.add_command(label="Dump to file", command=I2CStatsWindow.dump, font=menu_font)
+        i2c_menu.add_command(label="Reset", command=I2CStatsWindow.reset, font=menu_font)
+        menubar.add_cascade(label="I2C", menu=i2c_menu, font=menu_font)
+
         help_menu = Menu(menubar, tearoff=0)
         help_menu.add_command(label="Help", command=self.help_function, font=menu_font)
         help_menu.add_command(label="About...", command=self.about_function, font=menu_font)
@@ -2156,14 +4199,12 @@ class ServoWindow(tk.Tk):
                 self.terminate_gui()
 
     def terminate_gui(self):
-        # Has to destroy count_label explicitly because the main loop will try to use it otherwise.
-        # Just setting to None is not good enough (and I do not know why).
-        self.power_label.destroy()
-        self.power_label = None
-        self.count_label.destroy()
-        self.count_label = None
+        self.after_cancel(self.flush_id)
+        self.unsubscribe()
         self.destroy()
-        request['action'] = 'terminate'
+        if not engine_stopped():
+            send_request('terminate')
+        dump_statistics()
         print('INFO: GUI terminated.')
 
     def about_function(self):
@@ -2172,38 +4213,116 @@ class ServoWindow(tk.Tk):
 
     def help_function(self):
         """ Menu response. """
-        messagebox.showinfo("Help", "Each row controls a servo. Switch the point from left to right and back using On/Off.\n\nThe first angle is the target - what the servo is heading for. The second angle is the current value.\n\nUse Up and Down to modify the target angle.\n\nRemember to do File - Save to save your changes before you exit the program.")
+        messagebox.showinfo("Help", "Each row is a servo. Select one, then switch the point from left to right and back using On/Off (or double-click the row).\n\nThe first angle is the target - what the servo is heading for. The second angle is the current value.\n\nUse Up and Down to modify the target angle.\n\nType in the find box to show only servos with a word in the description starting with that, or on a board, eg '2.', or with a button or LED with that ID. Press Enter to go to each in turn and flash it on the trackplan.\n\nRemember to do File - Save to save your changes before you exit the program.")
 
 
-"""
-Set the angle for each servo
-Need to do this to ensure the servos are where we expect them to be.
-Have already set the current angle in the initialiser
-Do it in sequence with slight delay so only drawing minimal power
-"""
-if config.ON_LINE:
-    for servo in servos:
+def dump_statistics():
+    """ Writes the I2C statistics and latencies to file, if collected, on the way out. """
+    if config.I2C_STATS:
+        I2CStatsWindow.dump()
+    if config.LATENCY_TRACE:
+        LatencyWindow.dump()
+
+
+def display_available():
+    """ Returns True if Tk can open a display, so there can be a GUI. """
+    try:
+        tk.Tk().destroy()
+        return True
+    except TclError:
+        return False
+
+
+def home_servos():
+    """
+    Set the angle for each servo
+    Need to do this to ensure the servos are where we expect them to be.
+    Have already set the current angle in the initialiser
+    Do it in sequence with slight delay so only drawing minimal power
+    """
+    if not USE_BUS:
+        return
+    for servo in local_servos:
         # print('INFO: Setting servo ' + servo.id() + ' to OFF')
-        try:
-            servo.servo.angle = servo.current_angle / 100
-            if servo.relay:
-                servo.relay.set(True)
-        except OSError as err:
-            print("ERROR: OSError {err}")
+        # If the board is quarantined this does nothing, and the servo is sent its
+        # position when the board recovers
+        if servo.guard.quarantined:
+            servo.needs_sync = True
+            continue
+        # Waited for, so a failure is seen, and the servo is there before the pause
+        if not servo.write(servo.current_angle / 100, wait=True):
             print("This may be because there is no ground or power connection\nto the servo board on the I2C side")
-            print("Terminating!")
-            exit()
-        time.sleep(0.1)
-        servo.servo.angle = None
-
+            servo.needs_sync = True
+            continue
+        if servo.relay:
+            servo.relay.set(True)
+        if config.ON_LINE:
+            time.sleep(0.1)
+        servo.write(None)
+
+
+def main():
+    global window, this_node, primary, USE_BUS
+    parser = argparse.ArgumentParser(description='Controls the servos, LEDs, etc. on the layout.')
+    parser.add_argument('--node', default=config.NODE, help='Which node this is, when the layout is shared between several')
+    parser.add_argument('--standby', metavar='HOST:PORT', default=config.PRIMARY, help='Stand by for the primary at this address, see standby.py')
+    parser.add_argument('--headless', action='store_true', default=not config.GUI, help='Run without the GUI, using the web dashboard, control socket, etc.')
+    args = parser.parse_args()
+    this_node = args.node
+    primary = args.standby
+    if primary:
+        # Nothing touches the bus until we take over
+        USE_BUS = False
+    headless = args.headless
+    if not headless and not display_available():
+        print("WARNING: Cannot open a display, so running without the GUI.")
+        headless = True
+
+    engine = None
+    main_thread = None
+    if config.SEPARATE_GUI and not headless:
+        engine = start_engine()
+    else:
+        if config.LOG_EVENTS:
+            bus.subscribe(None, events.log)
+        load(FILENAME)
+        report()
+        start_publishing([])
+        start_control_server()
+        start_stream_server()
+        start_dashboard()
+        start_cluster()
+        start_replicator()
+        start_standby()
+        main_thread = start_main_loop()
+        home_servos()
+
+    if headless:
+        print("INFO: Running without the GUI.")
+        wait_for_engine(main_thread)
+        dump_statistics()
+    else:
+        print("INFO: About to open GUI")
+
+        window = ServoWindow()
+        print("INFO: GUI 1")
+        if config.SHOW_TRACKPLAN:
+            TrackPlan.show()
+            window.geometry("+%d+%d" %(10, config.HEIGHT + 150))
+        print("INFO: GUI 2")
+        window.mainloop()
+        print("INFO: GUI running")
+    if engine:
+        engine.join(5)
+        state_follower.close()
+    else:
+        stop_replicator()
+        stop_cluster()
+        stop_dashboard()
+        stop_stream_server()
+        stop_control_server()
+        remove_status_file()
 
-print("INFO: About to open GUI")
 
-window = ServoWindow()
-print("INFO: GUI 1")
-if config.SHOW_TRACKPLAN:
-    TrackPlan.show()
-    window.geometry("+%d+%d" %(10, config.HEIGHT + 150))
-print("INFO: GUI 2")
-window.mainloop()
-print("INFO: GUI running")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Sends commands to a running ServoMaster through its control socket (config.CONTROL_SOCKET).
+See control.py for the commands.
+
+    python servoctl.py 3 on                 # one command
+    python servoctl.py "3 on; 4 off; l2 on" # a batch, done together
+    python servoctl.py < commands.txt       # one command per line, all over one connection
+    python servoctl.py                      # type commands; a blank line or Ctrl-D to stop
+
+From a script, keep a ServoCtl and use it for every command, which saves connecting each time:
+
+    from servoctl import ServoCtl
+    with ServoCtl() as ctl:
+        ctl.send('3 on')
+        ctl.batch(['3 off', '4 on'])
+"""
+
+import argparse
+import socket
+import sys
+
+import config
+
+
+class ServoCtlError(Exception):
+    pass
+
+
+class ServoCtl:
+    """ One connection to the control socket, kept open for any number of commands. """
+    def __init__(self, path=config.CONTROL_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('rb')
+
+    def send(self, command):
+        """ Sends a command, or several separated by semicolons, and waits for the reply. Raises ServoCtlError if refused. """
+        self.sock.sendall(command.encode('utf-8') + b'\n')
+        return self.reply()
+
+    def batch(self, commands):
+        """ Sends the commands to be done together, in one pass of the main loop. """
+        self.sock.sendall('\n'.join(['begin'] + list(commands) + ['end']).encode('utf-8') + b'\n')
+        return self.reply()
+
+    def reply(self):
+        reply = self.rfile.readline().decode('utf-8').strip()
+        if not reply:
+            raise ServoCtlError('Connection closed by ServoMaster')
+        if reply != 'OK':
+            raise ServoCtlError(reply.removeprefix('ERROR '))
+        return reply
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sends commands to a running ServoMaster.')
+    parser.add_argument('--socket', default=config.CONTROL_SOCKET, help='The control socket')
+    parser.add_argument('command', nargs='*', help='The command; if none, they are read from stdin')
+    args = parser.parse_args()
+
+    try:
+        ctl = ServoCtl(args.socket)
+    except OSError as ex:
+        print(f'ERROR: Cannot connect to {args.socket}; is ServoMaster running? ({ex})')
+        sys.exit(1)
+
+    failed = False
+    batch = None    # Lines between "begin" and "end"
+    with ctl:
+        if args.command:
+            lines = [' '.join(args.command)]
+        else:
+            if sys.stdin.isatty():
+                print('Enter commands, or a blank line to stop.')
+            lines = sys.stdin
+        for line in lines:
+            line = line.strip()
+            if not line:
+                if sys.stdin.isatty():
+                    break
+                continue
+            try:
+                if line.lower() == 'begin':
+                    batch = []
+                elif line.lower() == 'end' and batch is not None:
+                    ctl.batch(batch)
+                    batch = None
+                elif batch is not None:
+                    batch.append(line)
+                else:
+                    ctl.send(line)
+            except ServoCtlError as ex:
+                print(f'ERROR: {ex}')
+                failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
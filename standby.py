@@ -0,0 +1,129 @@
+"""
+Keeps a second ServoMaster, on another Pi, ready to take over the layout if the first fails.
+
+The primary sends the standby the state of everything, as it changes: where each servo is and
+where it is going, and the state of each LED, relay and flasher. It goes as lines of JSON, as in
+cluster.py, through a StreamServer (see streaming.py), so each change is encoded once and sent
+from a thread of its own, and the main loop never waits for the standby. While nothing changes,
+the primary sends a heartbeat every config.HEARTBEAT_INTERVAL. The heartbeats come from the main
+loop, not a thread of their own, so they stop if the loop stalls or dies, not just if the process
+does, and the standby takes over.
+
+The standby loads the same servo.txt but leaves the I2C bus alone. If the connection to the
+primary closes, or nothing comes for config.FAILOVER_TIMEOUT, it connects to the boards and
+carries on from where the primary was: servos that were moving carry on moving, LEDs and relays
+are set as they were in one write to each I/O board, and nothing is homed.
+
+The bus must be wired to both Pis, for example through a switch that gives it to the standby
+when the primary loses power. If the primary is still running, but cannot be reached, both
+will drive the boards; the standby cannot tell the difference.
+
+    python servo.py                                 # the primary, with config.STANDBY_PORT set
+    python servo.py --standby primary.local:8771    # the standby
+"""
+
+import json
+import socket
+import threading
+import time
+
+import config
+from streaming import StreamServer
+
+
+RETRY = 1.0     # Seconds between attempts to connect to the primary
+HEARTBEAT = {'m':'hb'}
+
+
+class Replicator(StreamServer):
+    """
+    On the primary, sends the state to a standby, with heartbeats.
+    The snapshot function should return the layout hash and the state of everything,
+    as {"m":"snapshot","layout":...,"messages":[...]}.
+    The main loop should call beat on every pass.
+    """
+    def __init__(self, host, port, snapshot):
+        super().__init__(host, port, snapshot)
+        self.last_beat = 0.0
+
+    def beat(self):
+        """ Sends a heartbeat, if it is time for one. """
+        now = time.monotonic()
+        if now - self.last_beat >= config.HEARTBEAT_INTERVAL:
+            self.last_beat = now
+            self.publish(HEARTBEAT)
+
+
+class Standby:
+    """
+    On the standby, follows the primary at host:port, passing each message to the receive function.
+    Once it has heard from the primary, it calls take_over when the primary goes, then stops.
+    """
+    def __init__(self, host, port, layout, receive, take_over):
+        self.host = host
+        self.port = port
+        self.layout = layout
+        self.receive = receive
+        self.take_over = take_over
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, name='standby', daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        reported = False
+        while self.running:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=RETRY)
+            except OSError as ex:
+                if not reported:
+                    print(f'WARNING: Cannot connect to the primary at {self.host}:{self.port} ({ex}); will keep trying.')
+                    reported = True
+                time.sleep(RETRY)
+                continue
+            if self.follow(sock) and self.running:
+                self.running = False
+                self.take_over()
+                return
+            time.sleep(RETRY)
+
+    def follow(self, sock):
+        """
+        Reads from the primary until it goes. Returns True if it was followed, so we should take over;
+        not if it went before its state was received, as then there is nothing to carry on from.
+        The receive function should raise ValueError for a message it will not take.
+        """
+        followed = False
+        sock.settimeout(config.FAILOVER_TIMEOUT)
+        with sock, sock.makefile('rb') as f:
+            try:
+                snapshot = json.loads(f.readline())
+                if not isinstance(snapshot, dict) or snapshot.get('m') != 'snapshot':
+                    raise ValueError('no state from the primary')
+                if snapshot.get('layout') != self.layout:
+                    print('ERROR: The primary has a different servo.txt, so not standing by for it.')
+                    self.running = False
+                    return False
+                for message in snapshot['messages']:
+                    self.receive(message)
+                followed = True
+                print(f'INFO: Standing by for the primary at {self.host}:{self.port}')
+                for line in f:
+                    try:
+                        message = json.loads(line)
+                        if message != HEARTBEAT:
+                            self.receive(message)
+                    except ValueError as ex:
+                        print(f'WARNING: Ignored a bad message from the primary ({ex}): {line[:200]!r}')
+                print('WARNING: The primary has closed the connection.')
+            except socket.timeout:
+                print(f'WARNING: Nothing from the primary for {config.FAILOVER_TIMEOUT} seconds.')
+            except (OSError, ValueError, KeyError, TypeError) as ex:
+                print(f'WARNING: Lost the connection to the primary ({ex}).')
+        if not followed and self.running:
+            print('WARNING: The primary went before sending its state, so not taking over; trying again.')
+        return followed
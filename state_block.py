@@ -0,0 +1,155 @@
+"""
+A fixed layout for the live state of the layout in a block of memory, so the engine can
+write it and other processes can read it without either waiting for the other.
+
+The block starts with a header, then a record for each servo, then a byte for each
+button, LED, relay and flasher, in the order they are in servo.txt:
+
+  header    magic, version, sequence number, the counts, loop count and rate, UPS readings
+  servos    current angle, target angle (degrees, float), flags
+  buttons   1 if pressed
+  LEDs      1 if on
+  relays    1 if on
+  flashers  1 if on
+
+Writes are protected with a seqlock: the sequence number is odd while a write is
+in progress, so a reader copies what it needs, then checks the number is even and
+unchanged, or tries again. There is one writer, and any number of readers.
+"""
+
+import struct
+import time
+
+
+MAGIC = b'SVMS'
+VERSION = 1
+
+# magic, version, header size, sequence, then the counts of servos, buttons, LEDs, relays, flashers,
+# loop count, time of the last write, loops per second, UPS voltage and current, power state
+HEADER = struct.Struct('<4sHHQIIIIIIdfffB7x')
+SEQ_OFFSET = 8
+SERVO = struct.Struct('<ffB3x')
+
+# Servo flags
+TURN_ON = 1
+CENTRED = 2
+MOVING = 4
+QUARANTINED = 8
+
+# Power states
+POWER_STATES = ('unknown', 'normal', 'charging', 'battery')
+
+SPIN = 1000     # Give up reading after this many tries
+
+
+def size(n_servos, n_buttons, n_leds, n_relays, n_flashers):
+    """ Gets the size in bytes of a block for the given numbers of each. """
+    return HEADER.size + SERVO.size * n_servos + n_buttons + n_leds + n_relays + n_flashers
+
+
+class StateBlock:
+    """
+    The state in a buffer, which can be shared memory, an mmap, or just a bytearray.
+    Create with counts to set up a new block for writing, or without to read an existing one.
+    """
+    def __init__(self, buf, counts=None):
+        self.buf = buf
+        if counts:
+            HEADER.pack_into(buf, 0, MAGIC, VERSION, HEADER.size, 0, *counts, 0, time.time(), 0.0, 0.0, 0.0, 0)
+        header = HEADER.unpack_from(buf, 0)
+        if header[0] != MAGIC:
+            raise ValueError('Not a ServoMaster state block')
+        if header[1] != VERSION:
+            raise ValueError(f'State block is version {header[1]}, expected {VERSION}')
+        self.counts = header[4:9]
+        n_servos, n_buttons, n_leds, n_relays, n_flashers = self.counts
+        self.servos_at = HEADER.size
+        self.buttons_at = self.servos_at + SERVO.size * n_servos
+        self.leds_at = self.buttons_at + n_buttons
+        self.relays_at = self.leds_at + n_leds
+        self.flashers_at = self.relays_at + n_relays
+        self.end = self.flashers_at + n_flashers
+        self.seq = header[3]
+
+    # Writing - only from one thread
+
+    def begin(self):
+        self.seq += 1
+        struct.pack_into('<Q', self.buf, SEQ_OFFSET, self.seq)
+
+    def commit(self):
+        self.seq += 1
+        struct.pack_into('<Q', self.buf, SEQ_OFFSET, self.seq)
+
+    def set_servo(self, i, current, target, flags):
+        self.begin()
+        SERVO.pack_into(self.buf, self.servos_at + SERVO.size * i, current, target, flags)
+        self.commit()
+
+    def set_button(self, i, value):
+        self._set_byte(self.buttons_at + i, value)
+
+    def set_led(self, i, value):
+        self._set_byte(self.leds_at + i, value)
+
+    def set_relay(self, i, value):
+        self._set_byte(self.relays_at + i, value)
+
+    def set_flasher(self, i, value):
+        self._set_byte(self.flashers_at + i, value)
+
+    def _set_byte(self, offset, value):
+        self.begin()
+        self.buf[offset] = 1 if value else 0
+        self.commit()
+
+    def set_loop(self, count, rate):
+        self.begin()
+        struct.pack_into('<Idf', self.buf, 36, count, time.time(), rate)
+        self.commit()
+
+    def set_power(self, state, voltage, current):
+        self.begin()
+        struct.pack_into('<ffB', self.buf, 52, voltage, current, POWER_STATES.index(state))
+        self.commit()
+
+    # Reading - from anywhere
+
+    def read(self, fn):
+        """
+        Calls the function with the buffer until it gets a consistent result, and returns that.
+        The function should just copy out what it needs.
+        """
+        for _ in range(SPIN):
+            seq = struct.unpack_from('<Q', self.buf, SEQ_OFFSET)[0]
+            if seq % 2:
+                continue
+            result = fn(self.buf)
+            if struct.unpack_from('<Q', self.buf, SEQ_OFFSET)[0] == seq:
+                return seq, result
+        raise TimeoutError('State block is being written too often to read')
+
+    def sequence(self):
+        """ Gets the sequence number; if it has not changed, nothing else has. """
+        return struct.unpack_from('<Q', self.buf, SEQ_OFFSET)[0]
+
+    def snapshot(self):
+        """ Gets a consistent copy of everything, as a dictionary. """
+        def copy(buf):
+            return bytes(buf[:self.end])
+        seq, data = self.read(copy)
+        header = HEADER.unpack_from(data, 0)
+        return {
+            'seq':seq,
+            'loop_count':header[9],
+            'time':header[10],
+            'loop_rate':header[11],
+            'ups_voltage':header[12],
+            'ups_current':header[13],
+            'power_state':POWER_STATES[header[14]],
+            'servos':list(SERVO.iter_unpack(data[self.servos_at:self.buttons_at])),
+            'buttons':list(data[self.buttons_at:self.leds_at]),
+            'leds':list(data[self.leds_at:self.relays_at]),
+            'relays':list(data[self.relays_at:self.flashers_at]),
+            'flashers':list(data[self.flashers_at:self.end]),
+        }
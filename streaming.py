@@ -0,0 +1,207 @@
+"""
+Streams the state of the layout over TCP to any number of followers, such as tablets
+around the layout or a screen in the control room.
+
+Each message is a line of JSON. A follower is sent a snapshot of everything when it
+connects, then just the changes as they happen:
+
+    {"t":"snapshot","servos":[...],"buttons":[...],"leds":[...],"power":{...}}
+    {"t":"s","i":3,"on":1,"c":0,"m":0,"a":140.0}     servo 3 is on, not centred, has settled at 140°
+    {"t":"b","i":2,"p":1}                            button 2 pressed
+    {"t":"l","i":4,"v":0}                            LED 4 off
+    {"t":"p","state":"battery","v":8.31,"ma":-412}   UPS state
+
+Changes give the new state, not the difference, so a follower that sees one twice comes
+to no harm. Each change is encoded once, whatever the number of followers, then just
+added to the output of each, and one thread does all the sending, gathering up
+changes that come close together. A follower that
+falls too far behind is disconnected; when it reconnects it gets a new snapshot.
+
+Followers only listen; anything they send is ignored. By default the stream is only on this
+machine (config.STREAM_HOST); set that to '' for followers elsewhere on the network. To watch:
+
+    python streaming.py --host localhost
+"""
+
+import argparse
+import json
+import selectors
+import socket
+import threading
+import time
+import traceback
+
+import config
+
+
+MAX_BUFFER = 1000000    # Bytes waiting for a follower before giving up on it
+SEND_SIZE = 65536       # Most bytes to try to send at once
+COALESCE = 0.01         # Seconds to gather changes before sending, so a burst goes in one packet
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class Follower:
+    __slots__ = ('sock', 'address', 'out')
+
+    def __init__(self, sock, address, out):
+        self.sock = sock
+        self.address = address
+        self.out = out
+
+
+class StreamServer:
+    """
+    Listens for followers, and sends them what is published.
+    The snapshot function should return a dictionary of the state of everything.
+    """
+    def __init__(self, host, port, snapshot):
+        self.snapshot = snapshot
+        self.lock = threading.Lock()
+        self.followers = {}
+        self.selector = selectors.DefaultSelector()
+        self.listener = socket.create_server((host, port))
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        # Writing to this wakes the thread when there is something to send
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.woken = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, name='stream', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake()
+        if self.thread:
+            self.thread.join(2)
+        for follower in list(self.followers.values()):
+            self.drop(follower)
+        self.selector.close()
+        self.listener.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+    def publish(self, message):
+        """ Sends the message to every follower. Can be called from any thread, and does not wait. """
+        data = encode(message)
+        with self.lock:
+            if not self.followers:
+                return
+            for follower in self.followers.values():
+                follower.out += data
+        self.wake()
+
+    def wake(self):
+        if not self.woken:
+            self.woken = True
+            try:
+                self.wake_w.send(b'x')
+            except OSError:
+                pass
+
+    def serve(self):
+        while self.running:
+            for key, mask in self.selector.select():
+                try:
+                    if key.fileobj is self.listener:
+                        self.accept()
+                    elif key.fileobj is self.wake_r:
+                        time.sleep(COALESCE)
+                        self.woken = False
+                        try:
+                            self.wake_r.recv(4096)
+                        except BlockingIOError:
+                            pass
+                    else:
+                        follower = key.data
+                        if mask & selectors.EVENT_READ:
+                            self.receive(follower)
+                        elif mask & selectors.EVENT_WRITE:
+                            self.send(follower)
+                except Exception:
+                    print(traceback.format_exc())
+                    print('ERROR: Streaming failed; carrying on.')
+            self.update_interest()
+
+    def accept(self):
+        sock, address = self.listener.accept()
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Under the lock so nothing published can be missed, or come before the snapshot
+        with self.lock:
+            follower = Follower(sock, address, bytearray(encode(self.snapshot())))
+            self.followers[sock] = follower
+        self.selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, follower)
+        print(f'INFO: Streaming to {address[0]}:{address[1]}')
+
+    def receive(self, follower):
+        # Followers should not send anything, so this is usually them going
+        try:
+            data = follower.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.drop(follower)
+
+    def send(self, follower):
+        with self.lock:
+            data = bytes(follower.out[:SEND_SIZE])
+        try:
+            sent = follower.sock.send(data)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.drop(follower)
+            return
+        with self.lock:
+            del follower.out[:sent]
+
+    def update_interest(self):
+        """ Only ask to be told a follower is ready to write when there is something for it. """
+        with self.lock:
+            followers = list(self.followers.values())
+        for follower in followers:
+            if len(follower.out) > MAX_BUFFER:
+                print(f'WARNING: Streaming to {follower.address[0]}:{follower.address[1]} has fallen too far behind; dropping it.')
+                self.drop(follower)
+                continue
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if follower.out else 0)
+            if self.selector.get_key(follower.sock).events != events:
+                self.selector.modify(follower.sock, events, follower)
+
+    def drop(self, follower):
+        with self.lock:
+            self.followers.pop(follower.sock, None)
+        try:
+            self.selector.unregister(follower.sock)
+        except (KeyError, ValueError):
+            pass
+        follower.sock.close()
+
+
+def main():
+    """ A follower that prints what it is sent. """
+    parser = argparse.ArgumentParser(description='Prints the state streamed from a running ServoMaster.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=config.STREAM_PORT or 8765)
+    args = parser.parse_args()
+    with socket.create_connection((args.host, args.port)) as sock:
+        for line in sock.makefile('r', encoding='utf-8'):
+            print(line, end='', flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import os
+import socket
+import stat
+import threading
+
+import pytest
+
+import control
+from control import ControlServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    done = []
+    def execute(commands):
+        if any('bad' in command for command in commands):
+            raise ValueError('Not understood')
+        done.append(commands)
+    server = ControlServer(str(tmp_path / 'control'), execute)
+    server.done = done
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    sock = socket.socket(socket.AF_UNIX)
+    sock.connect(server.path)
+    f = sock.makefile('rw')
+    yield f
+    f.close()
+    sock.close()
+
+
+def send(client, *lines):
+    client.write(''.join(line + '\n' for line in lines))
+    client.flush()
+
+
+def test_one_reply_per_command(server, client):
+    send(client, '3 on', '', '4 bad')
+    assert client.readline() == 'OK\n'
+    assert client.readline() == 'ERROR Not understood\n'
+    assert server.done == [['3 on']]
+
+
+def test_a_batch_on_one_line(server, client):
+    send(client, '0 on; 1 on;; l4 off')
+    assert client.readline() == 'OK\n'
+    assert server.done == [['0 on', '1 on', 'l4 off']]
+
+
+def test_begin_and_end(server, client):
+    send(client, 'begin', '0 on', '1 off', 'END', '2 on')
+    assert client.readline() == 'OK\n'
+    assert client.readline() == 'OK\n'
+    assert server.done == [['0 on', '1 off'], ['2 on']]
+
+
+def test_a_bad_batch_does_nothing(server, client):
+    send(client, 'begin', '0 on', '1 bad', 'end')
+    assert client.readline() == 'ERROR Not understood\n'
+    assert server.done == []
+
+
+def test_begin_within_a_batch_spoils_it(server, client):
+    send(client, 'begin', '0 on', 'begin', '1 on', 'end', 'begin', '2 on', 'end')
+    assert client.readline() == 'ERROR Already in a batch\n'
+    assert client.readline() == 'OK\n'
+    assert server.done == [['2 on']]
+
+
+def test_end_without_begin(server, client):
+    send(client, 'end', '0 on')
+    assert client.readline() == 'ERROR Not in a batch\n'
+    assert client.readline() == 'OK\n'
+
+
+def test_socket_is_for_the_owner_and_group(server):
+    assert stat.S_IMODE(os.stat(server.path).st_mode) == control.MODE
+
+
+def test_left_over_socket_is_replaced_and_removed(tmp_path):
+    path = tmp_path / 'control'
+    path.write_text('left behind')
+    server = ControlServer(str(path), lambda commands: None)
+    assert stat.S_ISSOCK(os.stat(path).st_mode)
+    server.server_close()
+    assert not path.exists()
@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+import config
+import i2c_bus
+from i2c_bus import Bus
+from i2c_stats import BUTTON_READ, SERVO_WRITE, LED_WRITE, LCD_WRITE
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    monkeypatch.setattr(config, 'I2C_DEADLINES', [10.0, 10.0, 10.0])
+    return Bus(1, None)
+
+
+def hold(bus):
+    """ Keeps the worker busy until the event returned is set, so jobs can be queued up behind it. """
+    started = threading.Event()
+    go = threading.Event()
+    def blocker():
+        started.set()
+        go.wait(5)
+    bus.queue(LCD_WRITE, 'blocker', blocker)
+    assert started.wait(5)
+    return go
+
+
+def run(bus, go):
+    go.set()
+    bus.finish()
+
+
+def test_classes_go_in_priority_order(bus):
+    done = []
+    go = hold(bus)
+    bus.queue(LCD_WRITE, 'lcd', lambda: done.append('housekeeping'))
+    bus.queue(LED_WRITE, 'io', lambda: done.append('indicator'))
+    bus.queue(SERVO_WRITE, 'servo', lambda: done.append('servo'))
+    bus.queue(BUTTON_READ, 'io', lambda: done.append('input'))
+    run(bus, go)
+    assert done == ['input', 'servo', 'indicator', 'housekeeping']
+
+
+def test_boards_take_turns_within_a_class(bus):
+    done = []
+    go = hold(bus)
+    for name in ('a1', 'a2', 'a3'):
+        bus.queue(SERVO_WRITE, 'a', lambda name=name: done.append(name))
+    for name in ('b1', 'b2'):
+        bus.queue(SERVO_WRITE, 'b', lambda name=name: done.append(name))
+    run(bus, go)
+    assert done == ['a1', 'b1', 'a2', 'b2', 'a3']
+
+
+def test_overdue_goes_first_but_not_before_input(bus, monkeypatch):
+    monkeypatch.setattr(config, 'I2C_DEADLINES', [10.0, 10.0, 0.0])
+    done = []
+    go = hold(bus)
+    bus.queue(SERVO_WRITE, 'servo', lambda: done.append('servo'))
+    bus.queue(LCD_WRITE, 'lcd', lambda: done.append('housekeeping'))
+    bus.queue(BUTTON_READ, 'io', lambda: done.append('input'))
+    run(bus, go)
+    assert done == ['input', 'housekeeping', 'servo']
+    assert bus.class_stats[i2c_bus.HOUSEKEEPING].overdue >= 1
+
+
+def test_a_waiting_write_is_replaced_in_place(bus):
+    done = []
+    go = hold(bus)
+    bus.queue(SERVO_WRITE, 'a', lambda: done.append('old'), key='k')
+    bus.queue(SERVO_WRITE, 'b', lambda: done.append('other'))
+    bus.queue(SERVO_WRITE, 'a', lambda: done.append('new'), key='k')
+    run(bus, go)
+    assert done == ['new', 'other']
+    assert bus.class_stats[i2c_bus.SERVO].replaced == 1
+    assert not bus.keyed
+
+
+def test_a_write_that_must_not_be_replaced(bus):
+    done = []
+    go = hold(bus)
+    bus.queue(SERVO_WRITE, 'a', lambda: done.append(1), key='k')
+    bus.queue(SERVO_WRITE, 'a', lambda: done.append(None), key='k', replace=False)
+    bus.queue(SERVO_WRITE, 'a', lambda: done.append(2), key='k')
+    run(bus, go)
+    assert done == [1, None, 2]
+
+
+def test_submit_is_not_replaced_and_gives_the_result(bus):
+    go = hold(bus)
+    done = []
+    bus.queue(SERVO_WRITE, 'a', lambda: done.append('queued'), key='k')
+    future = bus.submit(SERVO_WRITE, 'a', lambda: done.append('waited') or 'result', key='k')
+    bus.queue(SERVO_WRITE, 'a', lambda: done.append('later'), key='k')
+    run(bus, go)
+    assert future.result(5) == 'result'
+    assert done == ['queued', 'waited', 'later']
+
+
+def test_errors(bus, capsys):
+    def fail():
+        raise RuntimeError('broken')
+    future = bus.submit(BUTTON_READ, 'io', fail)
+    with pytest.raises(RuntimeError):
+        future.result(5)
+    bus.queue(LED_WRITE, 'io', fail)
+    bus.finish()
+    assert 'carrying on' in capsys.readouterr().out
+    # The worker is still going
+    assert bus.submit(BUTTON_READ, 'io', lambda: 7).result(5) == 7
+
+
+def test_drain_and_stats(bus):
+    go = hold(bus)
+    for i in range(3):
+        bus.queue(SERVO_WRITE, i, lambda: None)
+    stats = {s['priority']:s for s in bus.stats()}
+    assert stats['servo']['depth'] == 3
+    go.set()
+    bus.drain(i2c_bus.SERVO)
+    stats = {s['priority']:s for s in bus.stats()}
+    assert stats['servo']['depth'] == 0
+    assert stats['servo']['done'] == 3
+    assert stats['servo']['max_depth'] == 3
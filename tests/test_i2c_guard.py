@@ -0,0 +1,118 @@
+import errno
+
+import pytest
+
+import config
+import i2c_guard
+from i2c_guard import BoardGuard
+from i2c_stats import SERVO_WRITE, BUTTON_READ
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    monkeypatch.setattr(config, 'I2C_RETRIES', 2)
+    monkeypatch.setattr(config, 'I2C_BACKOFF', 0.0)
+    monkeypatch.setattr(config, 'I2C_MAX_BACKOFF', 0.0)
+    monkeypatch.setattr(config, 'I2C_ERROR_BUDGET', 3)
+    monkeypatch.setattr(config, 'I2C_ERROR_WINDOW', 10.0)
+    # No background prober
+    monkeypatch.setattr(i2c_guard.Prober, 'start', lambda: None)
+    monkeypatch.setattr(i2c_guard, 'guards', [])
+
+
+def failing(n, err=errno.EIO, result='ok'):
+    """ Gets a function that fails n times, then returns the result, and the list of calls. """
+    calls = []
+    def fn():
+        calls.append(1)
+        if len(calls) <= n:
+            raise OSError(err, 'failed')
+        return result
+    return fn, calls
+
+
+def test_transient_errors_are_retried():
+    guard = BoardGuard(0x40, 'test')
+    fn, calls = failing(2)
+    assert guard.call(SERVO_WRITE, fn) == 'ok'
+    assert len(calls) == 3
+    assert guard.retries == 2
+    assert guard.total_errors == 0
+
+
+def test_retries_run_out(capsys):
+    guard = BoardGuard(0x40, 'test')
+    fn, calls = failing(10)
+    assert guard.call(SERVO_WRITE, fn, default='default') == 'default'
+    assert len(calls) == config.I2C_RETRIES + 1
+    assert guard.total_errors == 1
+    assert 'ERROR: I2C error on test 0x40' in capsys.readouterr().out
+
+
+def test_other_errors_are_not_retried():
+    guard = BoardGuard(0x40, 'test')
+    fn, calls = failing(1, errno.ENODEV)
+    assert guard.call(SERVO_WRITE, fn) is None
+    assert len(calls) == 1
+    assert guard.retries == 0
+
+
+def test_quarantined_when_the_budget_is_used_up():
+    guard = BoardGuard(0x40, 'test')
+    fn, calls = failing(100, errno.ENODEV)
+    for i in range(config.I2C_ERROR_BUDGET - 1):
+        guard.call(SERVO_WRITE, fn)
+    assert not guard.quarantined
+    guard.call(SERVO_WRITE, fn)
+    assert guard.quarantined
+    assert i2c_guard.quarantined() == [guard]
+    # Now the board is left alone
+    n = len(calls)
+    assert guard.call(SERVO_WRITE, fn, default='skipped') == 'skipped'
+    assert len(calls) == n
+    assert guard.skipped == 1
+
+
+def test_old_errors_do_not_count(monkeypatch):
+    monkeypatch.setattr(config, 'I2C_ERROR_WINDOW', 0.0)
+    guard = BoardGuard(0x40, 'test')
+    fn, calls = failing(100, errno.ENODEV)
+    for i in range(config.I2C_ERROR_BUDGET * 2):
+        guard.call(SERVO_WRITE, fn)
+    assert not guard.quarantined
+    assert guard.total_errors == config.I2C_ERROR_BUDGET * 2
+
+
+def test_released_when_it_responds():
+    responding = False
+    def probe():
+        if not responding:
+            raise OSError(errno.EIO, 'no')
+    guard = BoardGuard(0x40, 'test', probe)
+    guard.quarantine()
+    assert not guard.try_probe()
+    assert guard.total_errors == 0
+    responding = True
+    assert guard.try_probe()
+    guard.release()
+    assert not guard.quarantined
+    assert not guard.errors
+    assert i2c_guard.recovered.get_nowait() is guard
+    assert guard.call(BUTTON_READ, lambda: 5) == 5
+
+
+def test_write_and_send():
+    class Device:
+        value = None
+    device = Device()
+    guard = BoardGuard(0x20, 'test')
+    done = []
+    assert guard.write(SERVO_WRITE, device, 'value', 90, done=lambda: done.append(1))
+    assert device.value == 90
+    assert done == [1]
+    assert guard.write(SERVO_WRITE, device, 'value', 45, wait=True)
+    assert device.value == 45
+    guard.quarantine()
+    assert not guard.write(SERVO_WRITE, device, 'value', 0, done=lambda: done.append(2))
+    assert device.value == 45
+    assert done == [1]
@@ -0,0 +1,55 @@
+from search import SearchIndex, tokenise
+
+
+def test_tokenise_splits_on_punctuation():
+    assert tokenise('St X-over 2/1') == {'st', 'x-over', 'x', 'over', '2/1', '2', '1'}
+
+
+def test_tokenise_keeps_ids_whole():
+    assert tokenise('2.5') == {'2.5'}
+
+
+def test_find_by_the_start_of_each_word():
+    index = SearchIndex()
+    index.add('a', ['FY-R Anti 3', '2.5'])
+    index.add('b', ['Anti Main', '2.6'])
+    assert index.find('anti') == {'a', 'b'}
+    assert index.find('anti fy') == {'a'}
+    assert index.find('ANT MA') == {'b'}
+    assert index.find('2.') == {'a', 'b'}
+    assert index.find('nti') == set()
+
+
+def test_nothing_matches_empty_text():
+    index = SearchIndex()
+    index.add('a', ['Anti'])
+    assert index.find('') == set()
+    assert index.find('   ') == set()
+
+
+def test_adding_again_replaces_the_tokens():
+    index = SearchIndex()
+    index.add('a', ['Old name'])
+    index.add('b', ['Old siding'])
+    index.add('a', ['New name'])
+    assert index.find('old') == {'b'}
+    assert index.find('new') == {'a'}
+    assert index.tokens == sorted(index.tokens)
+    assert 'siding' in index.tokens and 'new' in index.tokens
+
+
+def test_remove_drops_tokens_nothing_else_has():
+    index = SearchIndex()
+    index.add('a', ['Shared only_a'])
+    index.add('b', ['Shared'])
+    index.remove('a')
+    assert index.tokens == ['shared']
+    assert index.find('shared') == {'b'}
+    index.remove('a')   # Not there any more, so nothing happens
+    assert index.find('shared') == {'b'}
+
+
+def test_none_strings_are_skipped():
+    index = SearchIndex()
+    index.add('a', [None, '1.2'])
+    assert index.find('1.2') == {'a'}
@@ -0,0 +1,96 @@
+import struct
+
+import pytest
+
+import state_block
+from state_block import StateBlock, HEADER, SERVO, SEQ_OFFSET
+
+
+COUNTS = (3, 2, 4, 1, 2)
+
+
+def new_block():
+    buf = bytearray(state_block.size(*COUNTS))
+    return buf, StateBlock(buf, COUNTS)
+
+
+def sequence(buf):
+    return struct.unpack_from('<Q', buf, SEQ_OFFSET)[0]
+
+
+def test_offsets():
+    buf, block = new_block()
+    assert block.servos_at == HEADER.size
+    assert block.buttons_at == HEADER.size + 3 * SERVO.size
+    assert block.leds_at == block.buttons_at + 2
+    assert block.relays_at == block.leds_at + 4
+    assert block.flashers_at == block.relays_at + 1
+    assert block.end == block.flashers_at + 2 == len(buf)
+
+
+def test_writes_are_read_back():
+    buf, block = new_block()
+    block.set_servo(1, 45.0, 90.0, state_block.TURN_ON | state_block.MOVING)
+    block.set_button(1, True)
+    block.set_led(3, True)
+    block.set_relay(0, True)
+    block.set_flasher(1, True)
+    block.set_loop(42, 99.5)
+    block.set_power('battery', 8.25, -400.0)
+    state = block.snapshot()
+    assert state['servos'][1] == (45.0, 90.0, state_block.TURN_ON | state_block.MOVING)
+    assert state['servos'][0] == (0.0, 0.0, 0)
+    assert state['buttons'] == [0, 1]
+    assert state['leds'] == [0, 0, 0, 1]
+    assert state['relays'] == [1]
+    assert state['flashers'] == [0, 1]
+    assert state['loop_count'] == 42
+    assert state['loop_rate'] == 99.5
+    assert state['power_state'] == 'battery'
+    assert state['ups_voltage'] == 8.25
+    assert state['seq'] == sequence(buf)
+
+
+def test_each_write_moves_the_sequence_on_by_two():
+    buf, block = new_block()
+    before = sequence(buf)
+    block.set_led(0, True)
+    assert sequence(buf) == before + 2
+    assert block.sequence() % 2 == 0
+
+
+def test_a_reader_opens_an_existing_block():
+    buf, block = new_block()
+    block.set_servo(2, 10.0, 20.0, 0)
+    reader = StateBlock(buf)
+    assert reader.counts == COUNTS
+    assert reader.snapshot()['servos'][2] == (10.0, 20.0, 0)
+
+
+def test_not_a_block():
+    with pytest.raises(ValueError):
+        StateBlock(bytearray(state_block.size(*COUNTS)))
+
+
+def test_read_tries_again_if_written_meanwhile():
+    buf, block = new_block()
+    calls = []
+    def copy(b):
+        calls.append(1)
+        if len(calls) == 1:
+            # As if the writer got in while this was copying
+            block.set_led(0, True)
+        return b[block.leds_at]
+    seq, value = block.read(copy)
+    assert len(calls) == 2
+    assert value == 1
+    assert seq == sequence(buf)
+
+
+def test_read_gives_up_while_a_write_is_in_progress():
+    buf, block = new_block()
+    block.begin()       # The writer stalls half way
+    with pytest.raises(TimeoutError):
+        block.snapshot()
+    block.commit()
+    block.snapshot()
@@ -0,0 +1,329 @@
+"""
+A small web dashboard, for when ServoMaster is running without a monitor.
+
+Serves a page with the trackplan, the state of each point, button and LED, the UPS and
+buttons to change the points, using only the standard library. The page does not poll; changes
+are pushed to it with server-sent events, in the same form as streaming.py, and each
+change is encoded once however many browsers are watching.
+
+    /               the page
+    /trackplan.png  the static part of the trackplan, as drawn by StaticLayer; cached
+    /layout.json    where each point is drawn, in pixels, and the IDs of the buttons and LEDs
+    /events         the stream: a snapshot, then changes
+    /command        POST a command, as for the control socket, e.g. "3 on", but not exit
+
+Commands must be sent with the Content-Type COMMAND_TYPE, as the page does. A form cannot send
+that, and a script on another site cannot send it without asking first, which it is not allowed
+to, so other web pages the operator has open cannot change the points. Requests from another
+origin are refused anyway. By default the dashboard only listens on this machine (config.WEB_HOST).
+"""
+
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+KEEPALIVE = 15          # Seconds between comments on an idle stream, so proxies do not close it
+MAX_BACKLOG = 1000      # Changes waiting for a browser before giving up on it
+COMMAND_TYPE = 'text/x-servomaster-command'     # The Content-Type for /command
+
+
+class EventHub:
+    """ Keeps a queue for each browser watching, and adds each change to all of them. """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.lock = threading.Lock()
+        self.queues = set()
+
+    def subscribe(self):
+        """ Gets a queue for a new browser, starting with a snapshot. """
+        q = queue.SimpleQueue()
+        # Under the lock so nothing published can be missed, or come before the snapshot
+        with self.lock:
+            q.put(encode(self.snapshot()))
+            self.queues.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.queues.discard(q)
+
+    def publish(self, message):
+        data = encode(message)
+        with self.lock:
+            for q in self.queues:
+                q.put(data)
+
+    def close(self):
+        with self.lock:
+            for q in self.queues:
+                q.put(None)
+            self.queues = set()
+
+
+def encode(message):
+    return b'data: ' + json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n\n'
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        dashboard = self.server.dashboard
+        path = self.path.split('?')[0]
+        if path == '/':
+            self.reply(200, 'text/html; charset=utf-8', PAGE)
+        elif path == '/layout.json':
+            self.reply(200, 'application/json', json.dumps(dashboard.layout()).encode('utf-8'))
+        elif path == '/trackplan.png':
+            key, png = dashboard.trackplan()
+            etag = f'"{key}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.reply(304, None, b'', {'ETag':etag})
+            else:
+                self.reply(200, 'image/png', png, {'ETag':etag, 'Cache-Control':'no-cache'})
+        elif path == '/events':
+            self.stream()
+        else:
+            self.reply(404, 'text/plain', b'Not found')
+
+    def do_POST(self):
+        if self.path != '/command':
+            self.reply(404, 'text/plain', b'Not found')
+            return
+        if self.headers.get('Content-Type', '').split(';')[0].strip() != COMMAND_TYPE:
+            self.reply(415, 'text/plain', b'Unsupported content type')
+            return
+        origin = self.headers.get('Origin')
+        if origin and urlsplit(origin).netloc != self.headers.get('Host'):
+            self.reply(403, 'text/plain', b'Forbidden')
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        command = self.rfile.read(length).decode('utf-8', errors='replace')
+        try:
+            self.server.dashboard.execute([s.strip() for s in command.split(';') if s.strip()])
+        except ValueError as ex:
+            self.reply(400, 'text/plain', f'ERROR {ex}'.encode('utf-8'))
+        else:
+            self.reply(200, 'text/plain', b'OK')
+
+    def reply(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self):
+        hub = self.server.dashboard.hub
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        q = hub.subscribe()
+        try:
+            while True:
+                if q.qsize() > MAX_BACKLOG:
+                    print(f'WARNING: Browser at {self.client_address[0]} has fallen too far behind; dropping it.')
+                    return
+                try:
+                    data = q.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    data = b': keepalive\n\n'
+                if data is None:
+                    return
+                self.wfile.write(data)
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            hub.unsubscribe(q)
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        # Every request would be printed otherwise
+        pass
+
+
+class Dashboard:
+    """
+    The web server, on its own threads.
+    The functions give the state as a dictionary, where the points are drawn, the trackplan as
+    (key, PNG bytes), and do a list of commands, raising ValueError if any is bad or not allowed.
+    """
+    def __init__(self, host, port, snapshot, layout, trackplan, execute):
+        self.hub = EventHub(snapshot)
+        self.layout = layout
+        self.trackplan = trackplan
+        self.execute = execute
+        self.server = ThreadingHTTPServer((host, port), DashboardHandler)
+        self.server.daemon_threads = True
+        self.server.dashboard = self
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='web', daemon=True).start()
+
+    def stop(self):
+        self.hub.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def publish(self, message):
+        self.hub.publish(message)
+
+
+PAGE = b'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>ServoMaster</title>
+<style>
+body { font-family: sans-serif; margin: 0.5em; }
+#plan { position: relative; overflow: auto; }
+#plan img, #plan svg { position: absolute; left: 0; top: 0; }
+#plan line { cursor: pointer; }
+table { border-collapse: collapse; margin-top: 0.5em; }
+td, th { padding: 2px 8px; border-bottom: 1px solid #ddd; text-align: left; }
+tr.ON td.state { background: #cfc; }
+tr.OFF td.state { background: #fcc; }
+tr.moving td.state { background: #ffc; }
+#status { font-weight: bold; }
+.io span { display: inline-block; padding: 1px 4px; margin: 1px; border: 1px solid #ddd; }
+.io span.lit { background: #cfc; }
+</style>
+</head>
+<body>
+<div id="status">Connecting...</div>
+<div id="plan"><img id="trackplan" src="trackplan.png"><svg id="points"></svg></div>
+<input id="find" placeholder="Find"> <span id="error"></span>
+<table><thead><tr><th>ID</th><th>Description</th><th>State</th><th>Angle</th><th></th></tr></thead>
+<tbody id="servos"></tbody></table>
+<h4>Buttons</h4><div class="io" id="buttons"></div>
+<h4>LEDs</h4><div class="io" id="leds"></div>
+<script>
+let servos = [], layout = {}, colour = 'black';
+const ns = 'http://www.w3.org/2000/svg';
+
+function command(s) {
+  fetch('command', {method: 'POST', headers: {'Content-Type': 'text/x-servomaster-command'}, body: s}).then(r => r.text()).then(t => {
+    document.getElementById('error').textContent = t == 'OK' ? '' : t;
+  });
+}
+
+function state(s) {
+  return s.m ? 'moving' : s.c ? 'CENTRE' : s.on ? 'ON' : 'OFF';
+}
+
+function show(s) {
+  const row = document.getElementById('row' + s.i);
+  if (row) {
+    row.className = state(s);
+    row.querySelector('.state').textContent = state(s);
+    row.querySelector('.angle').textContent = Math.round(s.a) + '\\u00b0';
+  }
+  const lines = layout.points && layout.points[s.i];
+  if (lines) {
+    lines.main.setAttribute('stroke', !s.m && !s.c && !s.on ? colour : 'silver');
+    lines.branch.setAttribute('stroke', !s.m && !s.c && s.on ? colour : 'silver');
+  }
+}
+
+function line(coords, i) {
+  const el = document.createElementNS(ns, 'line');
+  ['x1', 'y1', 'x2', 'y2'].forEach((a, n) => el.setAttribute(a, coords[n]));
+  el.setAttribute('stroke-width', layout.width);
+  el.addEventListener('click', () => command(i + (servos[i].on ? ' off' : ' on')));
+  document.getElementById('points').appendChild(el);
+  return el;
+}
+
+function io(kind, values) {
+  const div = document.getElementById(kind);
+  div.innerHTML = '';
+  values.forEach((v, i) => {
+    const el = document.createElement('span');
+    el.id = kind + i;
+    el.textContent = layout[kind] ? layout[kind][i] : i;
+    div.appendChild(el);
+    light(kind, i, v);
+  });
+}
+
+function light(kind, i, v) {
+  const el = document.getElementById(kind + i);
+  if (el) el.className = v ? 'lit' : '';
+}
+
+function snapshot(m) {
+  servos = m.servos;
+  const body = document.getElementById('servos');
+  body.innerHTML = '';
+  for (const s of servos) {
+    const row = body.insertRow();
+    row.id = 'row' + s.i;
+    row.insertCell().textContent = s.id;
+    row.insertCell().textContent = s.desc;
+    row.insertCell().className = 'state';
+    row.insertCell().className = 'angle';
+    const cell = row.insertCell();
+    for (const action of ['on', 'off']) {
+      const button = document.createElement('button');
+      button.textContent = action;
+      button.onclick = () => command(s.i + ' ' + action);
+      cell.appendChild(button);
+    }
+  }
+  filter();
+  servos.forEach(show);
+  io('buttons', m.buttons);
+  io('leds', m.leds);
+  if (m.power) document.getElementById('status').textContent = m.power.text;
+}
+
+function filter() {
+  const words = document.getElementById('find').value.toLowerCase().split(/\\s+/).filter(w => w);
+  for (const s of servos) {
+    const text = (s.id + ' ' + s.desc).toLowerCase();
+    document.getElementById('row' + s.i).hidden = !words.every(w => text.includes(w));
+  }
+}
+document.getElementById('find').oninput = filter;
+
+fetch('layout.json').then(r => r.json()).then(data => {
+  const svg = document.getElementById('points');
+  svg.setAttribute('width', data.width_px);
+  svg.setAttribute('height', data.height_px);
+  document.getElementById('plan').style.height = data.height_px + 'px';
+  colour = data.colour;
+  layout.width = data.line_width;
+  layout.buttons = data.buttons;
+  layout.leds = data.leds;
+  layout.points = {};
+  for (const p of data.points) {
+    layout.points[p.i] = {main: line(p.main, p.i), branch: line(p.branch, p.i)};
+  }
+  servos.forEach(show);
+
+  const events = new EventSource('events');
+  events.onopen = () => { if (!servos.length) document.getElementById('status').textContent = 'Connected'; };
+  events.onerror = () => { document.getElementById('status').textContent = 'Connection lost; retrying...'; };
+  events.onmessage = e => {
+    const m = JSON.parse(e.data);
+    if (m.t == 'snapshot') snapshot(m);
+    else if (m.t == 's') { Object.assign(servos[m.i], m); show(servos[m.i]); }
+    else if (m.t == 'b') light('buttons', m.i, m.p);
+    else if (m.t == 'l') light('leds', m.i, m.v);
+    else if (m.t == 'p') document.getElementById('status').textContent = m.text;
+  };
+});
+</script>
+</body>
+</html>
+'''